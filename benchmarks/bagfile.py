@@ -0,0 +1,58 @@
+""" A writer of synthetic bag v2.0 files for the benchmarks.
+
+The chunks hold no messages; their data is left as a hole in a sparse file,
+so a bag of many gigabytes takes almost no disk space and no time to write,
+while its header, chunk headers and index look like those of rosbag.
+"""
+
+import struct
+from typing import List, Sequence
+
+
+def _header(**fields: bytes) -> bytes:
+    body = b"".join(struct.pack("<I", len(name) + 1 + len(value)) + name.encode() + b"=" + value
+                    for name, value in fields.items())
+    return struct.pack("<I", len(body)) + body
+
+
+def _record(data: bytes = b"", data_len: int = -1, **fields: bytes) -> bytes:
+    return _header(**fields) + struct.pack("<I", len(data) if data_len < 0 else data_len) + data
+
+
+def write_bag(path: str, topics: Sequence[str], chunks: int, chunk_bytes: int = 768 * 1024,
+              messages_per_chunk: int = 100, compression: str = "lz4", ratio: float = 0.5) -> None:
+    """ Writes a sparse bag with ``chunks`` chunks of ``chunk_bytes`` uncompressed bytes each,
+    the messages spread round robin over the topics.
+    """
+    compressed_bytes = int(chunk_bytes * ratio) if compression != "none" else chunk_bytes
+    with open(path, "wb") as f:
+        f.write(b"#ROSBAG V2.0\n")
+        header_pos = f.tell()
+        f.write(b"\0" * 4096)
+        chunk_infos: List[bytes] = []
+        for i in range(chunks):
+            chunk_pos = f.tell()
+            f.write(_header(op=b"\x05", compression=compression.encode(), size=struct.pack("<I", chunk_bytes)))
+            f.write(struct.pack("<I", compressed_bytes))
+            f.seek(compressed_bytes, 1)
+            counts = [messages_per_chunk // len(topics) + (1 if c < messages_per_chunk % len(topics) else 0)
+                      for c in range(len(topics))]
+            start = struct.pack("<II", 1700000000 + i, 0)
+            end = struct.pack("<II", 1700000000 + i, 999000000)
+            data = b"".join(struct.pack("<II", conn, count) for conn, count in enumerate(counts) if count)
+            chunk_infos.append(_record(data, op=b"\x06", ver=struct.pack("<I", 1), chunk_pos=struct.pack("<Q", chunk_pos),
+                                       start_time=start, end_time=end,
+                                       count=struct.pack("<I", len(data) // 8)))
+        index_pos = f.tell()
+        for conn, topic in enumerate(topics):
+            connection_header = _header(topic=topic.encode(), type=b"std_msgs/String",
+                                        md5sum=b"992ce8a1687cec8c8bd883ec73ca41d1")[4:]
+            f.write(_record(connection_header, op=b"\x07", conn=struct.pack("<I", conn), topic=topic.encode()))
+        for chunk_info in chunk_infos:
+            f.write(chunk_info)
+        f.seek(header_pos)
+        header = _header(op=b"\x03", index_pos=struct.pack("<Q", index_pos),
+                         conn_count=struct.pack("<I", len(topics)), chunk_count=struct.pack("<I", chunks))
+        # rosbag pads the bag header record to 4096 bytes, so it can be rewritten in place
+        padding = 4096 - len(header) - 4
+        f.write(header + struct.pack("<I", padding) + b" " * padding)
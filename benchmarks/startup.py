@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+""" Startup time of the headless path compared with the GUI path.
+
+Each path is started in a fresh interpreter several times and the median is reported:
+- headless: importing smartbagrec.headless, which is all ``bagrec --headless`` loads
+- gui import: importing smartbagrec.contents, which pulls in tkinter
+- gui first paint: building SmartBagRec until its window is painted (needs a display)
+
+It fails if the headless import takes more than ``--max-ratio`` of the GUI import,
+which catches a module-level import that drags the recording machinery into every sub-command.
+
+Usage:
+    python3 benchmarks/startup.py [--runs N] [--max-ratio R]
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+from argparse import ArgumentParser
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MAX_HEADLESS_RATIO = 0.5
+
+IMPORT_SNIPPET = """
+import sys, time
+t = time.perf_counter()
+import {module}
+print(time.perf_counter() - t)
+print("tkinter" in sys.modules, file=sys.stderr)
+"""
+
+PAINT_SNIPPET = """
+import time
+t = time.perf_counter()
+from smartbagrec.contents import SmartBagRec
+app = SmartBagRec("benchmark", t)
+def check():
+    if app.startup_latency:
+        print(app.startup_latency)
+        app.tk_widget.destroy()
+    else:
+        app.tk_widget.after(1, check)
+app.tk_widget.after(1, check)
+app()
+"""
+
+
+def run_python(snippet: str) -> subprocess.CompletedProcess:
+    env = dict(os.environ, PYTHONPATH=REPO_ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    return subprocess.run([sys.executable, "-c", snippet], capture_output=True, text=True, env=env, cwd=REPO_ROOT)
+
+
+def measure_import(module: str, runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        result = run_python(IMPORT_SNIPPET.format(module=module))
+        result.check_returncode()
+        times.append(float(result.stdout.split()[-1]))
+        if module == "smartbagrec.headless" and result.stderr.strip() != "False":
+            raise RuntimeError("smartbagrec.headless imported tkinter")
+    return statistics.median(times)
+
+
+def measure_first_paint(runs: int) -> float:
+    times = []
+    for _ in range(runs):
+        result = run_python(PAINT_SNIPPET)
+        result.check_returncode()
+        times.append(float(result.stdout.split()[-1]))
+    return statistics.median(times)
+
+
+def main() -> None:
+    parser = ArgumentParser("startup benchmark")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--max-ratio", type=float, default=MAX_HEADLESS_RATIO,
+                        help="largest allowed headless import time relative to the gui import")
+    args = parser.parse_args()
+
+    headless = measure_import("smartbagrec.headless", args.runs)
+    gui_import = measure_import("smartbagrec.contents", args.runs)
+    print(f"headless import:  {headless * 1000:8.1f} ms")
+    print(f"gui import:       {gui_import * 1000:8.1f} ms ({headless / gui_import:.0%} for headless)")
+    if os.environ.get("DISPLAY"):
+        gui_paint = measure_first_paint(args.runs)
+        print(f"gui first paint:  {gui_paint * 1000:8.1f} ms ({headless / gui_paint:.0%} for headless)")
+    else:
+        print("gui first paint:  skipped, no DISPLAY")
+    if headless / gui_import > args.max_ratio:
+        sys.exit(f"headless import takes {headless / gui_import:.0%} of the gui import, more than {args.max_ratio:.0%}")
+
+
+if __name__ == "__main__":
+    main()
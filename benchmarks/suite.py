@@ -0,0 +1,435 @@
+#!/usr/bin/env python3
+""" Benchmarks of smartbagrec's own hot paths, runnable without ROS.
+
+``benchmarks/fake_ros`` is put first on PATH, so ``rostopic``, ``rosbag`` and ``ros2`` are stand-ins
+that answer instantly and write bag files at a fixed rate. HOME points to a temporary
+directory, so the benchmarks neither read nor touch the real ``~/.config/smartbagrec``.
+
+Benchmarks:
+- gui_construction: building the main window with N cached topics (needs a display)
+- record_command: BagRecFrame.generate_rosbag_record_command with N selected topics (needs a display)
+- profile_save / profile_load / profile_load_legacy: one profile with N topics
+- profile_index_cold / profile_index_warm: listing a directory of profiles
+- recording_tick: what the recording window does every second, sampling and polling a session
+- recording_tick_telemetry: the same with telemetry, one tick per telemetry interval,
+  so that every tick writes a JSONL sample event and the Prometheus textfile
+- stop_latency: RecordingSession.shutdown, from the SIGINT to the recorder having exited
+  and its bag file checked, including up to 50 ms for the stand-in recorder to notice the signal
+- stop_latency_ros2: the same with ``ros2 bag record``, up to its metadata.yaml having been written
+- bag_info / bag_info_cached: reading the index of a sparse 4 GB bag with 5000 chunks and 50 topics
+  from benchmarks/bagfile.py, and listing a directory of such bags from the sidecar cache
+- snapshot_dump: from requesting a snapshot dump to its bag file having been written,
+  through ``rosbag_snapshot -t`` as rospy is not available to the stand-in
+- offload: copying a 32 MB bag to another directory with OffloadQueue, without a bandwidth cap,
+  every 8 MB chunk written, synced and read back
+- verify: checking a directory of four 32 MB bags against their SHA256SUMS manifest
+- control_start: the round trip of a start command over the control API's Unix socket,
+  from sending it to the answer that the recorder has been spawned
+- startup_headless / startup_gui: import time of the headless and GUI paths
+
+Every benchmark reports the median, the 90th percentile and the number of runs in ms.
+The results are written as JSON, and ``--compare`` prints the change against an earlier
+result file, exiting with 1 if a benchmark got slower than ``--threshold``.
+
+Usage:
+    python3 benchmarks/suite.py [--topics N] [--runs N] [--output PATH] [--compare PATH] [--only NAME ...]
+"""
+
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from typing import Callable, Dict, List, Optional
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FAKE_ROS_DIR = os.path.join(REPO_ROOT, "benchmarks", "fake_ros")
+RESULT_FORMAT = 1
+
+
+class Skipped(Exception):
+    """ Raised by a benchmark that cannot run here, e.g. without a display.
+    """
+
+
+def summarize(times: List[float], **params: object) -> Dict[str, object]:
+    ordered = sorted(times)
+    return {
+        "median_ms": statistics.median(ordered) * 1000,
+        "p90_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))] * 1000,
+        "runs": len(ordered),
+        "params": params,
+    }
+
+
+def time_calls(func: Callable[[], object], runs: int) -> List[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return times
+
+
+def require_display() -> None:
+    if not os.environ.get("DISPLAY"):
+        raise Skipped("no DISPLAY")
+
+
+def write_topic_cache(topics: List[str]) -> None:
+    from smartbagrec.discovery import save_cached_topics
+    save_cached_topics(tuple(topics))
+
+
+def fake_topics(count: int) -> List[str]:
+    return [f"/robot{i % 10}/sensor{i // 10 % 10}/topic{i}" for i in range(count)]
+
+
+def bench_gui_construction(topics: int, runs: int) -> Dict[str, object]:
+    require_display()
+    from smartbagrec.contents import SmartBagRec
+    write_topic_cache(fake_topics(topics))
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        app = SmartBagRec("benchmark")
+        app.tk_widget.update_idletasks()
+        times.append(time.perf_counter() - start)
+        app.tk_widget.destroy()
+    return summarize(times, topics=topics)
+
+
+def bench_record_command(topics: int, runs: int) -> Dict[str, object]:
+    require_display()
+    from smartbagrec.contents import SmartBagRec
+    write_topic_cache(fake_topics(topics))
+    app = SmartBagRec("benchmark")
+    try:
+        app.outer_frame.topic_list_frame.topic_list.select_all()
+        frame = app.outer_frame.bagrec_frame
+        return summarize(time_calls(frame.generate_rosbag_record_command, runs * 10), topics=topics)
+    finally:
+        app.tk_widget.destroy()
+
+
+def bench_profile_save(topics: int, runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.profile import Profile, save_profile
+    profile = Profile(fake_topics(topics), ["--split", "--duration", "60", "--lz4"], "prefix", "/tmp/bench")
+    path = os.path.join(work_dir, "save.profile")
+    return summarize(time_calls(lambda: save_profile(path, profile), runs * 10), topics=topics)
+
+
+def bench_profile_load(topics: int, runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.profile import Profile, load_profile, save_profile
+    path = os.path.join(work_dir, "load.profile")
+    save_profile(path, Profile(fake_topics(topics), ["--split", "--duration", "60"], "prefix", "/tmp/bench"))
+    return summarize(time_calls(lambda: load_profile(path), runs * 10), topics=topics)
+
+
+def bench_profile_load_legacy(topics: int, runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.profile import load_profile
+    path = os.path.join(work_dir, "legacy.profile")
+    with open(path, "w") as f:
+        f.write(" ".join(["rosbag", "record", "--split", "--duration", "60"] + fake_topics(topics)) + "\n")
+    return summarize(time_calls(lambda: load_profile(path), runs * 10), topics=topics)
+
+
+def make_profile_dir(work_dir: str, count: int) -> str:
+    from smartbagrec.profile import Profile, save_profile
+    directory = tempfile.mkdtemp(prefix="profiles_", dir=work_dir)
+    for i in range(count):
+        save_profile(os.path.join(directory, f"profile{i}.profile"),
+                     Profile(fake_topics(20), [], description=f"profile {i}"))
+    return directory
+
+
+def bench_profile_index_cold(runs: int, work_dir: str, count: int = 300) -> Dict[str, object]:
+    from smartbagrec.profile import INDEX_FILE, ProfileIndex
+    directory = make_profile_dir(work_dir, count)
+
+    def list_cold() -> None:
+        index_path = os.path.join(directory, INDEX_FILE)
+        if os.path.exists(index_path):
+            os.remove(index_path)
+        ProfileIndex(directory).list()
+
+    return summarize(time_calls(list_cold, runs), profiles=count)
+
+
+def bench_profile_index_warm(runs: int, work_dir: str, count: int = 300) -> Dict[str, object]:
+    from smartbagrec.profile import ProfileIndex
+    directory = make_profile_dir(work_dir, count)
+    ProfileIndex(directory).list()
+    return summarize(time_calls(lambda: ProfileIndex(directory).list(), runs), profiles=count)
+
+
+def wait_for_active_file(directory: str, timeout: float = 5.0, suffix: str = ".bag.active") -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if os.path.isdir(directory) and any(name.endswith(suffix) for name in os.listdir(directory)):
+            return
+        time.sleep(0.01)
+    raise RuntimeError("the fake recorder did not start writing")
+
+
+def bench_recording_tick(runs: int, work_dir: str, shards: int = 4, telemetry: bool = False) -> Dict[str, object]:
+    from smartbagrec.headless import format_status
+    from smartbagrec.session import RecordingSession
+    from smartbagrec.telemetry import MIN_TELEMETRY_INTERVAL_SEC, TelemetrySettings
+    directory = tempfile.mkdtemp(prefix="tick_", dir=work_dir)
+    options = ["rosbag", "record", "--split", "--duration", "0.2", "-o", os.path.join(directory, "bench")]
+    settings = None
+    if telemetry:
+        settings = TelemetrySettings(os.path.join(directory, "events.jsonl"), os.path.join(directory, "bench.prom"),
+                                     MIN_TELEMETRY_INTERVAL_SEC)
+    session = RecordingSession(options, [[f"/topic{i}"] for i in range(shards)], telemetry_settings=settings)
+    try:
+        wait_for_active_file(directory)
+        time.sleep(1.0)  # let a few splits finish, so the monitor has files to track
+        if not telemetry:
+            return summarize(time_calls(lambda: format_status(session), runs * 10), shards=shards)
+        times = []
+        for _ in range(runs * 2):
+            # one tick per interval, so that every tick writes a sample event and the textfile
+            time.sleep(MIN_TELEMETRY_INTERVAL_SEC)
+            start = time.perf_counter()
+            format_status(session)
+            times.append(time.perf_counter() - start)
+        return summarize(times, shards=shards, telemetry=True)
+    finally:
+        session.shutdown()
+
+
+def bench_stop_latency(runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.session import RecordingSession
+    times = []
+    for i in range(runs):
+        directory = tempfile.mkdtemp(prefix="stop_", dir=work_dir)
+        session = RecordingSession(["rosbag", "record", "-O", os.path.join(directory, "bench.bag")], [["/topic"]])
+        wait_for_active_file(directory)
+        report = session.shutdown()
+        if not report.finalized:
+            raise RuntimeError("the fake recorder did not finalize its bag file")
+        times.append(report.latency)
+    return summarize(times)
+
+
+def bench_stop_latency_ros2(runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.session import RecordingSession
+    times = []
+    for i in range(runs):
+        directory = os.path.join(tempfile.mkdtemp(prefix="stop_ros2_", dir=work_dir), "bench")
+        session = RecordingSession(["ros2", "bag", "record", "-o", directory], [["/topic"]])
+        wait_for_active_file(directory, suffix=".mcap")
+        report = session.shutdown()
+        if not report.finalized:
+            raise RuntimeError("the fake recorder did not write its metadata.yaml")
+        times.append(report.latency)
+    return summarize(times)
+
+
+def bench_bag_info(runs: int, work_dir: str) -> Dict[str, object]:
+    from bagfile import write_bag
+    from smartbagrec.baginfo import read_bag_info
+    path = os.path.join(tempfile.mkdtemp(prefix="baginfo_", dir=work_dir), "large.bag")
+    write_bag(path, [f"/topic{i}" for i in range(50)], 5000, 768 * 1024)
+    return summarize(time_calls(lambda: read_bag_info(path), runs), chunks=5000, topics=50)
+
+
+def bench_bag_info_cached(runs: int, work_dir: str, count: int = 20) -> Dict[str, object]:
+    from bagfile import write_bag
+    from smartbagrec.baginfo import BagInfoCache
+    directory = tempfile.mkdtemp(prefix="baginfo_", dir=work_dir)
+    for i in range(count):
+        write_bag(os.path.join(directory, f"bag{i}.bag"), ["/topic0", "/topic1"], 100)
+    BagInfoCache(directory).list()
+    return summarize(time_calls(lambda: BagInfoCache(directory).list(), runs), bags=count)
+
+
+def bench_snapshot_dump(runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.snapshot import SnapshotSession, SnapshotSettings
+    directory = tempfile.mkdtemp(prefix="snapshot_", dir=work_dir)
+    session = SnapshotSession(SnapshotSettings(60.0, 8.0), ["rosbag", "record", "-o", os.path.join(directory, "bench")],
+                              ["/topic0", "/topic1"])
+    try:
+        for _ in range(runs):
+            session.dump()
+        while session.pending:
+            time.sleep(0.001)
+        dumps = session.dumps
+        if not all(dump.ok for dump in dumps):
+            raise RuntimeError("a snapshot dump failed")
+        # requested back to back, so the time of each dump is how much later it finished than the one before
+        finished = [dump.requested + dump.latency for dump in dumps]
+        return summarize([dumps[0].latency] + [b - a for a, b in zip(finished, finished[1:])])
+    finally:
+        session.shutdown()
+
+
+def bench_offload(runs: int, work_dir: str, size_mb: int = 32) -> Dict[str, object]:
+    from smartbagrec.offload import OffloadQueue, OffloadSettings
+    directory = tempfile.mkdtemp(prefix="offload_", dir=work_dir)
+    source = os.path.join(directory, "bench.bag")
+    with open(source, "wb") as f:
+        f.write(os.urandom(size_mb * 1024 ** 2))
+
+    def offload() -> None:
+        queue = OffloadQueue(OffloadSettings(tempfile.mkdtemp(prefix="archive_", dir=directory), None, None))
+        queue.submit(source)
+        while not queue.idle:
+            time.sleep(0.001)
+        if queue.status().failed:
+            raise RuntimeError("the offload failed")
+        queue.shutdown()
+
+    return summarize(time_calls(offload, runs), size_mb=size_mb)
+
+
+def bench_verify(runs: int, work_dir: str, count: int = 4, size_mb: int = 32) -> Dict[str, object]:
+    from smartbagrec.checksum import ChecksumSettings, VerifyJob, write_manifest
+    directory = tempfile.mkdtemp(prefix="verify_", dir=work_dir)
+    for i in range(count):
+        with open(os.path.join(directory, f"bag{i}.bag"), "wb") as f:
+            f.write(os.urandom(size_mb * 1024 ** 2))
+    write_manifest(directory, ChecksumSettings())
+
+    def verify() -> None:
+        if not all(result.state == "ok" for result in VerifyJob(directory).run()):
+            raise RuntimeError("the verification failed")
+
+    return summarize(time_calls(verify, runs), bags=count, size_mb=size_mb)
+
+
+def bench_control_start(runs: int, work_dir: str) -> Dict[str, object]:
+    from smartbagrec.control import ControlClient, ControlServer
+    from smartbagrec.manager import SessionManager
+    directory = tempfile.mkdtemp(prefix="control_", dir=work_dir)
+    manager = SessionManager()
+    server = ControlServer(manager, os.path.join(directory, "control.sock"))
+    server.start_in_thread()
+    client = ControlClient(os.path.join(directory, "control.sock"))
+    times = []
+    try:
+        for i in range(runs):
+            start = time.perf_counter()
+            response = client.request({"cmd": "start", "topics": ["/topic0", "/topic1"],
+                                       "output": os.path.join(directory, f"run{i}", "bench")})
+            times.append(time.perf_counter() - start)
+            if not response["ok"]:
+                raise RuntimeError(response["error"])
+            client.request({"cmd": "stop", "session": response["session"]})
+    finally:
+        client.close()
+        server.close()
+        manager.shutdown()
+    return summarize(times)
+
+
+def bench_startup(module: str, runs: int) -> Dict[str, object]:
+    from startup import measure_import
+    return summarize([measure_import(module, 1) for _ in range(runs)], module=module)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO_ROOT)
+    except OSError:
+        return None
+    return result.stdout.strip() or None
+
+
+def compare(results: Dict[str, Dict[str, object]], base_path: str, threshold: float) -> bool:
+    """ Prints the change of every benchmark against an earlier result file, returning False on a regression.
+    """
+    with open(base_path, "r") as f:
+        base = json.load(f)["results"]
+    ok = True
+    print(f"\ncompared with {base_path}:")
+    for name, result in results.items():
+        old = base.get(name, {})
+        if "median_ms" not in result or "median_ms" not in old:
+            continue
+        ratio = result["median_ms"] / old["median_ms"] if old["median_ms"] else float("inf")
+        mark = ""
+        if ratio > threshold:
+            mark = "  <-- slower"
+            ok = False
+        print(f"  {name:24s} {old['median_ms']:10.3f} -> {result['median_ms']:10.3f} ms  x{ratio:.2f}{mark}")
+    return ok
+
+
+def main() -> None:
+    parser = ArgumentParser("smartbagrec benchmark suite")
+    parser.add_argument("--topics", type=int, default=2000, help="Number of topics (Default: 2000)")
+    parser.add_argument("--runs", type=int, default=10, help="Runs of each benchmark (Default: 10)")
+    parser.add_argument("--output", default="bench_results.json", help="Result file (Default: bench_results.json)")
+    parser.add_argument("--compare", metavar="PATH", help="Earlier result file to compare with")
+    parser.add_argument("--threshold", type=float, default=1.2,
+                        help="Slowdown ratio reported as a regression by --compare (Default: 1.2)")
+    parser.add_argument("--only", nargs="+", metavar="NAME", help="Run only these benchmarks")
+    args = parser.parse_args()
+
+    # before smartbagrec is imported, because the config directory is derived from HOME at import
+    work_dir = tempfile.mkdtemp(prefix="smartbagrec_bench_")
+    os.environ["HOME"] = work_dir
+    os.environ["PATH"] = FAKE_ROS_DIR + os.pathsep + os.environ.get("PATH", "")
+    os.environ["FAKE_TOPIC_COUNT"] = str(args.topics)
+    sys.path.insert(0, REPO_ROOT)
+    sys.path.insert(0, os.path.join(REPO_ROOT, "benchmarks"))
+
+    benchmarks: Dict[str, Callable[[], Dict[str, object]]] = {
+        "gui_construction": lambda: bench_gui_construction(args.topics, args.runs),
+        "record_command": lambda: bench_record_command(args.topics, args.runs),
+        "profile_save": lambda: bench_profile_save(args.topics, args.runs, work_dir),
+        "profile_load": lambda: bench_profile_load(args.topics, args.runs, work_dir),
+        "profile_load_legacy": lambda: bench_profile_load_legacy(args.topics, args.runs, work_dir),
+        "profile_index_cold": lambda: bench_profile_index_cold(args.runs, work_dir),
+        "profile_index_warm": lambda: bench_profile_index_warm(args.runs, work_dir),
+        "recording_tick": lambda: bench_recording_tick(args.runs, work_dir),
+        "recording_tick_telemetry": lambda: bench_recording_tick(args.runs, work_dir, telemetry=True),
+        "stop_latency": lambda: bench_stop_latency(args.runs, work_dir),
+        "stop_latency_ros2": lambda: bench_stop_latency_ros2(args.runs, work_dir),
+        "bag_info": lambda: bench_bag_info(args.runs, work_dir),
+        "bag_info_cached": lambda: bench_bag_info_cached(args.runs, work_dir),
+        "snapshot_dump": lambda: bench_snapshot_dump(args.runs, work_dir),
+        "offload": lambda: bench_offload(args.runs, work_dir),
+        "verify": lambda: bench_verify(args.runs, work_dir),
+        "control_start": lambda: bench_control_start(args.runs, work_dir),
+        "startup_headless": lambda: bench_startup("smartbagrec.headless", args.runs),
+        "startup_gui": lambda: bench_startup("smartbagrec.contents", args.runs),
+    }
+    results: Dict[str, Dict[str, object]] = {}
+    for name, bench in benchmarks.items():
+        if args.only and name not in args.only:
+            continue
+        try:
+            result = bench()
+        except Skipped as e:
+            results[name] = {"skipped": str(e)}
+            print(f"{name:24s} skipped: {e}")
+            continue
+        results[name] = result
+        print(f"{name:24s} median {result['median_ms']:10.3f} ms  p90 {result['p90_ms']:10.3f} ms")
+
+    with open(args.output, "w") as f:
+        json.dump({
+            "format": RESULT_FORMAT,
+            "revision": git_revision(),
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "results": results,
+        }, f, indent=2)
+        f.write("\n")
+    print(f"results written to {args.output}")
+
+    if args.compare and not compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
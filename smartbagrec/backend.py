@@ -0,0 +1,251 @@
+""" Recorder backends: what differs between recording with ROS 1 and with ROS 2.
+
+A backend knows the tools of one ROS version: how topics are listed and measured,
+how a record command line is split into options and topics and spread over shards,
+how its recorder is stopped, and where the recorder writes its files.
+The backend of a command line is told by its first words, so a session needs no other hint.
+
+``rosbag record`` writes ``.bag`` files next to each other, while ``ros2 bag record`` writes a
+bag directory holding ``<name>_<n>.mcap`` splits and a ``metadata.yaml``. ROS 2 has no
+timestamped prefix of its own, so ``--output-prefix`` is resolved to ``-o <prefix>_<timestamp>``
+before the recorder is started.
+"""
+
+from __future__ import annotations
+
+import os
+import time
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+from .output import ROS2_TIMESTAMP_FORMAT, BagDirectorySpec, OutputSpec, parse_output_spec
+
+ROS1 = "ros1"
+ROS2 = "ros2"
+BACKEND_NAMES = (ROS1, ROS2)
+ROS2_STORAGES = ("mcap", "sqlite3")
+# the MCAP writer presets of rosbag2; the zstd ones compress each chunk as it is written
+MCAP_PRESETS = ("none", "fastwrite", "zstd_fast", "zstd_small")
+DEFAULT_MCAP_PRESET = "zstd_fast"
+
+
+class RecorderBackend:
+    """ The tools of one ROS version.
+
+    Attributes:
+        name (str): One of BACKEND_NAMES
+        record_prefix (List[str]): The command that records, without options
+        list_command (List[str]): The command printing the topic names, one per line
+        bandwidth_command (List[str]): The command measuring a topic, given the topic as its last argument
+        options_with_value (FrozenSet[str]): The record options that take a value
+        prefix_options (Tuple[str, ...]): The record options naming the output by a prefix and a timestamp
+        name_options (Tuple[str, ...]): The record options naming the output exactly
+        signal_group (bool): Whether stopping signals the whole process group of the recorder,
+            rather than the recorder process alone
+    """
+
+    name: str
+    record_prefix: List[str]
+    list_command: List[str]
+    bandwidth_command: List[str]
+    options_with_value: FrozenSet[str]
+    prefix_options: Tuple[str, ...]
+    name_options: Tuple[str, ...]
+    signal_group: bool
+
+    def split_command(self, command: Sequence[str]) -> Tuple[List[str], List[str]]:
+        """ Splits a command line into the options part, including the record command, and the topics.
+        """
+        options = list(self.record_prefix)
+        topics = []
+        args = list(command[len(self.record_prefix):])
+        i = 0
+        while i < len(args):
+            if args[i].startswith("-"):
+                options.append(args[i])
+                if args[i] in self.options_with_value and i + 1 < len(args):
+                    options.append(args[i + 1])
+                    i += 1
+            else:
+                topics.append(args[i])
+            i += 1
+        return options, topics
+
+    def output_arguments(self, save_mode: str, output: str) -> List[str]:
+        """ The options naming the output for a save mode of a profile.
+        """
+        if save_mode == "prefix":
+            return [self.prefix_options[0], output]
+        if save_mode == "file_path":
+            return [self.name_options[0], output]
+        return []
+
+    def parse_output_arguments(self, options: Sequence[str]) -> Tuple[str, str, List[str]]:
+        """ Reads the save mode and the output from options without the record command.
+
+        Returns:
+            Tuple[str, str, List[str]]: The save mode, the output and the other options
+        """
+        save_mode = "current_dir"
+        output = ""
+        remaining = []
+        i = 0
+        while i < len(options):
+            if options[i] in self.prefix_options + self.name_options and i + 1 < len(options):
+                save_mode = "prefix" if options[i] in self.prefix_options else "file_path"
+                output = options[i + 1]
+                i += 2
+                continue
+            remaining.append(options[i])
+            i += 1
+        return save_mode, output, remaining
+
+    def strip_output_options(self, options: Sequence[str]) -> List[str]:
+        """ Removes the options naming the output, and their values, from the options.
+        """
+        stripped = []
+        skip = False
+        for arg in options:
+            if skip:
+                skip = False
+            elif arg in self.prefix_options + self.name_options:
+                skip = True
+            else:
+                stripped.append(arg)
+        return stripped
+
+    def output_spec(self, command: Sequence[str], started: Optional[float] = None) -> OutputSpec:
+        """ Where the recorder started with the command line writes its files.
+        """
+        raise NotImplementedError
+
+    def shard_commands(self, options: Sequence[str], shards: Sequence[Sequence[str]],
+                       started: float) -> List[List[str]]:
+        """ Builds one command line per shard, each writing its own files.
+        """
+        raise NotImplementedError
+
+
+class Ros1Backend(RecorderBackend):
+    """ ``rosbag record``, which ignores SIGINT itself and leaves it to its ``record`` child.
+    """
+
+    def __init__(self) -> None:
+        self.name = ROS1
+        self.record_prefix = ["rosbag", "record"]
+        self.list_command = ["rostopic", "list"]
+        self.bandwidth_command = ["rostopic", "bw"]
+        self.options_with_value = frozenset({
+            "-o", "--output-prefix", "-O", "--output-name", "--size", "--duration", "--max-splits",
+            "-b", "--buffsize", "--chunksize", "-l", "--limit", "--node", "-x", "--exclude",
+        })
+        self.prefix_options = ("-o", "--output-prefix")
+        self.name_options = ("-O", "--output-name")
+        self.signal_group = True
+
+    def output_spec(self, command: Sequence[str], started: Optional[float] = None) -> OutputSpec:
+        return parse_output_spec(list(command), started)
+
+    def shard_commands(self, options: Sequence[str], shards: Sequence[Sequence[str]],
+                       started: float) -> List[List[str]]:
+        """ A single shard is recorded with the options as they are.
+        Several shards each get their own -O name derived from the shared, timestamped base path.
+        """
+        if len(shards) == 1:
+            return [list(options) + list(shards[0])]
+        spec = parse_output_spec(list(options), started)
+        base = os.path.join(spec.directory, spec.base_name)
+        common = self.strip_output_options(options)
+        return [common + ["-O", f"{base}_shard{i}.bag"] + list(topics) for i, topics in enumerate(shards)]
+
+
+class Ros2Backend(RecorderBackend):
+    """ ``ros2 bag record``, which handles SIGINT itself and writes ``metadata.yaml`` when it exits.
+    """
+
+    def __init__(self) -> None:
+        self.name = ROS2
+        self.record_prefix = ["ros2", "bag", "record"]
+        self.list_command = ["ros2", "topic", "list"]
+        self.bandwidth_command = ["ros2", "topic", "bw"]
+        self.options_with_value = frozenset({
+            "-o", "--output", "--output-prefix", "-s", "--storage", "-f", "--serialization-format",
+            "-b", "--max-bag-size", "-d", "--max-bag-duration", "--max-cache-size",
+            "--storage-preset-profile", "--storage-config-file", "--compression-mode", "--compression-format",
+            "--compression-queue-size", "--compression-threads", "-e", "--regex", "-x", "--exclude",
+            "--qos-profile-overrides-path", "-p", "--polling-interval", "--node-name",
+        })
+        self.prefix_options = ("--output-prefix",)
+        self.name_options = ("-o", "--output")
+        self.signal_group = False
+
+    def bag_directory(self, options: Sequence[str], started: float) -> str:
+        """ The bag directory the options name, with a prefix resolved against the start time.
+        """
+        save_mode, output, _ = self.parse_output_arguments(options)
+        if save_mode == "file_path":
+            return os.path.abspath(output)
+        timestamp = time.strftime(ROS2_TIMESTAMP_FORMAT, time.localtime(started))
+        return os.path.abspath(f"{output}_{timestamp}" if save_mode == "prefix" else f"rosbag2_{timestamp}")
+
+    def output_spec(self, command: Sequence[str], started: Optional[float] = None) -> OutputSpec:
+        started = time.time() if started is None else started
+        return BagDirectorySpec(self.bag_directory(command, started), started)
+
+    def shard_commands(self, options: Sequence[str], shards: Sequence[Sequence[str]],
+                       started: float) -> List[List[str]]:
+        """ Every shard gets an explicit -o, since ``ros2 bag record`` refuses a directory that exists
+        and several shards started within a second would otherwise pick the same default name.
+        """
+        directory = self.bag_directory(options, started)
+        common = self.strip_output_options(options)
+        if len(shards) == 1:
+            return [common + ["-o", directory] + list(shards[0])]
+        return [common + ["-o", f"{directory}_shard{i}"] + list(topics) for i, topics in enumerate(shards)]
+
+
+BACKENDS: Dict[str, RecorderBackend] = {ROS1: Ros1Backend(), ROS2: Ros2Backend()}
+
+
+def get_backend(name: str) -> RecorderBackend:
+    """
+    Raises:
+        ValueError: If there is no backend of that name
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError("Unknown recorder backend: " + name)
+
+
+def backend_of(command: Sequence[str]) -> RecorderBackend:
+    """ The backend whose record command the command line starts with.
+
+    Raises:
+        ValueError: If it is not a record command of any backend
+    """
+    for backend in BACKENDS.values():
+        if list(command[:len(backend.record_prefix)]) == backend.record_prefix:
+            return backend
+    raise ValueError("Not a record command: " + " ".join(command))
+
+
+def default_backend_name() -> str:
+    """ The backend of the ROS environment that has been sourced, as told by $ROS_VERSION.
+    """
+    return ROS2 if os.environ.get("ROS_VERSION") == "2" else ROS1
+
+
+def ros2_storage_options(storage: str = "mcap", preset: Optional[str] = DEFAULT_MCAP_PRESET) -> List[str]:
+    """ The ``ros2 bag record`` options selecting the storage plugin and, for MCAP, the writer preset.
+
+    Raises:
+        ValueError: If the storage or the preset is unknown
+    """
+    if storage not in ROS2_STORAGES:
+        raise ValueError("Unknown ROS 2 storage: " + storage)
+    options = ["-s", storage]
+    if storage == "mcap" and preset is not None and preset != "none":
+        if preset not in MCAP_PRESETS:
+            raise ValueError(f"Unknown MCAP storage preset: {preset} (one of {', '.join(MCAP_PRESETS)})")
+        options.extend(["--storage-preset-profile", preset])
+    return options
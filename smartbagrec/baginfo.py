@@ -0,0 +1,369 @@
+""" Summaries of bag files read straight from their index, without ``rosbag info``.
+
+A bag v2.0 file starts with a header record pointing at the index at its end:
+one connection record per topic connection, then one chunk info record per chunk
+with its time range and message count per connection. The file is memory-mapped
+and only the header and the index are read, so the cost does not grow with the
+size of the messages. The compression ratio needs the header of each chunk, which is
+scattered over the whole file, so it is estimated from at most ``MAX_SAMPLED_CHUNKS``
+chunks spread evenly over the file.
+
+The summaries of a directory are cached in a sidecar file by file mtime and size,
+like the profile index, and bags that changed are read by a pool of processes.
+"""
+
+from __future__ import annotations
+
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from .monitor import format_bytes, format_duration
+
+MAGIC = b"#ROSBAG V2.0\n"
+OP_CHUNK = 0x05
+OP_CHUNK_INFO = 0x06
+OP_CONNECTION = 0x07
+OP_BAG_HEADER = 0x03
+MAX_SAMPLED_CHUNKS = 64
+SIDECAR_FILE = ".smartbagrec_baginfo.json"
+# bumped whenever the cached fields change, so older sidecars are read again
+SIDECAR_FORMAT = 1
+
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+_TIME = struct.Struct("<II")
+
+
+class BagFormatError(ValueError):
+    """ Raised for files that are not indexed bag v2.0 files.
+    """
+
+
+class TopicInfo:
+    """ What a bag holds of one topic.
+
+    Attributes:
+        topic (str): The topic name
+        type (str): The message type
+        count (int): The number of messages
+    """
+
+    topic: str
+    type: str
+    count: int
+
+    def __init__(self, topic: str, type: str, count: int) -> None:
+        self.topic = topic
+        self.type = type
+        self.count = count
+
+
+class BagInfo:
+    """ The summary of one bag file.
+
+    Attributes:
+        path (str): The bag file
+        size (int): Its size in bytes
+        start (float): The time of the first message, in seconds
+        end (float): The time of the last message, in seconds
+        message_count (int): The number of messages of all topics
+        chunk_count (int): The number of chunks
+        compression (str): "none", "bz2", "lz4" or "mixed", from the sampled chunks
+        ratio (Optional[float]): Compressed size divided by uncompressed size of the sampled chunks,
+            or None if the bag has no chunks
+        topics (List[TopicInfo]): The topics, sorted by name
+    """
+
+    path: str
+    size: int
+    start: float
+    end: float
+    message_count: int
+    chunk_count: int
+    compression: str
+    ratio: Optional[float]
+    topics: List[TopicInfo]
+
+    def __init__(self, path: str, size: int, start: float, end: float, message_count: int, chunk_count: int,
+                 compression: str, ratio: Optional[float], topics: List[TopicInfo]) -> None:
+        self.path = path
+        self.size = size
+        self.start = start
+        self.end = end
+        self.message_count = message_count
+        self.chunk_count = chunk_count
+        self.compression = compression
+        self.ratio = ratio
+        self.topics = topics
+
+    @property
+    def duration(self) -> float:
+        return max(0.0, self.end - self.start)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "size": self.size,
+            "start": self.start,
+            "end": self.end,
+            "message_count": self.message_count,
+            "chunk_count": self.chunk_count,
+            "compression": self.compression,
+            "ratio": self.ratio,
+            "topics": [[topic.topic, topic.type, topic.count] for topic in self.topics],
+        }
+
+    @classmethod
+    def from_dict(cls, path: str, data: Dict[str, Any]) -> BagInfo:
+        return cls(path, int(data["size"]), float(data["start"]), float(data["end"]), int(data["message_count"]),
+                   int(data["chunk_count"]), str(data["compression"]), data.get("ratio"),
+                   [TopicInfo(str(topic), str(type), int(count)) for topic, type, count in data["topics"]])
+
+
+def read_bag_info(path: str, max_sampled_chunks: int = MAX_SAMPLED_CHUNKS) -> BagInfo:
+    """ Reads the summary of a bag file from its header and index.
+
+    Raises:
+        BagFormatError: If the file is not a bag v2.0 file or has no index, e.g. a ``.bag.active`` file
+        OSError: If the file cannot be read
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size < len(MAGIC):
+            raise BagFormatError("too short to be a bag file")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if mm[:len(MAGIC)] != MAGIC:
+                raise BagFormatError("not a bag v2.0 file")
+            try:
+                fields, _, _, _ = _read_record(mm, len(MAGIC))
+                if _op(fields) != OP_BAG_HEADER:
+                    raise BagFormatError("no bag header record")
+                index_pos = _UINT64.unpack(fields[b"index_pos"])[0]
+                if index_pos == 0 or index_pos >= size:
+                    raise BagFormatError("not indexed; run rosbag reindex")
+                if hasattr(mm, "madvise"):
+                    # the index is read front to back, so let the kernel read ahead
+                    start_page = index_pos - index_pos % mmap.PAGESIZE
+                    mm.madvise(mmap.MADV_WILLNEED, start_page, size - start_page)
+                return _read_index(mm, path, size, index_pos, max_sampled_chunks)
+            except (KeyError, struct.error) as e:
+                raise BagFormatError(f"malformed record: {e}") from e
+
+
+def _read_index(mm: mmap.mmap, path: str, size: int, index_pos: int, max_sampled_chunks: int) -> BagInfo:
+    connections: Dict[int, Tuple[str, str]] = {}
+    # the message counts of all chunks with the same connections, in one array, so they are summed in C
+    layouts: Dict[bytes, array] = {}
+    chunk_positions: List[int] = []
+    start: Optional[float] = None
+    end: Optional[float] = None
+    pos = index_pos
+    while pos < size:
+        fields, data_pos, data_len, pos = _read_record(mm, pos)
+        op = _op(fields)
+        if op == OP_CONNECTION:
+            conn = _UINT32.unpack(fields[b"conn"])[0]
+            connection_header = _read_fields(mm, data_pos, data_pos + data_len)
+            connections[conn] = (fields[b"topic"].decode("utf-8", errors="replace"),
+                                 connection_header.get(b"type", b"").decode("utf-8", errors="replace"))
+        elif op == OP_CHUNK_INFO:
+            chunk_positions.append(_UINT64.unpack(fields[b"chunk_pos"])[0])
+            chunk_start = _to_seconds(fields[b"start_time"])
+            chunk_end = _to_seconds(fields[b"end_time"])
+            start = chunk_start if start is None else min(start, chunk_start)
+            end = chunk_end if end is None else max(end, chunk_end)
+            pairs = _uint32_array(mm[data_pos:data_pos + 8 * _UINT32.unpack(fields[b"count"])[0]])
+            layouts.setdefault(pairs[0::2].tobytes(), array("I")).extend(pairs[1::2])
+
+    counts: Dict[int, int] = {}
+    for layout, layout_counts in layouts.items():
+        conns = _uint32_array(layout, native=True)
+        for i, conn in enumerate(conns):
+            counts[conn] = counts.get(conn, 0) + sum(layout_counts[i::len(conns)])
+
+    by_topic: Dict[str, TopicInfo] = {}
+    for conn, (topic, type) in connections.items():
+        info = by_topic.setdefault(topic, TopicInfo(topic, type, 0))
+        info.count += counts.get(conn, 0)
+    compression, ratio = _sample_chunks(mm, chunk_positions, max_sampled_chunks)
+    return BagInfo(path, size, start or 0.0, end or 0.0, sum(counts.values()), len(chunk_positions),
+                   compression, ratio, [by_topic[topic] for topic in sorted(by_topic)])
+
+
+def _sample_chunks(mm: mmap.mmap, positions: List[int], max_sampled: int) -> Tuple[str, Optional[float]]:
+    if not positions:
+        return "none", None
+    step = max(1, len(positions) // max_sampled)
+    compressions = set()
+    compressed = 0
+    uncompressed = 0
+    for chunk_pos in positions[::step][:max_sampled]:
+        fields, _, data_len, _ = _read_record(mm, chunk_pos)
+        if _op(fields) != OP_CHUNK:
+            raise BagFormatError(f"no chunk at {chunk_pos}")
+        compressions.add(fields.get(b"compression", b"none").decode("ascii", errors="replace"))
+        compressed += data_len
+        uncompressed += _UINT32.unpack(fields[b"size"])[0]
+    compression = compressions.pop() if len(compressions) == 1 else "mixed"
+    return compression, compressed / uncompressed if uncompressed else None
+
+
+def _read_record(mm: mmap.mmap, pos: int) -> Tuple[Dict[bytes, bytes], int, int, int]:
+    """ Returns the header fields, the data position and length, and the position of the next record.
+    """
+    try:
+        header_len = _UINT32.unpack_from(mm, pos)[0]
+        fields = _read_fields(mm, pos + 4, pos + 4 + header_len)
+        data_len = _UINT32.unpack_from(mm, pos + 4 + header_len)[0]
+    except struct.error as e:
+        raise BagFormatError(f"truncated record at {pos}") from e
+    data_pos = pos + 8 + header_len
+    return fields, data_pos, data_len, data_pos + data_len
+
+
+def _read_fields(mm: mmap.mmap, pos: int, end: int) -> Dict[bytes, bytes]:
+    if end > len(mm):
+        raise BagFormatError(f"truncated header at {pos}")
+    fields = {}
+    while pos < end:
+        field_len = _UINT32.unpack_from(mm, pos)[0]
+        name, sep, value = mm[pos + 4:pos + 4 + field_len].partition(b"=")
+        if not sep:
+            raise BagFormatError(f"malformed header field at {pos}")
+        fields[name] = value
+        pos += 4 + field_len
+    return fields
+
+
+def _op(fields: Dict[bytes, bytes]) -> int:
+    op = fields.get(b"op")
+    if op is None or len(op) != 1:
+        raise BagFormatError("record without op")
+    return op[0]
+
+
+def _uint32_array(data: bytes, native: bool = False) -> array:
+    values = array("I")
+    values.frombytes(data)
+    if not native and sys.byteorder == "big":
+        values.byteswap()
+    return values
+
+
+def _to_seconds(value: bytes) -> float:
+    sec, nsec = _TIME.unpack(value)
+    return sec + nsec * 1e-9
+
+
+class BagInfoCache:
+    """ Summaries of the bag files of a directory, cached in a sidecar file by file mtime and size.
+
+    Attributes:
+        errors (Dict[str, str]): Why the bags that could not be read in the last call were not read
+    """
+
+    errors: Dict[str, str]
+    _directory: str
+    _sidecar_path: str
+    _entries: Dict[str, Dict[str, Any]]
+
+    def __init__(self, directory: str) -> None:
+        self.errors = {}
+        self._directory = directory
+        self._sidecar_path = os.path.join(directory, SIDECAR_FILE)
+        try:
+            with open(self._sidecar_path, "r") as f:
+                data = json.load(f)
+            self._entries = data["bags"] if data.get("format") == SIDECAR_FORMAT else {}
+        except (OSError, ValueError, KeyError, AttributeError):
+            self._entries = {}
+
+    def list(self, workers: Optional[int] = None) -> List[BagInfo]:
+        """ Returns the summaries of the ``.bag`` files in the directory, sorted by name.
+        """
+        try:
+            names = sorted(name for name in os.listdir(self._directory) if name.endswith(".bag"))
+        except OSError:
+            names = []
+        return self.get([os.path.join(self._directory, name) for name in names], workers)
+
+    def get(self, paths: Sequence[str], workers: Optional[int] = None) -> List[BagInfo]:
+        """ Returns the summaries of the given bags of the directory, in order, reading only the changed ones
+        with up to ``workers`` processes, by default one per CPU.
+        """
+        self.errors = {}
+        stale: List[Tuple[str, os.stat_result]] = []
+        stats: Dict[str, os.stat_result] = {}
+        for path in paths:
+            try:
+                st = os.stat(path)
+            except OSError as e:
+                self.errors[path] = str(e)
+                continue
+            stats[path] = st
+            entry = self._entries.get(os.path.basename(path))
+            if entry is None or entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+                stale.append((path, st))
+
+        if stale:
+            workers = min(workers or os.cpu_count() or 1, len(stale))
+            if workers > 1:
+                # imported here, as they cost more to import than a warm listing takes
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+                # parsing holds the GIL, so bags are read in parallel by processes;
+                # spawned rather than forked, as the GUI process runs threads
+                with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+                    results = list(executor.map(_summarize, [path for path, _ in stale], [st for _, st in stale]))
+            else:
+                results = [_summarize(path, st) for path, st in stale]
+            for (path, _), entry in zip(stale, results):
+                self._entries[os.path.basename(path)] = entry
+            self._save()
+
+        infos = []
+        for path in paths:
+            entry = self._entries.get(os.path.basename(path))
+            if path not in stats or entry is None:
+                continue
+            if entry.get("error") is not None:
+                self.errors[path] = entry["error"]
+            else:
+                infos.append(BagInfo.from_dict(path, entry["info"]))
+        return infos
+
+    def _save(self) -> None:
+        # forget bags that are gone, e.g. deleted by the retention policy
+        self._entries = {name: entry for name, entry in self._entries.items()
+                         if os.path.exists(os.path.join(self._directory, name))}
+        tmp_path = f"{self._sidecar_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump({"format": SIDECAR_FORMAT, "bags": self._entries}, f)
+            os.replace(tmp_path, self._sidecar_path)
+        except OSError as e:
+            print(f"[SmartBagRec] Could not write the bag info cache: {e}")
+
+
+def _summarize(path: str, st: os.stat_result) -> Dict[str, Any]:
+    entry: Dict[str, Any] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "error": None}
+    try:
+        entry["info"] = read_bag_info(path).to_dict()
+    except (BagFormatError, OSError) as e:
+        entry["error"] = str(e)
+    return entry
+
+
+def format_bag_info(info: BagInfo) -> List[str]:
+    """ Returns the lines ``bagrec --info`` prints for a bag.
+    """
+    ratio = f"{info.ratio * 100:.0f} %" if info.ratio is not None else "--"
+    lines = [f"{info.path}: {format_bytes(info.size)}, {format_duration(info.duration)}, "
+             f"{info.message_count} messages, {info.chunk_count} chunks, {info.compression} ({ratio})"]
+    width = max((len(topic.topic) for topic in info.topics), default=0)
+    lines.extend(f"    {topic.topic:{width}s} {topic.count:10d} msgs  {topic.type}" for topic in info.topics)
+    return lines
@@ -0,0 +1,374 @@
+""" Checksum manifests of bag files, written while recording and verified on the receiving side.
+
+rosbag rewrites the bag header at the start of the file when it closes a split,
+so a split cannot be hashed while it is being written. Instead every split is hashed
+as soon as it is closed, while its pages are still in the page cache, so each byte is
+read once and mostly from memory. A bounded pool of threads hashes several files
+at a time; hashlib releases the GIL while it hashes, so the threads run in parallel.
+
+Each digest is appended to a manifest next to the bags, ``SHA256SUMS`` in the format of
+``sha256sum``, or ``XXH64SUMS`` in the format of ``xxhsum`` with the optional ``xxhash``
+package, so the receiving side can check a dataset with ``bagrec --verify DIR`` or the
+standard tools. Appending one line per file keeps the manifest valid after a crash.
+"""
+
+from __future__ import annotations
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
+
+from .monitor import format_bytes
+from .output import is_bag_file
+
+ALGORITHMS = ("sha256", "xxh64")
+MANIFEST_FILES = {"sha256": "SHA256SUMS", "xxh64": "XXH64SUMS"}
+READ_BLOCK = 1024 ** 2
+VERIFY_STATES = ("ok", "failed", "missing")
+
+_manifest_locks: Dict[str, threading.Lock] = {}
+_manifest_locks_lock = threading.Lock()
+
+
+class ChecksumSettings:
+    """ How the bag files of a recording are checksummed.
+
+    Attributes:
+        algorithm (str): One of ALGORITHMS
+        workers (int): The number of files hashed at the same time
+    """
+
+    algorithm: str
+    workers: int
+
+    def __init__(self, algorithm: str = "sha256", workers: int = 2) -> None:
+        if algorithm not in ALGORITHMS:
+            raise ValueError("Unknown checksum algorithm: " + algorithm)
+        self.algorithm = algorithm
+        self.workers = max(1, workers)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"algorithm": self.algorithm, "workers": self.workers}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> ChecksumSettings:
+        return cls(str(data.get("algorithm", "sha256")), int(data.get("workers", 2)))
+
+
+def new_hash(algorithm: str) -> Any:
+    """ Returns a hash object with update() and hexdigest() for one of ALGORITHMS.
+
+    Raises:
+        ValueError: If the algorithm is unknown, or xxh64 is asked for without the xxhash package
+    """
+    if algorithm == "sha256":
+        import hashlib
+        return hashlib.sha256()
+    if algorithm == "xxh64":
+        try:
+            import xxhash
+        except ImportError:
+            raise ValueError("xxh64 checksums need the xxhash package: pip install xxhash")
+        return xxhash.xxh64()
+    raise ValueError("Unknown checksum algorithm: " + algorithm)
+
+
+def hash_file(path: str, algorithm: str = "sha256", progress: Optional[Callable[[int], None]] = None) -> str:
+    """ Hashes a file in one sequential pass, calling ``progress`` with the size of every block read.
+    """
+    digest = new_hash(algorithm)
+    buffer = bytearray(READ_BLOCK)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as f:
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        while True:
+            n = f.readinto(buffer)
+            if not n:
+                break
+            digest.update(view[:n])
+            if progress is not None:
+                progress(n)
+    return digest.hexdigest()
+
+
+def manifest_path(directory: str, algorithm: str = "sha256") -> str:
+    return os.path.join(directory, MANIFEST_FILES[algorithm])
+
+
+def read_manifest(path: str) -> Dict[str, str]:
+    """ Returns the digest of every file name in a manifest, the last one for names listed twice.
+    """
+    entries: Dict[str, str] = {}
+    try:
+        with open(path, "r") as f:
+            for line in f:
+                digest, _, name = line.rstrip("\n").partition(" ")
+                # sha256sum marks binary mode with "*" and text mode with a second space
+                name = name[1:] if name[:1] in (" ", "*") else name
+                if digest and name:
+                    entries[name] = digest
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def append_to_manifest(path: str, name: str, digest: str) -> None:
+    """ Appends one line to a manifest; lines appended from several threads are never interleaved.
+    """
+    with _manifest_locks_lock:
+        lock = _manifest_locks.setdefault(os.path.abspath(path), threading.Lock())
+    with lock:
+        with open(path, "a") as f:
+            f.write(f"{digest}  {name}\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+
+class ChecksumStatus:
+    """ Progress of a checksum queue.
+
+    Attributes:
+        done (int): The number of files hashed
+        failed (int): The number of files that could not be read
+        running (int): The number of files being hashed
+        queued (int): The number of files waiting for a worker
+        hashed_bytes (int): Bytes hashed so far
+    """
+
+    done: int
+    failed: int
+    running: int
+    queued: int
+    hashed_bytes: int
+
+    def __init__(self, done: int, failed: int, running: int, queued: int, hashed_bytes: int) -> None:
+        self.done = done
+        self.failed = failed
+        self.running = running
+        self.queued = queued
+        self.hashed_bytes = hashed_bytes
+
+    @property
+    def backlog(self) -> int:
+        return self.running + self.queued
+
+
+class ChecksumQueue:
+    """ Hashes finished bag files with a bounded pool of threads, appending each digest to
+    the manifest of the file's directory.
+    """
+
+    _settings: ChecksumSettings
+    _on_done: Optional[Callable[[str], None]]
+    _executor: ThreadPoolExecutor
+    _lock: threading.Lock
+    _done: int
+    _failed: int
+    _queued: Set[str]
+    _current: List[str]
+    _hashed_bytes: int
+
+    def __init__(self, settings: ChecksumSettings, on_done: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Args:
+            settings (ChecksumSettings): The algorithm and the number of workers
+            on_done (Optional[Callable[[str], None]]): Called with every file once it is hashed,
+                whether or not that succeeded
+        """
+        # fails early if the algorithm is not available
+        new_hash(settings.algorithm)
+        self._settings = settings
+        self._on_done = on_done
+        self._executor = ThreadPoolExecutor(max_workers=settings.workers, thread_name_prefix="smartbagrec-checksum")
+        self._lock = threading.Lock()
+        self._done = 0
+        self._failed = 0
+        self._queued = set()
+        self._current = []
+        self._hashed_bytes = 0
+
+    def submit(self, path: str) -> None:
+        with self._lock:
+            self._queued.add(path)
+        self._executor.submit(self._hash, path)
+
+    def status(self) -> ChecksumStatus:
+        with self._lock:
+            return ChecksumStatus(self._done, self._failed, len(self._current), len(self._queued),
+                                  self._hashed_bytes)
+
+    def in_use(self, path: str) -> bool:
+        """ Tells whether a file is waiting to be hashed or being hashed.
+        """
+        with self._lock:
+            return path in self._queued or path in self._current
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _hash(self, path: str) -> None:
+        with self._lock:
+            self._queued.discard(path)
+            self._current.append(path)
+        try:
+            digest = hash_file(path, self._settings.algorithm, self._count)
+            append_to_manifest(manifest_path(os.path.dirname(path), self._settings.algorithm),
+                               os.path.basename(path), digest)
+            ok = True
+        except OSError as e:
+            print(f"[SmartBagRec] Checksum of {path} failed: {e}")
+            ok = False
+        # handed on while still in use, so that retention never sees the file unclaimed
+        if self._on_done is not None and os.path.exists(path):
+            self._on_done(path)
+        with self._lock:
+            self._current.remove(path)
+            if ok:
+                self._done += 1
+            else:
+                self._failed += 1
+
+    def _count(self, n: int) -> None:
+        with self._lock:
+            self._hashed_bytes += n
+
+
+def write_manifest(directory: str, settings: ChecksumSettings) -> Tuple[int, int]:
+    """ Hashes the bag files of a directory that its manifest does not list yet.
+
+    Returns:
+        Tuple[int, int]: The number of files added to the manifest and the number that could not be read
+    """
+    listed = read_manifest(manifest_path(directory, settings.algorithm))
+    queue = ChecksumQueue(settings)
+    for name in sorted(os.listdir(directory)):
+        if is_bag_file(name) and name not in listed and os.path.isfile(os.path.join(directory, name)):
+            queue.submit(os.path.join(directory, name))
+    queue.shutdown(wait=True)
+    status = queue.status()
+    return status.done, status.failed
+
+
+class VerifyResult:
+    """ The check of one file listed in a manifest.
+
+    Attributes:
+        name (str): The file name as listed
+        state (str): One of VERIFY_STATES
+        size (int): The size of the file, 0 if it is missing
+    """
+
+    name: str
+    state: str
+    size: int
+
+    def __init__(self, name: str, state: str, size: int) -> None:
+        self.name = name
+        self.state = state
+        self.size = size
+
+
+class VerifyJob:
+    """ Checks the files listed in the manifests of a directory with at most ``workers`` threads at a time.
+
+    Attributes:
+        directory (str): The directory of the manifest and the files
+        unlisted (List[str]): Bag files in the directory that no manifest lists
+    """
+
+    directory: str
+    unlisted: List[str]
+    _entries: List[Tuple[str, str, str, int]]
+    _workers: int
+    _results: List[VerifyResult]
+    _lock: threading.Lock
+    _hashed_bytes: int
+    _total_bytes: int
+    _started: float
+
+    def __init__(self, directory: str, workers: Optional[int] = None) -> None:
+        """
+        Raises:
+            ValueError: If there is no manifest in the directory
+        """
+        self.directory = directory
+        manifests = [(algorithm, read_manifest(manifest_path(directory, algorithm))) for algorithm in ALGORITHMS]
+        manifests = [(algorithm, entries) for algorithm, entries in manifests if entries]
+        if not manifests:
+            raise ValueError("No " + " or ".join(MANIFEST_FILES.values()) + " in " + directory)
+        self._entries = []
+        listed = set()
+        for algorithm, entries in manifests:
+            for name, digest in entries.items():
+                try:
+                    size = os.path.getsize(os.path.join(directory, name))
+                except OSError:
+                    size = -1
+                self._entries.append((name, digest, algorithm, size))
+                listed.add(name)
+        # the largest files first, so one of them does not finish long after the rest
+        self._entries.sort(key=lambda entry: entry[3], reverse=True)
+        self.unlisted = sorted(name for name in os.listdir(directory) if is_bag_file(name) and name not in listed)
+        self._workers = max(1, workers if workers is not None else min(8, os.cpu_count() or 1))
+        self._results = []
+        self._lock = threading.Lock()
+        self._hashed_bytes = 0
+        self._total_bytes = sum(max(0, entry[3]) for entry in self._entries)
+        self._started = 0.0
+
+    @property
+    def file_count(self) -> int:
+        return len(self._entries)
+
+    def run(self, on_result: Optional[Callable[[VerifyResult], None]] = None) -> List[VerifyResult]:
+        """ Checks every listed file, calling ``on_result`` from the worker threads after each one.
+        """
+        self._started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="smartbagrec-verify") as executor:
+            for entry in self._entries:
+                executor.submit(self._verify, entry, on_result)
+        with self._lock:
+            return list(self._results)
+
+    def progress(self) -> Tuple[int, int, float]:
+        """ Returns the bytes hashed, the total bytes and the seconds since run() started.
+        """
+        with self._lock:
+            return self._hashed_bytes, self._total_bytes, time.monotonic() - self._started if self._started else 0.0
+
+    def _verify(self, entry: Tuple[str, str, str, int], on_result: Optional[Callable[[VerifyResult], None]]) -> None:
+        name, expected, algorithm, size = entry
+        if size < 0:
+            result = VerifyResult(name, "missing", 0)
+        else:
+            try:
+                digest = hash_file(os.path.join(self.directory, name), algorithm, self._count)
+                result = VerifyResult(name, "ok" if digest == expected.lower() else "failed", size)
+            except OSError:
+                result = VerifyResult(name, "missing", 0)
+        with self._lock:
+            self._results.append(result)
+        if on_result is not None:
+            on_result(result)
+
+    def _count(self, n: int) -> None:
+        with self._lock:
+            self._hashed_bytes += n
+
+
+def format_checksum_status(status: ChecksumStatus) -> str:
+    text = f"checksums {status.done} done, {status.backlog} left"
+    if status.failed:
+        text += f", {status.failed} failed"
+    return text
+
+
+def format_verify_summary(results: List[VerifyResult], elapsed: float) -> str:
+    counts = {state: sum(1 for result in results if result.state == state) for state in VERIFY_STATES}
+    size = sum(result.size for result in results)
+    rate = size / elapsed if elapsed > 0 else 0.0
+    return (f"{counts['ok']} OK, {counts['failed']} FAILED, {counts['missing']} missing | "
+            f"{format_bytes(size)} in {elapsed:.1f} s at {format_bytes(rate)}/s")
@@ -0,0 +1,54 @@
+""" Manipulation of ``rosbag record`` and ``ros2 bag record`` command lines.
+
+A command line is split into its options and its topics,
+so that the same options can be reused for several recorder processes.
+What differs between the two lives in the backend the command line starts with.
+"""
+
+from __future__ import annotations
+
+from typing import List, Optional, Sequence, Tuple
+
+from .backend import backend_of
+
+BUFFER_OPTIONS = ("-b", "--buffsize")
+DEFAULT_BUFFER_MB = 256
+DEFAULT_CHUNK_KB = 768
+
+
+def split_record_command(command: Sequence[str]) -> Tuple[List[str], List[str]]:
+    """ Splits a command line into the options part, including the record command, and the topics.
+
+    Raises:
+        ValueError: If it is not a record command of any backend
+    """
+    return backend_of(command).split_command(command)
+
+
+def option_value(options: Sequence[str], *names: str) -> Optional[str]:
+    """ Returns the value of the first of the options given, or None if none is set.
+    """
+    for i, option in enumerate(options[:-1]):
+        if option in names:
+            return options[i + 1]
+    return None
+
+
+def set_option(options: Sequence[str], names: Sequence[str], value: str) -> List[str]:
+    """ Returns the options with the value of an option replaced, or the option appended if it is not set.
+    """
+    result = list(options)
+    for i, option in enumerate(result[:-1]):
+        if option in names:
+            result[i + 1] = value
+            return result
+    return result + [names[0], value]
+
+
+def shard_commands(options: Sequence[str], shards: Sequence[Sequence[str]], started: float) -> List[List[str]]:
+    """ Builds one command line per shard, each writing its own files.
+
+    Raises:
+        ValueError: If the options do not start with a record command
+    """
+    return backend_of(options).shard_commands(options, shards, started)
@@ -0,0 +1,17 @@
+""" Locations of the files smartbagrec keeps between runs.
+
+Everything lives under ``~/.config/smartbagrec``, next to the profiles.
+"""
+
+from __future__ import annotations
+
+import os
+
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".config", "smartbagrec")
+
+
+def config_path(name: str) -> str:
+    """ Returns the path of a file in the config directory, creating the directory if needed.
+    """
+    os.makedirs(CONFIG_DIR, exist_ok=True)
+    return os.path.join(CONFIG_DIR, name)
@@ -1,34 +1,114 @@
 from __future__ import annotations
 
+import atexit
 import os
-import subprocess
+import queue
+import threading
+import time
 import tkinter as tk
-from tkinter import filedialog, ttk
-from typing import List, Tuple
-
+from tkinter import filedialog, messagebox, simpledialog, ttk
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence, Tuple
+
+from .backend import (DEFAULT_MCAP_PRESET, ROS1, ROS2, RecorderBackend, default_backend_name, get_backend,
+                      ros2_storage_options)
+from .baginfo import BagInfo, BagInfoCache
+from .checksum import ChecksumSettings, format_checksum_status
+from .config import CONFIG_DIR
+from .discovery import TopicDiscovery, load_cached_topics
+from .isolation import ResourceLimits, format_usage, parse_cpu_list
+from .manager import SessionManager
+from .monitor import format_bytes, format_duration
+from .offload import RECORDING_RATE, OffloadSettings, format_offload_status
+from .overflow import BufferRecommendation
+from .pipeline import PipelineSettings
+from .planner import ShardPlan, compression_of, fixed_plan, plan_shards
+from .preflight import parse_duration, run_preflight
+from .probe import TopicProber, TopicStats
+from .profile import Profile, ProfileIndex, load_profile, save_profile
+from .repair import RepairJob, format_repair_status
+from .retention import RetentionPolicy
+from .session import STOP_TIMEOUT_SEC, RecordingSession, ShutdownReport
+from .snapshot import SnapshotSession, SnapshotSettings
+from .throttle import estimate_saving, throttle_stats
+from .topic_index import TopicIndex, namespace_of
 from .widgets import (Button, Checkbutton, Entry, Frame, Label,
                      Labelframe, MainWindow, ModalWindow, Pos,
-                     Radiobutton, ScrollableListbox)
+                     Radiobutton, ScrollableText, ScrollableTreeview, VirtualTreeview)
+
+if TYPE_CHECKING:
+    # control pulls in asyncio, which is only needed with --serve
+    from .control import ControlServer
 
 
 class SmartBagRec(MainWindow):
     outer_frame: OuterFrame
-
-    def __init__(self, title: str) -> None:
+    startup_time: float
+    startup_latency: Optional[float]
+    manager: SessionManager
+    control_server: Optional[ControlServer]
+
+    def __init__(self, title: str, startup_time: Optional[float] = None) -> None:
+        """
+        Args:
+            title (str): The title of the main window
+            startup_time (Optional[float]): time.perf_counter() value at which startup began,
+                used as the origin of the startup latency. Defaults to now.
+        """
+        self.startup_time = time.perf_counter() if startup_time is None else startup_time
+        self.startup_latency = None
+        self.manager = SessionManager()
+        self.control_server = None
         super().__init__(title)
         self.parent: None
         self.tk_widget: tk.Tk
 
         self.tk_widget.geometry("960x540")
         self.outer_frame = OuterFrame(self, (0, 0), {"padx": 8, "pady": 8, "sticky": "nsew"})
+        self.tk_widget.bind("<Map>", self._on_first_map, add="+")
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+        # also covers leaving the main loop some other way, e.g. Ctrl-C in the terminal
+        atexit.register(self.outer_frame.bagrec_frame.shutdown)
 
         print("[SmartBagRec] Initialized application.")
 
-    def open_profile(self) -> None:
-        self.outer_frame.bagrec_frame.on_clicked_load_from_profile_button()
+    def _on_first_map(self, event: tk.Event) -> None:
+        if event.widget is not self.tk_widget or self.startup_latency is not None:
+            return
+        self.startup_latency = 0.0
+        self.tk_widget.after_idle(self._report_startup_latency)
+
+    def _report_startup_latency(self) -> None:
+        self.startup_latency = time.perf_counter() - self.startup_time
+        print(f"[SmartBagRec] First window paint after {self.startup_latency * 1000:.0f} ms.")
+
+    def open_profile(self, file_name: Optional[str] = None) -> None:
+        """ Records with the profile at file_name, or asks for one if it is not given.
+        """
+        if file_name is None:
+            self.outer_frame.bagrec_frame.on_clicked_load_from_profile_button()
+        else:
+            self.outer_frame.bagrec_frame.record_from_profile(file_name)
         self.tk_widget.mainloop()
 
-    def __del__(self) -> None:
+    def serve(self, socket_path: Optional[str], http_port: Optional[int] = None) -> None:
+        """ Serves the control API from a thread while the window is open,
+        so that recordings can be started and stopped from both.
+
+        Raises:
+            OSError: If the socket or the port cannot be bound
+        """
+        from .control import ControlServer
+        self.control_server = ControlServer(self.manager, socket_path, http_port,
+                                            self.outer_frame.bagrec_frame.get_stop_timeout())
+        self.control_server.start_in_thread()
+
+    def on_close(self) -> None:
+        """ Stops a recording that is still running before the application exits.
+        """
+        if self.control_server is not None:
+            self.control_server.close()
+        self.outer_frame.bagrec_frame.shutdown()
+        self.tk_widget.destroy()
         print("[SmartBagRec] Normally terminated application.")
 
 
@@ -51,24 +131,93 @@ class OuterFrame(Frame):
             self, (1, 1), {"padx": 8, "pady": 8, "sticky": "ew"})
         self.bagrec_frame = BagRecFrame(
             self, (2, 1), {"padx": 8, "pady": 8, "sticky": "ew"})
+        self.settings_frame.advenced_settings_window.ros2_button.on_change(self.on_changed_backend)
+
+    def on_changed_backend(self) -> None:
+        # the topics are listed and measured with the tools of the backend that records them
+        ros2 = self.settings_frame.advenced_settings_window.ros2_button.get_state()
+        self.topic_list_frame.topic_list.set_backend(get_backend(ROS2 if ros2 else ROS1))
 
 
 class TopicListFrame(Labelframe):
     topic_list: TopicList
+    filter_frame: TopicFilterFrame
     select_button_frame: SelectButtonFrame
+    selection_label: Label
 
     def __init__(self, parent: OuterFrame, pos: Pos, grid_opt: dict = {}) -> None:
         super().__init__(parent, "recording topics", pos, grid_opt)
         self.parent: OuterFrame
         self.tk_widget: ttk.Labelframe
 
+        self.selection_label = Label(self, "", (3, 0), {"padx": 4, "pady": 4, "sticky": "w"})
         self.topic_list = TopicList(self, (0, 0, 0, 1), {"sticky": "nsew"})
-        self.select_button_frame = SelectButtonFrame(self, (1, 0))
+        self.filter_frame = TopicFilterFrame(self, (1, 0), {"sticky": "we"})
+        self.select_button_frame = SelectButtonFrame(self, (2, 0))
+        self.update_selection_summary()
+
+    def update_selection_summary(self) -> None:
+        """ Shows the number of selected topics, the sum of their measured bandwidth once throttled,
+        and how much the rate limits save.
+        """
+        selected = self.topic_list.get_selected()
+        throttles = {topic: rate for topic, rate in self.topic_list.throttles.items() if topic in selected}
+        stats = throttle_stats(self.topic_list.stats, throttles)
+        measured = [stats[topic] for topic in selected if topic in stats]
+        text = f"selected: {len(selected)} topics"
+        if measured:
+            total = sum(topic_stats.bandwidth for topic_stats in measured)
+            text += f", {format_bytes(total)}/s ({len(measured)} of {len(selected)} measured)"
+            saving = estimate_saving(self.topic_list.stats, throttles)
+            if saving > 0:
+                text += f", throttling saves {format_bytes(saving)}/s"
+        self.selection_label.tk_widget.configure(text=text)  # type: ignore
+
+
+class TopicFilterFrame(Frame):
+    filter_mode: tk.StringVar
+    filter_entry: Entry
+    substring_button: Radiobutton
+    glob_button: Radiobutton
+    regex_button: Radiobutton
+    match_label: Label
+
+    def __init__(self, parent: TopicListFrame, pos: Pos, grid_opt: dict = {}) -> None:
+        super().__init__(parent, pos, grid_opt)
+        self.parent: TopicListFrame
+        self.tk_widget: ttk.Frame
+
+        self.filter_mode = tk.StringVar(value="substring")
+        self.filter_entry = Entry(self, (0, 0), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.filter_entry.on_change(self.apply_filter)
+        self.substring_button = Radiobutton(
+            self, "substring", self.filter_mode, "substring", self.apply_filter, (0, 1), {"padx": 2})
+        self.glob_button = Radiobutton(
+            self, "glob", self.filter_mode, "glob", self.apply_filter, (0, 2), {"padx": 2})
+        self.regex_button = Radiobutton(
+            self, "regex", self.filter_mode, "regex", self.apply_filter, (0, 3), {"padx": 2})
+        self.match_label = Label(self, "", (0, 4), {"padx": 4, "sticky": "e"})
+
+    def apply_filter(self) -> None:
+        """ Lists only the topics matching the filter, and shows how many match.
+        """
+        try:
+            count = self.parent.topic_list.set_filter(self.filter_entry.get_state(), self.filter_mode.get())
+            text = f"{count} / {self.parent.topic_list.topic_count}"
+        except ValueError:
+            text = "invalid pattern"
+        self.match_label.tk_widget.configure(text=text)  # type: ignore
 
 
 class SelectButtonFrame(Frame):
     reset_button: Button
     all_button: Button
+    namespace_button: Button
+    refresh_button: Button
+    measure_button: Button
+    max_rate_label: Label
+    max_rate_entry: Entry
+    max_rate_button: Button
 
     def __init__(self, parent: TopicListFrame, pos: Pos, grid_opt: dict = {}) -> None:
         super().__init__(parent, pos, grid_opt)
@@ -78,7 +227,18 @@ class SelectButtonFrame(Frame):
         self.reset_button = Button(
             self, "reset", self.on_clicked_reset_button, (0, 0), {"padx": 4, "pady": 4})
         self.all_button = Button(
-            self, "select all", self.on_clicked_all_button, (0, 1), {"padx": 4, "pady": 4})
+            self, "select all matching", self.on_clicked_all_button, (0, 1), {"padx": 4, "pady": 4})
+        self.namespace_button = Button(
+            self, "select namespace", self.on_clicked_namespace_button, (0, 2), {"padx": 4, "pady": 4})
+        self.refresh_button = Button(
+            self, "refresh", self.on_clicked_refresh_button, (0, 3), {"padx": 4, "pady": 4})
+        self.measure_button = Button(
+            self, "measure", self.on_clicked_measure_button, (0, 4), {"padx": 4, "pady": 4})
+        self.max_rate_label = Label(
+            self, "max rate [Hz]\n(empty: no limit)", (1, 0), {"padx": 4, "pady": 4, "sticky": "e"})
+        self.max_rate_entry = Entry(self, (1, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.max_rate_button = Button(
+            self, "limit selected", self.on_clicked_max_rate_button, (1, 2), {"padx": 4, "pady": 4})
 
     def on_clicked_reset_button(self) -> None:
         self.parent.topic_list.reset()
@@ -86,6 +246,27 @@ class SelectButtonFrame(Frame):
     def on_clicked_all_button(self) -> None:
         self.parent.topic_list.select_all()
 
+    def on_clicked_namespace_button(self) -> None:
+        self.parent.topic_list.select_namespace()
+
+    def on_clicked_refresh_button(self) -> None:
+        self.parent.topic_list.refresh()
+
+    def on_clicked_measure_button(self) -> None:
+        self.parent.topic_list.measure()
+
+    def on_clicked_max_rate_button(self) -> None:
+        state = self.max_rate_entry.get_state().strip()
+        try:
+            rate = float(state) if state else None
+        except ValueError:
+            rate = 0.0
+        if rate is not None and not rate > 0:
+            messagebox.showerror("invalid rate", "The max rate must be a positive number of messages per second.",
+                                 parent=self.parent.parent.parent.tk_widget)
+            return
+        self.parent.topic_list.set_throttle(self.parent.topic_list.get_selected(), rate)
+
 
 class SettingsFrame(Labelframe):
     quiet_button: Checkbutton
@@ -143,6 +324,42 @@ class AdvencedSettingsWindow(ModalWindow):
     limit_entry: Entry
     node_button: Checkbutton
     node_entry: Entry
+    shards_button: Checkbutton
+    shards_entry: Entry
+    post_compress_button: Checkbutton
+    post_compress_entry: Entry
+    split_step_button: Checkbutton
+    split_step_entry: Entry
+    max_bytes_button: Checkbutton
+    max_bytes_entry: Entry
+    min_free_button: Checkbutton
+    min_free_entry: Entry
+    preflight_button: Checkbutton
+    stop_timeout_button: Checkbutton
+    stop_timeout_entry: Entry
+    snapshot_duration_button: Checkbutton
+    snapshot_duration_entry: Entry
+    snapshot_size_button: Checkbutton
+    snapshot_size_entry: Entry
+    offload_button: Checkbutton
+    offload_entry: Entry
+    offload_rate_button: Checkbutton
+    offload_rate_entry: Entry
+    offload_delete_button: Checkbutton
+    checksum_button: Checkbutton
+    ros2_button: Checkbutton
+    storage_preset_button: Checkbutton
+    storage_preset_entry: Entry
+    cpus_button: Checkbutton
+    cpus_entry: Entry
+    nice_button: Checkbutton
+    nice_entry: Entry
+    io_class_button: Checkbutton
+    io_class_entry: Entry
+    cpu_quota_button: Checkbutton
+    cpu_quota_entry: Entry
+    memory_high_button: Checkbutton
+    memory_high_entry: Entry
 
     def __init__(self, parent: SettingsFrame, master: tk.Tk, title: str) -> None:
         super().__init__(parent, master, title)
@@ -178,6 +395,80 @@ class AdvencedSettingsWindow(ModalWindow):
         self.node_button = Checkbutton(
             self, "record all topics subscribed to by a specific node", (8, 0), button_grid_opt)
         self.node_entry = Entry(self, (8, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.shards_button = Checkbutton(
+            self, "split the topics across N recorder processes\n(Default: 1)", (9, 0), button_grid_opt)
+        self.shards_entry = Entry(self, (9, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.post_compress_button = Checkbutton(
+            self, "record uncompressed and compress each finished split\nin the background with N processes (Default: 1)",
+            (10, 0), button_grid_opt)
+        self.post_compress_entry = Entry(self, (10, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.split_step_button = Checkbutton(
+            self, "run a command on each finished split\n({input}: the split, {output}: its replacement)",
+            (11, 0), button_grid_opt)
+        self.split_step_entry = Entry(self, (11, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.max_bytes_button = Checkbutton(
+            self, "keep the bag files in the output directory under SIZE GB,\nerasing the oldest ones",
+            (12, 0), button_grid_opt)
+        self.max_bytes_entry = Entry(self, (12, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.min_free_button = Checkbutton(
+            self, "keep at least SIZE GB free on the disk,\nerasing the oldest bag files",
+            (13, 0), button_grid_opt)
+        self.min_free_entry = Entry(self, (13, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.preflight_button = Checkbutton(
+            self, "check the disk speed, free space and buffer\nbefore recording starts (pre-flight check)",
+            (14, 0), button_grid_opt)
+        self.stop_timeout_button = Checkbutton(
+            self, "when stopping, give the recorders SEC seconds to finalize\nthe bag files before terminating them (Default: 10)",
+            (15, 0), button_grid_opt)
+        self.stop_timeout_entry = Entry(self, (15, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.snapshot_duration_button = Checkbutton(
+            self, "snapshot mode: keep only the last SEC seconds in memory\nand write them to a bag file on demand",
+            (16, 0), button_grid_opt)
+        self.snapshot_duration_entry = Entry(self, (16, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.snapshot_size_button = Checkbutton(
+            self, "snapshot mode: keep at most SIZE MB of all topics in memory",
+            (17, 0), button_grid_opt)
+        self.snapshot_size_entry = Entry(self, (17, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.offload_button = Checkbutton(
+            self, "copy each finished split to DIR (e.g. a NAS mount)\nin verified chunks, resuming after interruptions",
+            (18, 0), button_grid_opt)
+        self.offload_entry = Entry(self, (18, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.offload_rate_button = Checkbutton(
+            self, "limit the copying to MB/s while recording\n(Default: 10)", (19, 0), button_grid_opt)
+        self.offload_rate_entry = Entry(self, (19, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.offload_delete_button = Checkbutton(
+            self, "delete the local bag files once their copies are verified", (20, 0), button_grid_opt)
+        self.checksum_button = Checkbutton(
+            self, "write the SHA-256 of each finished split to SHA256SUMS\nnext to the bag files",
+            (21, 0), button_grid_opt)
+        self.ros2_button = Checkbutton(
+            self, "record with ROS 2 (ros2 bag record) into MCAP files\n(Default: on if $ROS_VERSION is 2)",
+            (22, 0), button_grid_opt)
+        self.ros2_button.set_state(default_backend_name() == ROS2)
+        self.storage_preset_button = Checkbutton(
+            self, "ROS 2: write MCAP with the storage preset PRESET\n(Default: zstd_fast; also fastwrite, zstd_small, none)",
+            (23, 0), button_grid_opt)
+        self.storage_preset_entry = Entry(self, (23, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.cpus_button = Checkbutton(
+            self, "pin the recorders to the CPUs LIST (e.g. 2,3 or 4-7),\naway from the cores of the control loops",
+            (24, 0), button_grid_opt)
+        self.cpus_entry = Entry(self, (24, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.nice_button = Checkbutton(
+            self, "run the recorders at the nice level N\n(Default: 10; negative levels need root)",
+            (25, 0), button_grid_opt)
+        self.nice_entry = Entry(self, (25, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.io_class_button = Checkbutton(
+            self, "give the recorders the I/O class CLASS[:LEVEL]\n(Default: best-effort:7; also idle, realtime:N)",
+            (26, 0), button_grid_opt)
+        self.io_class_entry = Entry(self, (26, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.cpu_quota_button = Checkbutton(
+            self, "limit each recorder to N CPUs' worth of time\nin a cgroup (needs cgroup v2 and systemd)",
+            (27, 0), button_grid_opt)
+        self.cpu_quota_entry = Entry(self, (27, 1), {"padx": 4, "pady": 4, "sticky": "we"})
+        self.memory_high_button = Checkbutton(
+            self, "throttle each recorder above SIZE MB of memory\nin a cgroup (needs cgroup v2 and systemd)",
+            (28, 0), button_grid_opt)
+        self.memory_high_entry = Entry(self, (28, 1), {"padx": 4, "pady": 4, "sticky": "we"})
 
         self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
 
@@ -251,21 +542,47 @@ class BagRecFrame(Frame):
     record_button: Button
     save_as_profile_button: Button
     load_from_profile_button: Button
-    rosbag_record_process: subprocess.Popen
+    repair_button: Button
+    bag_info_button: Button
+    session: Optional[RecordingSession]
+    snapshot_session: Optional[SnapshotSession]
+    stop_timeout: float
     recording_window: RecordingWindow
+    shard_plan_window: ShardPlanWindow
+    preflight_window: PreflightWindow
+    profile_list_window: ProfileListWindow
+    buffer_advice_window: BufferAdviceWindow
+    snapshot_window: SnapshotWindow
+    repair_window: RepairWindow
+    bag_info_window: BagInfoWindow
+    profile_path: Optional[str]
 
     def __init__(self, parent: OuterFrame, pos: Pos, grid_opt: dict = {}) -> None:
         super().__init__(parent, pos, grid_opt)
         self.parent: OuterFrame
         self.tk_widget: ttk.Frame
+        self.profile_path = None
+        self.session = None
+        self.snapshot_session = None
+        self.stop_timeout = STOP_TIMEOUT_SEC
         self.save_as_profile_button = Button(
             self, "save as profile", self.on_clicked_save_as_profile_button, (0, 0), {"padx": 4, "pady": 8, "sticky": "ew"})
         self.load_from_profile_button = Button(
             self, "load from profile", self.on_clicked_load_from_profile_button, (1, 0), {"padx": 4, "pady": 8, "sticky": "ew"})
         self.record_button = Button(
             self, "record", self.on_clicked_record_button, (2, 0), {"padx": 4, "pady": 8, "sticky": "ew"})
+        self.repair_button = Button(
+            self, "repair bag files", self.on_clicked_repair_button, (3, 0), {"padx": 4, "pady": 8, "sticky": "ew"})
+        self.bag_info_button = Button(
+            self, "bag info", self.on_clicked_bag_info_button, (4, 0), {"padx": 4, "pady": 8, "sticky": "ew"})
 
     def generate_rosbag_record_command(self) -> List[str]:
+        """
+        Raises:
+            ValueError: If the ROS 2 storage preset is unknown
+        """
+        if self.parent.settings_frame.advenced_settings_window.ros2_button.get_state():
+            return self.generate_ros2_record_command()
         command = ["rosbag", "record"]
 
         if self.parent.settings_frame.bz2_button.get_state():
@@ -346,90 +663,930 @@ class BagRecFrame(Frame):
 
         return command
 
-    def open_record_process(self, command) -> None:
-        print(f"[SmartBagRec] Recording command is: {' '.join(command)}")
-        self.rosbag_record_process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    def generate_ros2_record_command(self) -> List[str]:
+        """ The ``ros2 bag record`` equivalent of the settings, writing MCAP with a storage preset.
+
+        Split sizes and durations become --max-bag-size/--max-bag-duration and the buffer --max-cache-size;
+        the settings ROS 2 has no equivalent for, such as bz2/LZ4 or --max-splits, are left out.
+
+        Raises:
+            ValueError: If the storage preset is unknown
+        """
+        settings_frame = self.parent.settings_frame
+        advenced_settings_window = settings_frame.advenced_settings_window
+        preset = DEFAULT_MCAP_PRESET
+        if advenced_settings_window.storage_preset_button.get_state():
+            preset = advenced_settings_window.storage_preset_entry.get_state().strip() or DEFAULT_MCAP_PRESET
+        command = get_backend(ROS2).record_prefix + ros2_storage_options("mcap", preset)
+
+        if settings_frame.split_button.get_state():
+            if settings_frame.size_button.get_state():
+                state = settings_frame.size_entry.get_state()
+                if state.isdigit() and int(state) > 0:
+                    command.extend(["--max-bag-size", str(int(state) * 1024 ** 2)])
+            if settings_frame.duration_button.get_state():
+                seconds = parse_duration(settings_frame.duration_entry.get_state() or "0")
+                if seconds is not None and seconds > 0:
+                    command.extend(["--max-bag-duration", str(int(seconds))])
+        if advenced_settings_window.buffer_size_button.get_state():
+            state = advenced_settings_window.buffer_size_entry.get_state()
+            if state.isdigit():
+                command.extend(["--max-cache-size", str(int(state) * 1024 ** 2)])
+        if advenced_settings_window.node_button.get_state():
+            state = advenced_settings_window.node_entry.get_state()
+            if state:
+                command.extend(["--node-name", state])
+
+        if self.parent.save_mode_frame.save_mode.get() == 1:
+            command.extend(["--output-prefix", self.parent.save_mode_frame.prefix_entry.get_state()])
+        elif self.parent.save_mode_frame.save_mode.get() == 2:
+            file_name = self.parent.save_mode_frame.file_name
+            command.extend(["-o", file_name[:-len(".bag")] if file_name.endswith(".bag") else file_name])
+
+        topics = self.parent.topic_list_frame.topic_list.get_selected()
+        if not topics:
+            return []
+        return command + list(topics)
+
+    def get_shard_count(self) -> int:
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+        if not advenced_settings_window.shards_button.get_state():
+            return 1
+        state = advenced_settings_window.shards_entry.get_state()
+        return max(1, int(state)) if state.isdigit() else 1
+
+    def get_pipeline_settings(self, options: List[str]) -> Optional[PipelineSettings]:
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+        compression = None
+        workers = 1
+        if advenced_settings_window.post_compress_button.get_state():
+            compression = compression_of(options)
+            state = advenced_settings_window.post_compress_entry.get_state()
+            workers = max(1, int(state)) if state.isdigit() else 1
+        steps = []
+        if advenced_settings_window.split_step_button.get_state():
+            state = advenced_settings_window.split_step_entry.get_state().strip()
+            if state:
+                steps.append(state)
+        settings = PipelineSettings(compression, workers, steps)
+        return settings if settings.enabled else None
+
+    def get_retention_policy(self) -> Optional[RetentionPolicy]:
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+
+        def gigabytes(button: Checkbutton, entry: Entry) -> Optional[int]:
+            if not button.get_state():
+                return None
+            try:
+                return max(0, int(float(entry.get_state()) * 1024 ** 3))
+            except ValueError:
+                return None
+
+        policy = RetentionPolicy(
+            gigabytes(advenced_settings_window.max_bytes_button, advenced_settings_window.max_bytes_entry),
+            gigabytes(advenced_settings_window.min_free_button, advenced_settings_window.min_free_entry))
+        return policy if policy.enabled else None
+
+    def get_stop_timeout(self) -> float:
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+        if not advenced_settings_window.stop_timeout_button.get_state():
+            return STOP_TIMEOUT_SEC
+        try:
+            return max(0.0, float(advenced_settings_window.stop_timeout_entry.get_state()))
+        except ValueError:
+            return STOP_TIMEOUT_SEC
+
+    def get_snapshot_settings(self) -> Optional[SnapshotSettings]:
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+
+        def positive(button: Checkbutton, entry: Entry) -> Optional[float]:
+            if not button.get_state():
+                return None
+            try:
+                value = float(entry.get_state())
+            except ValueError:
+                return None
+            return value if value > 0 else None
+
+        settings = SnapshotSettings(
+            positive(advenced_settings_window.snapshot_duration_button, advenced_settings_window.snapshot_duration_entry),
+            positive(advenced_settings_window.snapshot_size_button, advenced_settings_window.snapshot_size_entry))
+        return settings if settings.enabled else None
+
+    def get_offload_settings(self) -> Optional[OffloadSettings]:
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+        if not advenced_settings_window.offload_button.get_state():
+            return None
+        destination = advenced_settings_window.offload_entry.get_state().strip()
+        if not destination:
+            return None
+        recording_rate: Optional[float] = RECORDING_RATE
+        if advenced_settings_window.offload_rate_button.get_state():
+            try:
+                value = float(advenced_settings_window.offload_rate_entry.get_state())
+                recording_rate = value * 1024 ** 2 if value > 0 else None
+            except ValueError:
+                pass
+        return OffloadSettings(destination, None, recording_rate,
+                               advenced_settings_window.offload_delete_button.get_state())
+
+    def get_checksum_settings(self) -> Optional[ChecksumSettings]:
+        if not self.parent.settings_frame.advenced_settings_window.checksum_button.get_state():
+            return None
+        return ChecksumSettings()
+
+    def get_resource_limits(self) -> Optional[ResourceLimits]:
+        """
+        Raises:
+            ValueError: If an enabled limit is not valid
+        """
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+
+        def state(button: Checkbutton, entry: Entry) -> Optional[str]:
+            return entry.get_state().strip() if button.get_state() else None
+
+        cpus = state(advenced_settings_window.cpus_button, advenced_settings_window.cpus_entry)
+        nice = state(advenced_settings_window.nice_button, advenced_settings_window.nice_entry)
+        io = state(advenced_settings_window.io_class_button, advenced_settings_window.io_class_entry)
+        cpu_quota = state(advenced_settings_window.cpu_quota_button, advenced_settings_window.cpu_quota_entry)
+        memory_high = state(advenced_settings_window.memory_high_button, advenced_settings_window.memory_high_entry)
+        io_class, _, io_level = (io or "best-effort:7").partition(":")
+        limits = ResourceLimits(
+            parse_cpu_list(cpus) if cpus else None,
+            (int(nice) if nice else 10) if nice is not None else None,
+            io_class if io is not None else None,
+            int(io_level) if io is not None and io_level else None,
+            float(cpu_quota) if cpu_quota else None,
+            int(float(memory_high) * 1024 ** 2) if memory_high else None)
+        return limits if limits.enabled else None
+
+    def generate_profile(self) -> Optional[Profile]:
+        try:
+            command = self.generate_rosbag_record_command()
+        except ValueError as e:
+            messagebox.showerror("invalid storage preset", str(e), parent=self.parent.parent.tk_widget)
+            return None
+        if not command:
+            return None
+        try:
+            resources = self.get_resource_limits()
+        except ValueError as e:
+            messagebox.showerror("invalid resource limits", str(e), parent=self.parent.parent.tk_widget)
+            return None
+        profile = Profile.from_command(command, self.get_shard_count())
+        profile.pipeline = self.get_pipeline_settings(profile.options)
+        profile.retention = self.get_retention_policy()
+        profile.snapshot = self.get_snapshot_settings()
+        profile.offload = self.get_offload_settings()
+        profile.checksums = self.get_checksum_settings()
+        profile.resources = resources
+        throttles = self.parent.topic_list_frame.topic_list.throttles
+        profile.throttles = {topic: throttles[topic] for topic in profile.topics if topic in throttles}
+        return profile
+
+    def plan_shards(self, profile: Profile) -> ShardPlan:
+        stats = throttle_stats(self.parent.topic_list_frame.topic_list.stats, profile.throttles)
+        if profile.shards:
+            return fixed_plan(profile.shards, stats)
+        return plan_shards(profile.topics, stats, profile.shard_count, compression_of(profile.options))
+
+    def start_recording(self, profile: Profile, check: bool = True) -> None:
+        """ Starts recording with the profile, showing the shard plan first if there are several processes.
+
+        If the pre-flight check is enabled, it runs before anything else unless ``check`` is False.
+        A profile in snapshot mode only buffers its topics, so neither applies to it.
+        """
+        if profile.snapshot is not None:
+            try:
+                self.snapshot_session = SnapshotSession(profile.snapshot, profile.command, profile.topics)
+            except ValueError as e:
+                messagebox.showerror("cannot record", str(e), parent=self.parent.parent.tk_widget)
+                return
+            self.snapshot_window = SnapshotWindow(self, self.parent.parent.tk_widget, "snapshot")  # type: ignore
+        elif check and self.parent.settings_frame.advenced_settings_window.preflight_button.get_state():
+            self.preflight_window = PreflightWindow(
+                self, self.parent.parent.tk_widget, "pre-flight check", profile, self.plan_shards(profile))  # type: ignore
+        elif profile.shard_count > 1:
+            self.shard_plan_window = ShardPlanWindow(
+                self, self.parent.parent.tk_widget, "shard plan", profile, self.plan_shards(profile))  # type: ignore
+        else:
+            self.open_record_process(profile, [profile.topics])
+
+    def open_record_process(self, profile: Profile, shards: List[List[str]]) -> None:
+        self.stop_timeout = self.get_stop_timeout()
+        try:
+            self.session = self.parent.parent.manager.start(profile, shards, "gui").session
+        except ValueError as e:
+            messagebox.showerror("cannot record", str(e), parent=self.parent.parent.tk_widget)
+            return
+        for recorder in self.session.recorders:
+            print(f"[SmartBagRec] Recorder output is logged to: {recorder.output.log_path}")
         self.recording_window = RecordingWindow(self, self.parent.parent.tk_widget, "recording")  # type: ignore
 
     def on_clicked_save_as_profile_button(self) -> None:
-        command = self.generate_rosbag_record_command()
-        if not command:
+        profile = self.generate_profile()
+        if profile is None:
             return
-        default_dir = os.environ["HOME"] + "/.config/smartbagrec"
-        os.makedirs(default_dir, exist_ok=True)
-        file_name = filedialog.asksaveasfilename(initialdir=default_dir, initialfile="default.profile")
-        with open(file_name, "w") as f:
-            f.write(" ".join(command))
+        if profile.shard_count > 1:
+            profile.shards = self.plan_shards(profile).shards
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        file_name = filedialog.asksaveasfilename(initialdir=CONFIG_DIR, initialfile="default.profile")
+        if not file_name:
+            return
+        profile.description = simpledialog.askstring("save as profile", "description of the profile:",
+                                                     parent=self.parent.parent.tk_widget) or ""
+        save_profile(file_name, profile)
         print("[SmartBagRec] Saved as profile: " + file_name)
 
     def on_clicked_load_from_profile_button(self) -> None:
-        default_dir = os.environ["HOME"] + "/.config/smartbagrec"
-        os.makedirs(default_dir, exist_ok=True)
-        file_name = filedialog.askopenfilename(initialdir=default_dir)
+        self.profile_list_window = ProfileListWindow(self, self.parent.parent.tk_widget, "load from profile")  # type: ignore
+
+    def browse_profile(self) -> None:
+        os.makedirs(CONFIG_DIR, exist_ok=True)
+        file_name = filedialog.askopenfilename(initialdir=CONFIG_DIR)
         if not file_name:
             return
-        with open(file_name, "r") as f:
-            command = f.readline()
-            if ("rosbag record" in command and
-                    ";" not in command and
-                    "|" not in command and
-                    "&" not in command):
-                print("[SmartBagRec] Loaded from profile: " + file_name)
-                self.open_record_process(command.split())
+        self.record_from_profile(file_name)
+
+    def record_from_profile(self, file_name: str) -> None:
+        profile = load_profile(file_name)
+        if profile is None:
+            return
+        print("[SmartBagRec] Loaded from profile: " + file_name)
+        self.profile_path = file_name
+        self.start_recording(profile)
 
     def on_clicked_record_button(self) -> None:
-        command = self.generate_rosbag_record_command()
-        if not command:
+        profile = self.generate_profile()
+        if profile is None:
             return
-        self.open_record_process(command)
+        self.profile_path = None
+        self.start_recording(profile)
 
+    def on_clicked_repair_button(self) -> None:
+        directory = filedialog.askdirectory(title="directory with .bag.active files")
+        if not directory:
+            return
+        self.repair_window = RepairWindow(self, self.parent.parent.tk_widget, "repair bag files", directory)  # type: ignore
 
-class TopicList(ScrollableListbox):
+    def on_clicked_bag_info_button(self) -> None:
+        initial_dir = self.session.recorders[0].spec.directory if self.session is not None else os.getcwd()
+        directory = filedialog.askdirectory(title="directory with bag files", initialdir=initial_dir)
+        if not directory:
+            return
+        self.bag_info_window = BagInfoWindow(self, self.parent.parent.tk_widget, "bag info", directory)  # type: ignore
+
+    def shutdown(self) -> None:
+        """ Stops the sessions that are still running, including those started through the control API,
+        and waits for their recorders, for when the application exits.
+
+        The pipeline keeps processing the last splits before the process exits,
+        while the offload stops after its current chunk, to be resumed with ``bagrec --offload``.
+        """
+        if self.snapshot_session is not None:
+            self.snapshot_session.shutdown()
+        self.parent.parent.manager.shutdown(self.stop_timeout)
+
+    def show_buffer_advice(self) -> None:
+        """ Offers a larger buffer if the recorders of the last session dropped messages.
+        """
+        assert self.session is not None
+        recommendation = self.session.recommend_buffer()
+        if recommendation is None:
+            return
+        print("[SmartBagRec] " + recommendation.reason)
+        self.buffer_advice_window = BufferAdviceWindow(
+            self, self.parent.parent.tk_widget, "buffer overflow", recommendation)  # type: ignore
+
+    def apply_buffer_recommendation(self, recommendation: BufferRecommendation) -> None:
+        """ Writes the recommended sizes back into the profile the session was recorded from,
+        or into the settings if it was recorded from them.
+        """
+        if self.profile_path is not None:
+            profile = load_profile(self.profile_path)
+            if profile is not None:
+                profile.options = recommendation.apply(profile.options)
+                save_profile(self.profile_path, profile)
+                print("[SmartBagRec] Updated the buffer settings of profile: " + self.profile_path)
+                return
+        advenced_settings_window = self.parent.settings_frame.advenced_settings_window
+        advenced_settings_window.buffer_size_button.set_state(True)
+        advenced_settings_window.buffer_size_entry.set_state(str(recommendation.buffer_mb))
+        advenced_settings_window.chunk_size_button.set_state(True)
+        advenced_settings_window.chunk_size_entry.set_state(str(recommendation.chunk_kb))
+
+
+class TopicList(VirtualTreeview):
+    POLL_INTERVAL_MS = 100
+    COLUMNS = (("rate", "rate", 90), ("bandwidth", "bandwidth", 110), ("max_rate", "max rate", 80))
+
+    _index: TopicIndex
+    _filter: Tuple[str, str]
+    _stats: Dict[str, TopicStats]
+    _throttles: Dict[str, float]
+    _discovery: TopicDiscovery
+    _prober: TopicProber
 
     def __init__(self, parent: TopicListFrame, pos: Pos, grid_opt: dict = {}) -> None:
-        super().__init__(parent, self.fetch_topics(), "multiple", pos, grid_opt)
+        super().__init__(parent, self.COLUMNS, 20, pos, grid_opt)
         self.parent: TopicListFrame
-        self.tk_widget: tk.Listbox
+        self.tk_widget: ttk.Treeview
+
+        self._index = TopicIndex()
+        self._filter = ("", "substring")
+        self._stats = {}
+        self._throttles = {}
+        # the same backend the ros2 button of the advanced settings starts with
+        backend = get_backend(default_backend_name())
+        self._discovery = TopicDiscovery(backend)
+        self._prober = TopicProber(backend=backend)
+        self.tk_widget.bind("<<SelectionChanged>>", self._on_selection_changed)
+        self.set_topics(load_cached_topics())
+        self.refresh()
+
+    @property
+    def stats(self) -> Dict[str, TopicStats]:
+        """ The measured rate and bandwidth of the topics measured so far.
+        """
+        return self._stats
+
+    @property
+    def throttles(self) -> Dict[str, float]:
+        """ The maximum messages per second of the topics recorded through a throttling relay.
+        """
+        return self._throttles
+
+    def set_throttle(self, topics: Sequence[str], rate: Optional[float]) -> None:
+        """ Limits the topics to ``rate`` messages per second, or records them as published if it is None.
+        """
+        for topic in topics:
+            if rate is None:
+                self._throttles.pop(topic, None)
+            else:
+                self._throttles[topic] = rate
+            self._show_values(topic)
+        self.parent.update_selection_summary()
+
+    @property
+    def topic_count(self) -> int:
+        return len(self._index)
 
     def select_all(self) -> None:
-        self.tk_widget: tk.Listbox
-        self.tk_widget.select_set(0, tk.END)
+        """ Selects all topics matching the filter.
+        """
+        self.select(self.rows)
+        self.parent.update_selection_summary()
+
+    def select_namespace(self) -> None:
+        """ Selects all topics in the namespace of the topic clicked last, whether they match the filter or not.
+        """
+        if self.last_clicked is None:
+            return
+        self.select(self._index.namespace(namespace_of(self.last_clicked)))
+        self.parent.update_selection_summary()
 
     def reset(self) -> None:
-        self.tk_widget: tk.Listbox
-        self.tk_widget.selection_clear(0, tk.END)
+        self.set_selected(())
+        self.parent.update_selection_summary()
+
+    def set_filter(self, pattern: str, mode: str) -> int:
+        """ Lists only the topics matching the pattern, returning their number.
+
+        Raises:
+            ValueError: If the pattern is not a valid regex
+        """
+        rows = self._index.match(pattern, mode)
+        self._filter = (pattern, mode)
+        self.set_rows(rows)
+        return len(rows)
+
+    def refresh(self) -> None:
+        """ Fetches the live topic list in the background and shows it once it arrives.
+        """
+        if self._discovery.running:
+            return
+        self._discovery.start()
+        self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_discovery)
+
+    def set_backend(self, backend: RecorderBackend) -> None:
+        """ Lists and measures the topics with the tools of ``backend`` from now on, fetching its topic list.
+        """
+        if backend is self._discovery.backend:
+            return
+        self._discovery.backend = backend
+        self._prober.backend = backend
+        self.refresh()
+
+    def measure(self) -> None:
+        """ Measures the rate and bandwidth of the selected topics in the background.
+        """
+        topics = self.get_selected()
+        if not topics or not self._prober.start(topics):
+            return
+        for topic in topics:
+            self.set_values(topic, ("...", "...", self._throttle_text(topic)))
+        self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_prober)
+
+    def set_topics(self, topics: Tuple[str, ...]) -> None:
+        """ Lists the given topics, keeping the selected ones even if they are no longer published.
+        """
+        self._index = TopicIndex(set(topics) | set(self.get_selected()))
+        try:
+            self.set_filter(*self._filter)
+        except ValueError:
+            self.set_rows(self._index.topics)
+
+    def _poll_discovery(self) -> None:
+        running = self._discovery.running
+        topics = self._discovery.poll()
+        if topics is not None:
+            self.set_topics(topics)
+        if running:
+            self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_discovery)
+
+    def _poll_prober(self) -> None:
+        running = self._prober.running
+        results = self._prober.poll()
+        for stats in results.values():
+            self._stats[stats.topic] = stats
+            self._show_values(stats.topic)
+        if results:
+            self.parent.update_selection_summary()
+        if running:
+            self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_prober)
+
+    def _show_values(self, topic: str) -> None:
+        stats = self._stats.get(topic)
+        if stats is None:
+            self.set_values(topic, ("", "", self._throttle_text(topic)))
+        else:
+            self.set_values(topic, (f"{stats.rate:.1f} Hz", f"{format_bytes(stats.bandwidth)}/s",
+                                    self._throttle_text(topic)))
+
+    def _throttle_text(self, topic: str) -> str:
+        return f"{self._throttles[topic]:g} Hz" if topic in self._throttles else ""
+
+    def _on_selection_changed(self, event: tk.Event) -> None:
+        self.parent.update_selection_summary()
+
+
+class ProfileListWindow(ModalWindow):
+    COLUMNS = (("description", "description", 240), ("topics", "topics", 60),
+               ("shards", "processes", 70), ("created", "created", 150))
+
+    _profile_paths: Dict[str, str]
+    _profile_list: ScrollableTreeview
+    _button_frame: Frame
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._profile_list = ScrollableTreeview(self, self.COLUMNS, "browse", (0, 0, 0, 1),
+                                                {"padx": 8, "pady": 8, "sticky": "nsew"})
+        self._profile_list.tk_widget.bind("<Double-1>", lambda event: self.on_clicked_record_button())
+        summaries = ProfileIndex().list()
+        self._profile_paths = {os.path.basename(summary.path): summary.path for summary in summaries}
+        self._profile_list.set_rows(list(self._profile_paths))
+        for summary in summaries:
+            self._profile_list.set_values(os.path.basename(summary.path), (
+                summary.description, str(summary.topic_count), str(summary.shard_count), summary.created))
+
+        self._button_frame = Frame(self, (1, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "e"})
+        Button(self._button_frame, "cancel", self.on_close, (0, 0), {"padx": 4})
+        Button(self._button_frame, "browse", self.on_clicked_browse_button, (0, 1), {"padx": 4})
+        Button(self._button_frame, "record", self.on_clicked_record_button, (0, 2), {"padx": 4})
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_clicked_record_button(self) -> None:
+        selected = self._profile_list.get_selected()
+        if not selected:
+            return
+        self.tk_widget.destroy()
+        self.parent.record_from_profile(self._profile_paths[selected[0]])
+
+    def on_clicked_browse_button(self) -> None:
+        self.tk_widget.destroy()
+        self.parent.browse_profile()
+
+    def on_close(self) -> None:
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+
+class ShardPlanWindow(ModalWindow):
+    _profile: Profile
+    _plan: ShardPlan
+    _summary_label: Label
+    _plan_text: ScrollableText
+    _button_frame: Frame
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str, profile: Profile, plan: ShardPlan) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._profile = profile
+        self._plan = plan
+        summary = (f"{sum(len(topics) for topics in plan.shards)} topics on {len(plan.shards)} recorder processes, " +
+                   f"{plan.measured} measured" + "\n" +
+                   f"busiest process: {plan.imbalance:.2f} x average bandwidth")
+        self._summary_label = Label(self, summary, (0, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "w"})
+        self._plan_text = ScrollableText(self, 16, (1, 0, 1, 1), {"padx": 8, "sticky": "nsew"})
+        lines = []
+        for i, topics in enumerate(plan.shards):
+            lines.append(f"process {i}: {len(topics)} topics, {format_bytes(plan.bandwidths[i])}/s")
+            lines.extend("    " + topic for topic in topics)
+        self._plan_text.append(lines)
+        self._button_frame = Frame(self, (2, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "e"})
+        Button(self._button_frame, "cancel", self.on_close, (0, 0), {"padx": 4})
+        Button(self._button_frame, "start recording", self.on_clicked_start_button, (0, 1), {"padx": 4})
+        self.tk_widget.rowconfigure(0, weight=0)
+        self.tk_widget.rowconfigure(1, weight=1)
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_clicked_start_button(self) -> None:
+        self.tk_widget.destroy()
+        self.parent.open_record_process(self._profile, self._plan.shards)
+
+    def on_close(self) -> None:
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+
+class PreflightWindow(ModalWindow):
+    POLL_INTERVAL_MS = 100
 
-    @staticmethod
-    def fetch_topics() -> Tuple[str]:
-        return tuple(subprocess.run(
-            ["rostopic", "list"], capture_output=True, text=True).stdout.split())
+    _profile: Profile
+    _results: queue.Queue
+    _verdict_label: Label
+    _findings_text: ScrollableText
+    _button_frame: Frame
+    _start_button: Button
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str, profile: Profile, plan: ShardPlan) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._profile = profile
+        self._results = queue.Queue()
+        self._verdict_label = Label(self, "checking the output disk...", (0, 0),
+                                    {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "w"})
+        self._findings_text = ScrollableText(self, 8, (1, 0, 1, 1), {"padx": 8, "sticky": "nsew"})
+        self._button_frame = Frame(self, (2, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "e"})
+        Button(self._button_frame, "cancel", self.on_close, (0, 0), {"padx": 4})
+        self._start_button = Button(self._button_frame, "start recording", self.on_clicked_start_button,
+                                    (0, 1), {"padx": 4})
+        self._start_button.tk_widget.state(["disabled"])  # type: ignore
+        self.tk_widget.rowconfigure(0, weight=0)
+        self.tk_widget.rowconfigure(1, weight=1)
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        threading.Thread(target=lambda: self._results.put(run_preflight(profile, plan)), daemon=True).start()
+        self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_result)
+
+    def on_clicked_start_button(self) -> None:
+        self.tk_widget.destroy()
+        self.parent.start_recording(self._profile, check=False)
+
+    def on_close(self) -> None:
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+    def _poll_result(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        try:
+            report = self._results.get_nowait()
+        except queue.Empty:
+            self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_result)
+            return
+        texts = {"go": "go: the disk can keep up with this recording",
+                 "warn": "warn: the recording may lose messages or run out of space",
+                 "stop": "stop: the recording would lose messages or run out of space"}
+        self._verdict_label.tk_widget.configure(text=texts[report.verdict])  # type: ignore
+        self._findings_text.append(report.lines())
+        if report.verdict != "stop":
+            self._start_button.tk_widget.state(["!disabled"])  # type: ignore
+
+
+class BufferAdviceWindow(ModalWindow):
+    _recommendation: BufferRecommendation
+    _advice_label: Label
+    _button_frame: Frame
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str,
+                 recommendation: BufferRecommendation) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._recommendation = recommendation
+        text = (recommendation.reason + "\n\n" +
+                f"recommended: buffer {recommendation.buffer_mb} MB (-b), chunk size {recommendation.chunk_kb} KB")
+        self._advice_label = Label(self, text, (0, 0), {"padx": 8, "pady": 8, "sticky": "w"})
+        self._advice_label.tk_widget.configure(wraplength=480)  # type: ignore
+        self._button_frame = Frame(self, (1, 0), {"padx": 8, "pady": 8, "sticky": "e"})
+        target = "profile" if parent.profile_path is not None else "settings"
+        Button(self._button_frame, "close", self.on_close, (0, 0), {"padx": 4})
+        Button(self._button_frame, f"apply to {target}", self.on_clicked_apply_button, (0, 1), {"padx": 4})
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_clicked_apply_button(self) -> None:
+        self.parent.apply_buffer_recommendation(self._recommendation)
+        self.on_close()
+
+    def on_close(self) -> None:
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+
+class RepairWindow(ModalWindow):
+    POLL_INTERVAL_MS = 500
+    WORKERS = 2
+
+    _job: RepairJob
+    _summary_label: Label
+    _file_list: ScrollableTreeview
+    _button_frame: Frame
+    _cancel_button: Button
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str, directory: str) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._job = RepairJob(directory, self.WORKERS)
+        self._summary_label = Label(self, "", (0, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "w"})
+        self._file_list = ScrollableTreeview(
+            self, (("size", "size", 90), ("progress", "progress", 70), ("state", "state", 240)), "browse",
+            (1, 0, 1, 1), {"padx": 8, "sticky": "nsew"})
+        self._file_list.tk_widget.column("#0", width=420)
+        self._button_frame = Frame(self, (2, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "e"})
+        self._cancel_button = Button(self._button_frame, "cancel", self._job.cancel, (0, 0), {"padx": 4})
+        Button(self._button_frame, "close", self.on_close, (0, 1), {"padx": 4})
+        self.tk_widget.rowconfigure(0, weight=0)
+        self.tk_widget.rowconfigure(1, weight=1)
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        status = self._job.status()
+        if not status.items:
+            self._summary_label.tk_widget.configure(text="No .bag.active files under " + directory)  # type: ignore
+            self._cancel_button.tk_widget.state(["disabled"])  # type: ignore
+            return
+        self._file_list.set_rows([item.path for item in status.items])
+        self._job.start()
+        self._poll_status()
+
+    def on_close(self) -> None:
+        """ Closes the window; the files being reindexed are finished in the background.
+        """
+        self._job.cancel()
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+    def _poll_status(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        status = self._job.status()
+        for item in status.items:
+            state = f"{item.state}: {item.message}" if item.message else item.state
+            self._file_list.set_values(item.path, (format_bytes(item.size), f"{item.progress * 100:.0f} %", state))
+        self._summary_label.tk_widget.configure(text=format_repair_status(status))  # type: ignore
+        if status.finished:
+            self._cancel_button.tk_widget.state(["disabled"])  # type: ignore
+            return
+        self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_status)
+
+
+class BagInfoWindow(ModalWindow):
+    POLL_INTERVAL_MS = 100
+
+    _results: queue.Queue
+    _infos: Dict[str, BagInfo]
+    _summary_label: Label
+    _bag_list: ScrollableTreeview
+    _topic_text: ScrollableText
+    _button_frame: Frame
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str, directory: str) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._results = queue.Queue()
+        self._infos = {}
+        self._summary_label = Label(self, "reading " + directory + "...", (0, 0),
+                                    {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "w"})
+        self._bag_list = ScrollableTreeview(
+            self, (("size", "size", 80), ("duration", "duration", 80), ("messages", "messages", 90),
+                   ("compression", "compression", 110)), "browse",
+            (1, 0, 1, 1), {"padx": 8, "sticky": "nsew"})
+        self._bag_list.tk_widget.column("#0", width=320)
+        self._bag_list.tk_widget.bind("<<TreeviewSelect>>", self._on_select)
+        self._topic_text = ScrollableText(self, 10, (2, 0, 2, 1), {"padx": 8, "pady": 8, "sticky": "nsew"})
+        self._button_frame = Frame(self, (3, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "e"})
+        Button(self._button_frame, "close", self.on_close, (0, 0), {"padx": 4})
+        self.tk_widget.rowconfigure(0, weight=0)
+        self.tk_widget.rowconfigure(1, weight=1)
+        self.tk_widget.rowconfigure(2, weight=1)
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+
+        def read() -> None:
+            cache = BagInfoCache(directory)
+            self._results.put((cache.list(), cache.errors))
+
+        threading.Thread(target=read, daemon=True).start()
+        self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_result)
+
+    def on_close(self) -> None:
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+    def _poll_result(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        try:
+            infos, errors = self._results.get_nowait()
+        except queue.Empty:
+            self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_result)
+            return
+        self._infos = {os.path.basename(info.path): info for info in infos}
+        self._bag_list.set_rows(list(self._infos))
+        for name, info in self._infos.items():
+            ratio = f" ({info.ratio * 100:.0f} %)" if info.ratio is not None else ""
+            self._bag_list.set_values(name, (format_bytes(info.size), format_duration(info.duration),
+                                             str(info.message_count), info.compression + ratio))
+        summary = f"{len(infos)} bag files, {sum(info.message_count for info in infos)} messages"
+        if errors:
+            summary += f", {len(errors)} not readable (see below)"
+            self._topic_text.append([f"{path}: {error}" for path, error in errors.items()])
+        self._summary_label.tk_widget.configure(text=summary)  # type: ignore
+
+    def _on_select(self, event: tk.Event) -> None:
+        selected = self._bag_list.get_selected()
+        info = self._infos.get(selected[0]) if selected else None
+        if info is None:
+            return
+        lines = ["", f"{info.path}: {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info.start))} - "
+                     f"{time.strftime('%H:%M:%S', time.localtime(info.end))}, {info.chunk_count} chunks"]
+        lines.extend(f"    {topic.topic}  {topic.count} msgs  {topic.type}" for topic in info.topics)
+        self._topic_text.append(lines)
+
+
+class SnapshotWindow(ModalWindow):
+    POLL_INTERVAL_MS = 500
+
+    _status_label: Label
+    _dump_text: ScrollableText
+    _button_frame: Frame
+    _dump_button: Button
+    _shown_dumps: int
+
+    def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str) -> None:
+        super().__init__(parent, master, title)
+        self.parent: BagRecFrame
+        self.tk_widget: tk.Toplevel
+
+        self._shown_dumps = 0
+        self._status_label = Label(self, "", (0, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "w"})
+        self._dump_text = ScrollableText(self, 8, (1, 0, 1, 1), {"padx": 8, "sticky": "nsew"})
+        self._button_frame = Frame(self, (2, 0), {"columnspan": 2, "padx": 8, "pady": 8, "sticky": "e"})
+        Button(self._button_frame, "stop", self.on_close, (0, 0), {"padx": 4})
+        self._dump_button = Button(self._button_frame, "dump (F9)", self.on_clicked_dump_button, (0, 1), {"padx": 4})
+        self.tk_widget.rowconfigure(0, weight=0)
+        self.tk_widget.rowconfigure(1, weight=1)
+        self.tk_widget.bind("<F9>", lambda event: self.on_clicked_dump_button())
+        self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._poll_status()
+
+    @property
+    def session(self) -> SnapshotSession:
+        assert self.parent.snapshot_session is not None
+        return self.parent.snapshot_session
+
+    def on_clicked_dump_button(self) -> None:
+        if self.session.poll() is None:
+            self._dump_text.append(["dumping to " + self.session.dump()])
+
+    def on_close(self) -> None:
+        """ Stops buffering once the requested dumps are written; the buffers are not written.
+        """
+        self.session.shutdown()
+        self.parent.parent.parent.tk_widget.grab_set()
+        self.tk_widget.destroy()
+
+    def _poll_status(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        session = self.session
+        dumps = session.dumps
+        lines = []
+        for dump in dumps[self._shown_dumps:]:
+            if dump.ok:
+                lines.append(f"written in {dump.latency * 1000:.0f} ms: {dump.path}")
+            else:
+                lines.append(f"failed: {dump.path}: {dump.message}")
+        self._shown_dumps = len(dumps)
+        self._dump_text.append(lines)
+
+        limits = []
+        if session.settings.duration is not None:
+            limits.append(f"{session.settings.duration:g} s")
+        if session.settings.size_mb is not None:
+            limits.append(f"{session.settings.size_mb:g} MB")
+        memory = session.memory_bytes()
+        text = (f"Buffering the last {' / '.join(limits)} of {len(session.topics)} topics in memory." + "\n" +
+                f"memory used: {format_bytes(memory) if memory is not None else '--'}" + "\n" +
+                f"dumps: {sum(dump.ok for dump in dumps)} written, {session.pending} pending")
+        if session.poll() is not None:
+            text = ("rosbag_snapshot has exited. Causes may be:" + "\n\n" +
+                    "\n".join(session.output.buffer.tail(20, "stderr")))
+            self._dump_button.tk_widget.state(["disabled"])  # type: ignore
+        self._status_label.tk_widget.configure(text=text)  # type: ignore
+        if session.poll() is None:
+            self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_status)
 
 
 class RecordingWindow(ModalWindow):
-    _recording_frame: Frame
+    POLL_INTERVAL_MS = 100
+
+    _recording_frame: RecordingFrame
+    _throughput_frame: ThroughputFrame
+    _resources_frame: ResourcesFrame
+    _log_frame: RecorderLogFrame
+    _shutdown_queue: Optional[queue.Queue]
 
     def __init__(self, parent: BagRecFrame, master: tk.Tk, title: str) -> None:
         super().__init__(parent, master, title)
         self.parent: BagRecFrame
         self.tk_widget: tk.Toplevel
 
+        self._shutdown_queue = None
         self._recording_frame = RecordingFrame(self, (0, 0), {"padx": 8, "pady": 8})
+        self._throughput_frame = ThroughputFrame(self, (1, 0), {"padx": 8, "pady": 8, "sticky": "ew"})
+        self._resources_frame = ResourcesFrame(self, (2, 0), {"padx": 8, "pady": 8, "sticky": "ew"})
+        self._log_frame = RecorderLogFrame(self, (3, 0), {"padx": 8, "pady": 8, "sticky": "nsew"})
+        self.tk_widget.rowconfigure(0, weight=0)
+        self.tk_widget.rowconfigure(3, weight=1)
         self.tk_widget.protocol("WM_DELETE_WINDOW", self.on_close)
 
-    def kill_rosbag_record_process(self) -> None:
-        ret = subprocess.run(["kill", "-0", str(self.parent.rosbag_record_process.pid)],
-                             stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-        if ret.returncode == 0:
-            subprocess.run(["kill", "-TERM", str(self.parent.rosbag_record_process.pid)],
-                           stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
-            print("[SmartBagRec] Recording has been stopped.")
+    @property
+    def session(self) -> RecordingSession:
+        assert self.parent.session is not None
+        return self.parent.session
 
-    def __del__(self) -> None:
-        self.kill_rosbag_record_process()
+    @property
+    def stopping(self) -> bool:
+        return self._shutdown_queue is not None
 
-    def on_close(self) -> None:
-        self.kill_rosbag_record_process()
+    def stop_recording(self) -> None:
+        """ Stops the recorders in the background, and closes the window once their bag files are finalized.
+        """
+        if self.stopping:
+            return
+        self._shutdown_queue = queue.Queue()
+        self._recording_frame.show_stopping()
+        shutdown_queue = self._shutdown_queue
+        timeout = self.parent.stop_timeout
+        threading.Thread(target=lambda: shutdown_queue.put(self.session.shutdown(timeout)), daemon=True).start()
+        self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_shutdown)
+
+    def _poll_shutdown(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        assert self._shutdown_queue is not None
+        try:
+            report = self._shutdown_queue.get_nowait()
+        except queue.Empty:
+            self.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_shutdown)
+            return
+        print("[SmartBagRec] Recording has been stopped.")
+        report_shutdown(report)
+        self.session.finish_splits_in_background()
+        if not report.finalized:
+            messagebox.showwarning(
+                "bag files not finalized",
+                "These bag files were not finalized and need 'rosbag reindex',\n"
+                "or 'ros2 bag reindex' of their directory:\n\n" + "\n".join(report.unfinalized),
+                parent=self.tk_widget)
+        self.close()
+
+    def close(self) -> None:
+        """ Closes the window once recording has ended, and offers a larger buffer if messages were dropped.
+        """
         self.tk_widget.destroy()
+        self.parent.show_buffer_advice()
+
+    def on_close(self) -> None:
+        self.stop_recording()
+
+
+def report_shutdown(report: ShutdownReport) -> None:
+    for line in report.lines():
+        print("[SmartBagRec] " + line)
 
 
 class RecordingFrame(Frame):
@@ -448,15 +1605,25 @@ class RecordingFrame(Frame):
         self._recording_label = Label(self, text, (0, 0), {"padx": 4, "pady": 4})
         self._recording_label.tk_widget.after(1000, self._timer_callback)
 
+    def show_stopping(self) -> None:
+        text = ("Stopping..." + "\n" +
+                "Waiting for the recorders to finalize the bag files.")
+        self._recording_label.tk_widget.configure(text=text)  # type: ignore
+
     def _timer_callback(self) -> None:
-        if self.parent.parent.rosbag_record_process.poll() == 0:
-            self.parent.tk_widget.destroy()
-            print("[SmartBagRec] Recording has been stopped.")
+        if not self.tk_widget.winfo_exists() or self.parent.stopping:
+            return
+        session = self.parent.session
+        if session.poll() == 0:
+            # the recorders exited by themselves, e.g. after --duration; check their bag files all the same
+            self.parent.stop_recording()
             return
-        elif self.parent.parent.rosbag_record_process.poll():
+        elif session.poll():
+            session.stop()
+            session.finish_splits_in_background()
             text = ("Something went wrong during recording." + "\n" +
                     "Causes may be:" + "\n\n" +
-                    self.parent.parent.rosbag_record_process.stderr.read().decode("utf-8"))  # type: ignore
+                    "\n".join(session.error_lines(20)))
             self._recording_label.tk_widget.configure(text=text)  # type: ignore
             print("[SmartBagRec]", text)
             return
@@ -467,3 +1634,114 @@ class RecordingFrame(Frame):
                 f"({self._recording_sec // 60 :02d}:{self._recording_sec % 60 :02d})")
         self._recording_label.tk_widget.configure(text=text)  # type: ignore
         self._recording_label.tk_widget.after(1000, self._timer_callback)
+
+
+class ThroughputFrame(Labelframe):
+    SAMPLE_INTERVAL_MS = 1000
+
+    _throughput_label: Label
+
+    def __init__(self, parent: RecordingWindow, pos: Pos, grid_opt: dict = {}) -> None:
+        super().__init__(parent, "throughput", pos, grid_opt)
+        self.parent: RecordingWindow
+        self.tk_widget: ttk.Labelframe
+
+        self._throughput_label = Label(
+            self, "waiting for the first bag file...", (0, 0), {"padx": 4, "pady": 4, "sticky": "w"})
+        self._throughput_label.tk_widget.after(self.SAMPLE_INTERVAL_MS, self._sample_callback)
+
+    def _sample_callback(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        session = self.parent.session
+        sample = session.sample()
+        text = (f"recorder processes: {len(session.recorders)}" + "\n" +
+                f"write rate: {sample.rate / 1024 / 1024:.2f} MB/s" + "\n" +
+                f"total: {format_bytes(sample.total_bytes)}" + "\n" +
+                f"splits: {sample.split_count} finished, {sample.active_count} active" + "\n" +
+                f"free space: {format_bytes(sample.free_bytes)}" + "\n" +
+                f"disk full in: {format_duration(sample.seconds_until_full)}")
+        pipeline_status = session.pipeline_status()
+        if pipeline_status is not None:
+            text += ("\n" + f"post-processing: {pipeline_status.done} done, {pipeline_status.running} running, " +
+                     f"{pipeline_status.queued} queued, {pipeline_status.failed} failed")
+            if session.falling_behind:
+                text += "\n" + "post-processing is falling behind, finished splits are held back"
+        if session.tracks_overflows:
+            text += ("\n" + f"dropped messages (buffer exceeded): {session.overflow_count}, " +
+                     f"{session.overflows_since(time.time() - 60)} in the last minute")
+        if session.retention:
+            count, size = session.evicted
+            text += "\n" + f"deleted by retention: {count} files ({format_bytes(size)})"
+        checksum_status = session.checksum_status()
+        if checksum_status is not None:
+            text += "\n" + format_checksum_status(checksum_status)
+        offload_status = session.offload_status()
+        if offload_status is not None:
+            text += "\n" + "offload: " + format_offload_status(offload_status)
+        self._throughput_label.tk_widget.configure(text=text)  # type: ignore
+        if session.poll() is None:
+            self._throughput_label.tk_widget.after(self.SAMPLE_INTERVAL_MS, self._sample_callback)
+
+
+class ResourcesFrame(Labelframe):
+    SAMPLE_INTERVAL_MS = 1000
+
+    _resources_label: Label
+
+    def __init__(self, parent: RecordingWindow, pos: Pos, grid_opt: dict = {}) -> None:
+        super().__init__(parent, "recorder resources", pos, grid_opt)
+        self.parent: RecordingWindow
+        self.tk_widget: ttk.Labelframe
+
+        limits = self.parent.session.resource_limits
+        text = "limits: " + (limits.describe() if limits is not None else "none")
+        self._resources_label = Label(self, text, (0, 0), {"padx": 4, "pady": 4, "sticky": "w"})
+        self._resources_label.tk_widget.after(self.SAMPLE_INTERVAL_MS, self._sample_callback)
+
+    def _sample_callback(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        session = self.parent.session
+        limits = session.resource_limits
+        lines = ["limits: " + (limits.describe() if limits is not None else "none")]
+        for i, (recorder, usage) in enumerate(zip(session.recorders, session.resource_usage())):
+            # what the recorder runs with, as read back; some limits need privileges and may not have been applied
+            applied = recorder.resources.applied()
+            lines.append(f"recorder {i}: {format_usage(usage)}" + "\n" +
+                         "    runs with: " + ((", ".join(applied) or "unknown") if applied is not None else "starting..."))
+        self._resources_label.tk_widget.configure(text="\n".join(lines))  # type: ignore
+        if session.poll() is None:
+            self._resources_label.tk_widget.after(self.SAMPLE_INTERVAL_MS, self._sample_callback)
+
+
+class RecorderLogFrame(Labelframe):
+    POLL_INTERVAL_MS = 250
+
+    _log_text: ScrollableText
+    _next_seqs: List[int]
+
+    def __init__(self, parent: RecordingWindow, pos: Pos, grid_opt: dict = {}) -> None:
+        super().__init__(parent, "recorder output", pos, grid_opt)
+        self.parent: RecordingWindow
+        self.tk_widget: ttk.Labelframe
+
+        self._next_seqs = [0] * len(self.parent.session.recorders)
+        self._log_text = ScrollableText(self, 12, (0, 0, 0, 1), {"sticky": "nsew"})
+        self._log_text.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_callback)
+
+    def _poll_callback(self) -> None:
+        if not self.tk_widget.winfo_exists():
+            return
+        recorders = self.parent.session.recorders
+        new_lines = []
+        for i, recorder in enumerate(recorders):
+            lines = recorder.output.buffer.since(self._next_seqs[i])
+            if not lines:
+                continue
+            self._next_seqs[i] = lines[-1][0] + 1
+            prefix = f"[shard {i}] " if len(recorders) > 1 else ""
+            new_lines.extend(prefix + line for _, _, line in lines)
+        self._log_text.append(new_lines)
+        if new_lines or not all(recorder.output.finished for recorder in recorders):
+            self._log_text.tk_widget.after(self.POLL_INTERVAL_MS, self._poll_callback)
@@ -0,0 +1,517 @@
+""" A local control API for starting, stopping and querying recordings, e.g. from test automation.
+
+``ControlServer`` serves JSON commands with asyncio on a Unix socket, one JSON object per line
+in both directions, and optionally on a localhost HTTP port. Both go through the same
+``SessionManager`` as the GUI, so either side sees and can stop the sessions of the other.
+
+Commands, with an optional "id" that is echoed back:
+
+- ``{"cmd": "start", "profile": PATH}`` or ``{"cmd": "start", "topics": [...], "options": [...],
+  "output": PREFIX, "shards": N, "backend": "ros1"|"ros2", "throttles": {TOPIC: HZ}, "resources": {...}}``:
+  answers as soon as the recorders are spawned
+- ``{"cmd": "stop", "session": N, "timeout": SEC}``: answers once the bag files are finalized
+- ``{"cmd": "list"}`` and ``{"cmd": "status", "session": N}``
+- ``{"cmd": "watch", "session": N, "interval": SEC}``: streams ``"event": "status"`` objects
+  until the session has ended and its last splits are processed, followed by ``"event": "end"``
+
+Every answer has "ok", and "error" if it is false. Over HTTP the same commands are
+``POST /sessions``, ``POST /sessions/N/stop``, ``GET /sessions``, ``GET /sessions/N`` and
+``GET /sessions/N/watch?interval=SEC``, with the JSON command fields as the request body.
+
+A web page open in a browser on the same machine can reach a localhost port too, so every HTTP request
+must carry ``Authorization: Bearer TOKEN`` with the token of ``~/.config/smartbagrec/control.token``,
+which only the user can read, and a ``Host`` naming the port. Requests with an ``Origin`` are refused,
+and POST bodies must be ``application/json``, which a page cannot send without a preflight.
+
+Starting and stopping block on processes, so they run in the default executor
+and never hold up the answers to other clients.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hmac
+import json
+import math
+import os
+import secrets
+import socket
+import threading
+import time
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, Optional, Set, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+from .backend import ROS2, default_backend_name, ros2_storage_options
+from .config import CONFIG_DIR
+from .isolation import ResourceLimits
+from .manager import SessionManager
+from .profile import Profile, load_profile
+from .session import STOP_TIMEOUT_SEC
+
+DEFAULT_SOCKET = os.path.join(CONFIG_DIR, "control.sock")
+DEFAULT_TOKEN_FILE = os.path.join(CONFIG_DIR, "control.token")
+WATCH_INTERVAL_SEC = 1.0
+MAX_REQUEST_BYTES = 1024 ** 2
+HTTP_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found",
+                405: "Method Not Allowed", 415: "Unsupported Media Type", 500: "Internal Server Error"}
+
+
+class ControlError(Exception):
+    """ A command that cannot be carried out, answered with ``"ok": false`` and an HTTP status.
+    """
+
+    status: int
+
+    def __init__(self, message: str, status: int = 400) -> None:
+        super().__init__(message)
+        self.status = status
+
+
+class ControlServer:
+    """ Serves the control API of a session manager until close() is called.
+
+    Attributes:
+        manager (SessionManager): The sessions the API starts and stops
+        socket_path (Optional[str]): The Unix socket, or None for none
+        http_port (Optional[int]): The localhost HTTP port, or None for none
+        stop_timeout (float): The default timeout of the stop command
+        token_path (str): The file holding the token HTTP requests must carry, created if missing
+    """
+
+    manager: SessionManager
+    socket_path: Optional[str]
+    http_port: Optional[int]
+    stop_timeout: float
+    token_path: str
+    _token: Optional[str]
+    _http_hosts: Tuple[str, ...]
+    _loop: Optional[asyncio.AbstractEventLoop]
+    _closed: Optional[asyncio.Event]
+    _ready: threading.Event
+    _thread: Optional[threading.Thread]
+    _error: Optional[BaseException]
+    _clients: Set[asyncio.Task]
+
+    def __init__(self, manager: SessionManager, socket_path: Optional[str] = DEFAULT_SOCKET,
+                 http_port: Optional[int] = None, stop_timeout: float = STOP_TIMEOUT_SEC,
+                 token_path: str = DEFAULT_TOKEN_FILE) -> None:
+        self.manager = manager
+        self.socket_path = socket_path
+        self.http_port = http_port
+        self.stop_timeout = stop_timeout
+        self.token_path = token_path
+        self._token = None
+        self._http_hosts = ()
+        self._loop = None
+        self._closed = None
+        self._ready = threading.Event()
+        self._thread = None
+        self._error = None
+        self._clients = set()
+
+    async def run(self) -> None:
+        """ Serves until close() is called.
+
+        Raises:
+            OSError: If the socket or the port cannot be bound, e.g. because another server uses it
+        """
+        self._loop = asyncio.get_running_loop()
+        self._closed = asyncio.Event()
+        servers = []
+        try:
+            if self.socket_path is not None:
+                _remove_stale_socket(self.socket_path)
+                servers.append(await asyncio.start_unix_server(partial(self._serve, self._answer_lines), self.socket_path))
+                os.chmod(self.socket_path, 0o600)
+                print("[SmartBagRec] Control API listening on " + self.socket_path)
+            if self.http_port is not None:
+                self._token = load_token(self.token_path)
+                server = await asyncio.start_server(partial(self._serve, self._answer_http), "127.0.0.1",
+                                                    self.http_port)
+                servers.append(server)
+                port = server.sockets[0].getsockname()[1]
+                self._http_hosts = (f"127.0.0.1:{port}", f"localhost:{port}")
+                print(f"[SmartBagRec] Control API listening on http://127.0.0.1:{port}"
+                      f" (token in {self.token_path})")
+        except BaseException as e:
+            self._error = e
+            raise
+        finally:
+            self._ready.set()
+        try:
+            await self._closed.wait()
+        finally:
+            for server in servers:
+                server.close()
+            for task in list(self._clients):
+                task.cancel()
+            await asyncio.gather(*self._clients, return_exceptions=True)
+            for server in servers:
+                await server.wait_closed()
+            if self.socket_path is not None and os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def start_in_thread(self) -> None:
+        """ Serves from a thread of its own, as the GUI does, returning once the server listens.
+
+        Raises:
+            OSError: If the socket or the port cannot be bound
+        """
+        self._thread = threading.Thread(target=self._run_thread, name="smartbagrec-control", daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def close(self) -> None:
+        """ Stops serving; callable from any thread, including signal handlers.
+        """
+        if self._loop is not None and self._closed is not None:
+            self._loop.call_soon_threadsafe(self._closed.set)
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5.0)
+
+    def _run_thread(self) -> None:
+        try:
+            asyncio.run(self.run())
+        except OSError:
+            pass  # raised by start_in_thread
+
+    async def handle(self, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        """ Carries out one command, yielding its answer, or the stream of answers of "watch".
+        """
+        try:
+            async for response in self._dispatch(request):
+                response.setdefault("ok", True)
+                if "id" in request:
+                    response["id"] = request["id"]
+                yield response
+        except ControlError as e:
+            response = {"ok": False, "error": str(e), "status": e.status}
+            if "id" in request:
+                response["id"] = request["id"]
+            yield response
+
+    async def _dispatch(self, request: Dict[str, Any]) -> AsyncIterator[Dict[str, Any]]:
+        loop = asyncio.get_running_loop()
+        command = request.get("cmd")
+        if command == "start":
+            yield await loop.run_in_executor(None, self._start, request)
+        elif command == "stop":
+            session = _session_id(request)
+            timeout = _seconds(request, "timeout", self.stop_timeout)
+            report = await loop.run_in_executor(None, self._stop, session, timeout)
+            yield {"session": session, "latency": report.latency, "signals": report.signals,
+                   "unfinalized": report.unfinalized, "finalized": report.finalized}
+        elif command == "list":
+            sessions = self.manager.list()
+            yield {"sessions": await loop.run_in_executor(None, lambda: [managed.status() for managed in sessions])}
+        elif command == "status":
+            managed = self._get(_session_id(request))
+            yield await loop.run_in_executor(None, managed.status)
+        elif command == "watch":
+            managed = self._get(_session_id(request))
+            interval = max(0.05, _seconds(request, "interval", WATCH_INTERVAL_SEC))
+            while True:
+                status = await loop.run_in_executor(None, managed.status)
+                status["event"] = "status"
+                yield status
+                if status["state"] not in ("recording", "stopping") and not status["finishing"]:
+                    break
+                await asyncio.sleep(interval)
+            yield {"event": "end", "session": managed.id}
+        else:
+            raise ControlError(f"unknown command: {command!r}")
+
+    def _start(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        try:
+            managed = self.manager.start(_request_profile(request))
+        except (ValueError, OSError) as e:
+            raise ControlError(f"cannot start recording: {e}")
+        print(f"[SmartBagRec] Control API started session {managed.id}.")
+        return {"session": managed.id, "recorders": [recorder.spec.directory for recorder in managed.session.recorders],
+                "latency_ms": (time.perf_counter() - start) * 1000}
+
+    def _stop(self, session: int, timeout: float) -> Any:
+        try:
+            report = self.manager.stop(session, timeout)
+        except KeyError:
+            raise ControlError(f"no session {session}", 404)
+        print(f"[SmartBagRec] Control API stopped session {session}.")
+        return report
+
+    def _get(self, session: int) -> Any:
+        try:
+            return self.manager.get(session)
+        except KeyError:
+            raise ControlError(f"no session {session}", 404)
+
+    async def _serve(self, answer: Callable[[asyncio.StreamReader, asyncio.StreamWriter], Awaitable[None]],
+                     reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """ Answers one connection until the client closes it, or until close() cancels it, e.g. during "watch".
+        """
+        task = asyncio.current_task()
+        self._clients.add(task)
+        try:
+            await answer(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            pass
+        finally:
+            self._clients.discard(task)
+            writer.close()
+
+    async def _answer_lines(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        while True:
+            line = await reader.readline()
+            if not line:
+                return
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise ValueError("not an object")
+            except ValueError as e:
+                writer.write(_encode({"ok": False, "error": f"invalid JSON: {e}", "status": 400}))
+                await writer.drain()
+                continue
+            async for response in self.handle(request):
+                writer.write(_encode(response))
+                await writer.drain()
+
+    async def _answer_http(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            method, target, headers, body = await _read_http_request(reader)
+            self._check_http_headers(method, headers)
+            request = _http_command(method, target, body)
+        except ControlError as e:
+            _write_http(writer, e.status, _encode({"ok": False, "error": str(e), "status": e.status}))
+            return
+        except ValueError:
+            _write_http(writer, 400, _encode({"ok": False, "error": "not an HTTP request", "status": 400}))
+            return
+        # the stream of "watch" starts with its first status, so that a refused watch gets its own HTTP status
+        streaming = False
+        async for response in self.handle(request):
+            if not streaming and response.get("event") == "status":
+                streaming = True
+                writer.write(_http_head(200, "application/x-ndjson"))
+            if streaming:
+                writer.write(_encode(response))
+            else:
+                _write_http(writer, int(response.get("status", 200)), _encode(response))
+            await writer.drain()
+
+    def _check_http_headers(self, method: str, headers: Dict[str, str]) -> None:
+        """ Refuses requests a web page could have sent, and requests without the token.
+
+        Raises:
+            ControlError: If the request is not from a local client holding the token
+        """
+        if "origin" in headers:
+            raise ControlError("requests from web pages are not accepted", 403)
+        if headers.get("host", "").lower() not in self._http_hosts:
+            raise ControlError("the Host header must name this port on 127.0.0.1 or localhost", 403)
+        scheme, _, token = headers.get("authorization", "").partition(" ")
+        if (self._token is None or scheme.lower() != "bearer"
+                or not hmac.compare_digest(token.strip().encode(), self._token.encode())):
+            raise ControlError(f"a bearer token is required, see {self.token_path}", 401)
+        if method == "POST" and headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+            raise ControlError("the body must be sent as application/json", 415)
+
+
+def load_token(path: str = DEFAULT_TOKEN_FILE) -> str:
+    """ Returns the token of the HTTP API, creating the file with a random one if there is none.
+
+    The file is made readable by the user only, even if it already existed.
+
+    Raises:
+        OSError: If the file cannot be read or created
+    """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        os.chmod(path, 0o600)
+        with open(path, "r") as f:
+            token = f.read().strip()
+        if token:
+            return token
+        fd = os.open(path, os.O_WRONLY | os.O_TRUNC)
+    token = secrets.token_urlsafe(32)
+    with os.fdopen(fd, "w") as f:
+        f.write(token + "\n")
+    return token
+
+
+def _session_id(request: Dict[str, Any]) -> int:
+    try:
+        return int(request["session"])
+    except (KeyError, TypeError, ValueError):
+        raise ControlError("a session number is required")
+
+
+def _seconds(request: Dict[str, Any], name: str, default: float) -> float:
+    try:
+        value = float(request.get(name, default))
+    except (TypeError, ValueError):
+        raise ControlError(f"{name} must be a number of seconds")
+    if not math.isfinite(value) or value < 0:
+        raise ControlError(f"{name} must be a number of seconds")
+    return value
+
+
+def _request_profile(request: Dict[str, Any]) -> Profile:
+    """ The profile of a start command, loaded from its path or made from its topics.
+
+    Raises:
+        ControlError: If the command has neither a valid profile nor topics
+        OSError: If the directory of the output prefix cannot be created
+    """
+    if "profile" in request:
+        profile = load_profile(str(request["profile"]))
+        if profile is None:
+            raise ControlError(f"not a valid profile: {request['profile']}")
+        return profile
+    topics = request.get("topics")
+    if not isinstance(topics, list) or not topics:
+        raise ControlError("start needs a profile or a list of topics")
+    output = str(request.get("output", ""))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    backend = str(request.get("backend", default_backend_name()))
+    try:
+        options = [str(option) for option in request.get("options", [])]
+        if backend == ROS2 and not any(option in ("-s", "--storage") for option in options):
+            # ROS 2 records MCAP with zstd chunks unless the command picks a storage itself
+            options = ros2_storage_options() + options
+        throttles = {str(topic): float(rate) for topic, rate in dict(request.get("throttles", {})).items()}
+        resources = request.get("resources")
+        return Profile([str(topic) for topic in topics], options, "prefix" if output else "current_dir", output,
+                       int(request.get("shards", 1)), backend=backend, throttles=throttles,
+                       resources=ResourceLimits.from_dict(dict(resources)) if resources else None)
+    except (TypeError, ValueError) as e:
+        raise ControlError(str(e))
+
+
+def _remove_stale_socket(path: str) -> None:
+    """ Removes a socket file left by a server that is gone, refusing to take over a live one.
+    """
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        return
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(path)
+        except OSError:
+            os.remove(path)
+            return
+    raise OSError(f"another smartbagrec is already serving on {path}")
+
+
+def _encode(response: Dict[str, Any]) -> bytes:
+    return (json.dumps(response) + "\n").encode()
+
+
+async def _read_http_request(reader: asyncio.StreamReader) -> Tuple[str, str, Dict[str, str], bytes]:
+    """ Reads the method, the target, the headers with lowercase names, and the body of a request.
+    """
+    request_line = (await reader.readline()).decode("latin-1").split()
+    if len(request_line) != 3:
+        raise ValueError("not an HTTP request")
+    headers: Dict[str, str] = {}
+    while True:
+        line = (await reader.readline()).decode("latin-1").strip()
+        if not line:
+            break
+        name, _, value = line.partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0"))
+    if length > MAX_REQUEST_BYTES:
+        raise ControlError("request body too large")
+    body = await reader.readexactly(length) if length else b""
+    return request_line[0], request_line[1], headers, body
+
+
+def _http_command(method: str, target: str, body: bytes) -> Dict[str, Any]:
+    """ Translates an HTTP request into a command of the line protocol.
+    """
+    url = urlsplit(target)
+    parts = [part for part in url.path.split("/") if part]
+    try:
+        request = json.loads(body) if body.strip() else {}
+    except ValueError as e:
+        raise ControlError(f"invalid JSON: {e}")
+    if not isinstance(request, dict):
+        raise ControlError("the body must be a JSON object")
+    for name, values in parse_qs(url.query).items():
+        request.setdefault(name, values[-1])
+    if not parts or parts[0] != "sessions" or len(parts) > 3:
+        raise ControlError(f"no such resource: {url.path}", 404)
+    if len(parts) == 1:
+        commands = {"GET": "list", "POST": "start"}
+    else:
+        request["session"] = parts[1]
+        action = parts[2] if len(parts) == 3 else ""
+        commands = {("GET", ""): "status", ("POST", "stop"): "stop", ("GET", "watch"): "watch"}
+        commands = {method_: command for (method_, action_), command in commands.items() if action_ == action}
+        if not commands:
+            raise ControlError(f"no such resource: {url.path}", 404)
+    if method not in commands:
+        raise ControlError(f"{method} is not allowed on {url.path}", 405)
+    request["cmd"] = commands[method]
+    return request
+
+
+def _http_head(status: int, content_type: str, length: Optional[int] = None) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}", f"Content-Type: {content_type}", "Connection: close"]
+    if length is not None:
+        lines.append(f"Content-Length: {length}")
+    return ("\r\n".join(lines) + "\r\n\r\n").encode()
+
+
+def _write_http(writer: asyncio.StreamWriter, status: int, body: bytes) -> None:
+    writer.write(_http_head(status, "application/json", len(body)) + body)
+
+
+def send_command(request: Dict[str, Any], socket_path: str = DEFAULT_SOCKET,
+                 timeout: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """ Sends one command to a control server, yielding its answers, several for "watch".
+
+    Raises:
+        OSError: If no server listens on the socket
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(timeout)
+        connection.connect(socket_path)
+        connection.sendall(_encode(request))
+        with connection.makefile("r") as lines:
+            for line in lines:
+                response = json.loads(line)
+                yield response
+                if response.get("event") != "status":
+                    return
+
+
+class ControlClient:
+    """ A connection to a control server that is kept open across commands, for low latency.
+    """
+
+    _connection: socket.socket
+    _lines: Any
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: Optional[float] = None) -> None:
+        self._connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._connection.settimeout(timeout)
+        self._connection.connect(socket_path)
+        self._lines = self._connection.makefile("r")
+
+    def request(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """ Sends a command other than "watch" and returns its answer.
+        """
+        self._connection.sendall(_encode(request))
+        return json.loads(self._lines.readline())
+
+    def close(self) -> None:
+        self._lines.close()
+        self._connection.close()
@@ -0,0 +1,106 @@
+""" Topic discovery that never blocks the UI thread.
+
+``rostopic list`` can take seconds, or hang, when the master is slow or unreachable,
+and ``ros2 topic list`` waits for discovery.
+The last known topic list is therefore kept on disk and shown at once,
+and the live list is fetched by a background thread.
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import subprocess
+import threading
+from typing import Optional, Tuple
+
+from .backend import RecorderBackend, default_backend_name, get_backend
+from .config import config_path
+
+TOPIC_CACHE_FILE = "topics.cache"
+FETCH_TIMEOUT_SEC = 10.0
+
+
+def fetch_topics(timeout: float = FETCH_TIMEOUT_SEC,
+                 backend: Optional[RecorderBackend] = None) -> Optional[Tuple[str, ...]]:
+    """ Lists the topics with the tool of ``backend``, or of the sourced ROS environment if it is not given,
+    returning None if the ROS graph could not be reached.
+    """
+    if backend is None:
+        backend = get_backend(default_backend_name())
+    try:
+        result = subprocess.run(
+            backend.list_command, capture_output=True, text=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0:
+        return None
+    return tuple(result.stdout.split())
+
+
+def load_cached_topics() -> Tuple[str, ...]:
+    try:
+        with open(config_path(TOPIC_CACHE_FILE), "r") as f:
+            return tuple(f.read().split())
+    except OSError:
+        return ()
+
+
+def save_cached_topics(topics: Tuple[str, ...]) -> None:
+    path = config_path(TOPIC_CACHE_FILE)
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(topics))
+        os.replace(tmp_path, path)
+    except OSError as e:
+        print(f"[SmartBagRec] Could not write topic cache: {e}")
+
+
+class TopicDiscovery:
+    """ Fetches the topic list in a daemon thread.
+
+    The result is handed over through a queue so that the caller can pick it up
+    from the Tk event loop with ``poll()``; the worker itself never touches a widget.
+
+    Attributes:
+        backend (Optional[RecorderBackend]): The backend whose tool lists the topics,
+            or None for that of the sourced ROS environment
+    """
+
+    backend: Optional[RecorderBackend]
+    _results: queue.Queue
+    _thread: Optional[threading.Thread]
+
+    def __init__(self, backend: Optional[RecorderBackend] = None) -> None:
+        self.backend = backend
+        self._results = queue.Queue()
+        self._thread = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.running:
+            return
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def poll(self) -> Optional[Tuple[str, ...]]:
+        """ Returns the newest fetched topic list, or None if nothing new has arrived.
+        """
+        topics = None
+        while True:
+            try:
+                topics = self._results.get_nowait()
+            except queue.Empty:
+                return topics
+
+    def _run(self) -> None:
+        topics = fetch_topics(backend=self.backend)
+        if topics is None:
+            print("[SmartBagRec] Could not fetch topics, showing the cached list.")
+            return
+        save_cached_topics(topics)
+        self._results.put(topics)
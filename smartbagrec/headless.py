@@ -0,0 +1,518 @@
+""" Recording from a profile, serving the control API, and repairing, offloading and verifying bag files,
+without a display.
+
+This module must not import tkinter, directly or through the modules it uses,
+so that ``bagrec --headless`` starts quickly on robots without a display.
+"""
+
+from __future__ import annotations
+
+import os
+import signal
+import threading
+import time
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Sequence
+
+from .monitor import format_bytes, format_duration
+
+if TYPE_CHECKING:
+    from .checksum import ChecksumSettings, VerifyResult
+    from .offload import OffloadQueue, OffloadSettings, OffloadStatus
+    from .profile import Profile
+    from .session import RecordingSession
+    from .snapshot import SnapshotSession
+    from .telemetry import TelemetrySettings
+
+STATUS_INTERVAL_SEC = 5.0
+
+
+def format_status(session: RecordingSession) -> str:
+    sample = session.sample()
+    elapsed = time.time() - session.started
+    return (f"[SmartBagRec] {format_duration(elapsed)}"
+            f" | {sample.rate / 1024 / 1024:.2f} MB/s"
+            f" | total {format_bytes(sample.total_bytes)}"
+            f" | splits {sample.split_count}+{sample.active_count}"
+            f" | free {format_bytes(sample.free_bytes)}"
+            f" | full in {format_duration(sample.seconds_until_full)}"
+            + (f" | dropped {session.overflow_count}" if session.tracks_overflows else "")
+            + format_resource_status(session)
+            + format_pipeline_status(session)
+            + format_retention_status(session)
+            + format_session_checksum_status(session)
+            + format_session_offload_status(session)
+            + format_relay_status(session))
+
+
+def format_pipeline_status(session: RecordingSession) -> str:
+    status = session.pipeline_status()
+    if status is None:
+        return ""
+    text = f" | post-processing {status.done} done, {status.backlog} left, {status.failed} failed"
+    if session.falling_behind:
+        text += " (falling behind)"
+    return text
+
+
+def format_resource_status(session: RecordingSession) -> str:
+    usages = session.resource_usage()
+    if not any(usage.processes for usage in usages):
+        return ""
+    return (f" | cpu {sum(usage.cpu_percent for usage in usages):.0f}%"
+            f" rss {format_bytes(sum(usage.rss_bytes for usage in usages))}")
+
+
+def print_applied_limits(session: RecordingSession) -> bool:
+    """ Prints the limits each recorder runs with, returning False if a recorder is still starting.
+    """
+    applied = [recorder.resources.applied() for recorder in session.recorders]
+    if any(limits is None for limits in applied):
+        return False
+    for i, limits in enumerate(applied):
+        print(f"[SmartBagRec] Recorder {i} runs with: {', '.join(limits or ['unknown limits, it has exited'])}")
+    return True
+
+
+def format_relay_status(session: RecordingSession) -> str:
+    # the relays are stopped with the recorders, so only the ones exiting while recording are reported
+    if session.relays is None or session.report is not None:
+        return ""
+    exited = session.relays.exited()
+    if not exited:
+        return ""
+    return f" | throttling relays exited: {', '.join(sorted(exited))} (see {session.relays.log_path})"
+
+
+def format_retention_status(session: RecordingSession) -> str:
+    if not session.retention:
+        return ""
+    count, size = session.evicted
+    return f" | deleted {count} ({format_bytes(size)})"
+
+
+def format_session_checksum_status(session: RecordingSession) -> str:
+    from .checksum import format_checksum_status
+
+    status = session.checksum_status()
+    if status is None:
+        return ""
+    return " | " + format_checksum_status(status)
+
+
+def format_session_offload_status(session: RecordingSession) -> str:
+    from .offload import format_offload_status
+
+    status = session.offload_status()
+    if status is None:
+        return ""
+    return " | " + format_offload_status(status)
+
+
+def format_snapshot_status(session: SnapshotSession) -> str:
+    elapsed = time.time() - session.started
+    memory = session.memory_bytes()
+    dumps = session.dumps
+    return (f"[SmartBagRec] {format_duration(elapsed)}"
+            f" | buffering {len(session.topics)} topics"
+            f" | memory {format_bytes(memory) if memory is not None else '--'}"
+            f" | dumps {sum(dump.ok for dump in dumps)} written, {session.pending} pending")
+
+
+def check_before_recording(profile: Profile) -> bool:
+    """ Measures the topics of the profile and runs the pre-flight check, returning False on a stop verdict.
+    """
+    # imported here so that recording without the check does not load them
+    from .backend import get_backend
+    from .planner import compression_of, fixed_plan, plan_shards
+    from .preflight import run_preflight
+    from .probe import probe_topics
+    from .throttle import estimate_saving, throttle_stats
+
+    print(f"[SmartBagRec] Measuring {len(profile.topics)} topics for the pre-flight check...", flush=True)
+    stats = probe_topics(profile.topics, backend=get_backend(profile.backend))
+    if profile.throttles:
+        print(f"[SmartBagRec] Throttling {len(profile.throttles)} topics saves about "
+              f"{format_bytes(estimate_saving(stats, profile.throttles))}/s.", flush=True)
+        stats = throttle_stats(stats, profile.throttles)
+    if profile.shards:
+        plan = fixed_plan(profile.shards, stats)
+    else:
+        plan = plan_shards(profile.topics, stats, profile.shard_count, compression_of(profile.options))
+    report = run_preflight(profile, plan)
+    for line in report.lines():
+        print("[SmartBagRec] " + line)
+    print(f"[SmartBagRec] Pre-flight verdict: {report.verdict}", flush=True)
+    return report.verdict != "stop"
+
+
+def advise_buffer(session: RecordingSession, profile: Profile, file_name: str, apply: bool) -> None:
+    """ Prints a larger buffer if messages were dropped, and writes it into the profile if ``apply`` is set.
+    """
+    from .profile import save_profile
+
+    recommendation = session.recommend_buffer()
+    if recommendation is None:
+        return
+    print("[SmartBagRec] " + recommendation.reason)
+    print(f"[SmartBagRec] Recommended: -b {recommendation.buffer_mb} --chunksize {recommendation.chunk_kb}")
+    if apply:
+        profile.options = recommendation.apply(profile.options)
+        save_profile(file_name, profile)
+        print("[SmartBagRec] Updated the buffer settings of profile: " + file_name)
+    else:
+        print("[SmartBagRec] Run again with --apply-recommendation to write them into the profile.")
+
+
+def record_profile(file_name: str, status_interval: float = STATUS_INTERVAL_SEC, preflight: bool = False,
+                   apply_recommendation: bool = False, stop_timeout: Optional[float] = None,
+                   telemetry: Optional[TelemetrySettings] = None) -> int:
+    """ Records with the given profile until SIGINT/SIGTERM or until the recorders exit.
+
+    On a stop request the recorders get ``stop_timeout`` seconds, ``STOP_TIMEOUT_SEC`` by default,
+    to finalize their bag files before they are terminated.
+
+    With ``preflight`` the output disk is checked first, and nothing is recorded on a stop verdict.
+    If the recorders dropped messages, a larger buffer is printed afterwards,
+    and written into the profile with ``apply_recommendation``.
+    ``telemetry`` takes the place of the telemetry settings of the profile.
+
+    Returns:
+        int: The exit code for the command line, 0 on success, 3 if the pre-flight check stopped it
+            and 4 if a bag file was not finalized
+    """
+    # imported here so that the other sub-commands do not load the recording machinery
+    from .command import split_record_command
+    from .manager import profile_shards
+    from .profile import load_profile
+    from .session import STOP_TIMEOUT_SEC, RecordingSession
+
+    profile = load_profile(file_name)
+    if profile is None:
+        print("[SmartBagRec] Not a valid profile: " + file_name)
+        return 2
+    print("[SmartBagRec] Loaded from profile: " + file_name)
+    if preflight and not check_before_recording(profile):
+        return 3
+
+    if profile.snapshot is not None:
+        return record_snapshots(profile, status_interval)
+
+    options, _ = split_record_command(profile.command)
+    shards = profile_shards(profile)
+
+    stop_requested = threading.Event()
+
+    def on_signal(signum: int, frame: Any) -> None:
+        stop_requested.set()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    try:
+        session = RecordingSession(options, shards, profile.pipeline, profile.retention, profile.offload,
+                                   profile.checksums, profile.throttles, telemetry or profile.telemetry,
+                                   profile.resources)
+    except (ValueError, OSError) as e:
+        print("[SmartBagRec] " + str(e))
+        return 2
+    for recorder in session.recorders:
+        print(f"[SmartBagRec] Recorder output is logged to: {recorder.output.log_path}")
+
+    # what the recorders run with is printed once, as some limits need privileges and may not have been applied
+    limits_printed = session.resource_limits is None
+    while session.poll() is None and not stop_requested.wait(status_interval):
+        print(format_status(session), flush=True)
+        if not limits_printed:
+            limits_printed = print_applied_limits(session)
+
+    stopped = session.poll() is None
+    if stopped:
+        print("[SmartBagRec] Stopping the recorders...", flush=True)
+    report = session.shutdown(STOP_TIMEOUT_SEC if stop_timeout is None else stop_timeout)
+    if stopped:
+        print("[SmartBagRec] Recording has been stopped.")
+    for line in report.lines():
+        print("[SmartBagRec] " + line)
+    print(format_status(session), flush=True)
+
+    # the splits the recorders closed last are handed over here, and the pipeline and the checksums waited for
+    if session.pipeline is not None:
+        print("[SmartBagRec] Waiting for post-processing of the remaining splits...", flush=True)
+    finisher = threading.Thread(target=session.finish_splits)
+    finisher.start()
+    while finisher.is_alive():
+        finisher.join(status_interval)
+        if session.pipeline is not None:
+            print("[SmartBagRec]" + format_pipeline_status(session), flush=True)
+    if session.checksums is not None:
+        print("[SmartBagRec]" + format_session_checksum_status(session), flush=True)
+    if session.offload is not None:
+        wait_for_offload(session.offload, stop_requested, status_interval)
+
+    # only ROS 1 bags can be summarized; the splits of ros2 bag record are listed by its metadata.yaml
+    print_bag_info([path for recorder in session.recorders for path in recorder.monitor.finished_files()
+                    if path.endswith(".bag") and os.path.exists(path)])
+    advise_buffer(session, profile, file_name, apply_recommendation)
+
+    code = session.poll()
+    # a recorder killed by our own stop request is not a failure
+    if code and not (stopped and code < 0):
+        print("[SmartBagRec] Something went wrong during recording. Causes may be:")
+        for line in session.error_lines(20):
+            print(line)
+        return 1
+    if not report.finalized:
+        return 4
+    return 0
+
+
+def wait_for_offload(queue: OffloadQueue, stop_requested: threading.Event, status_interval: float) -> OffloadStatus:
+    """ Waits until the queue has copied every file, or until another SIGINT/SIGTERM
+    leaves the rest to be resumed by the next run.
+    """
+    from .offload import format_offload_status
+
+    stop_requested.clear()
+    if not queue.idle:
+        print("[SmartBagRec] Waiting for the offload of the remaining files; "
+              "press Ctrl-C to resume it in a later run...", flush=True)
+    next_print = time.monotonic() + status_interval
+    while not queue.idle and not stop_requested.wait(0.1):
+        if time.monotonic() >= next_print:
+            print("[SmartBagRec] " + format_offload_status(queue.status()), flush=True)
+            next_print += status_interval
+    queue.shutdown()
+    status = queue.status()
+    print("[SmartBagRec] " + format_offload_status(status), flush=True)
+    return status
+
+
+def record_snapshots(profile: Profile, status_interval: float = STATUS_INTERVAL_SEC) -> int:
+    """ Buffers the topics of the profile in snapshot mode, dumping them on SIGUSR1, until SIGINT/SIGTERM.
+
+    Returns:
+        int: The exit code for the command line, 0 on success, 1 if rosbag_snapshot failed or a dump failed
+            and 2 if the profile is not for ROS 1
+    """
+    from .snapshot import SnapshotSession
+
+    wake = threading.Event()
+    requests = {"dump": 0, "stop": 0}
+
+    def on_signal(signum: int, frame: Any) -> None:
+        requests["dump" if signum == signal.SIGUSR1 else "stop"] += 1
+        wake.set()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+    signal.signal(signal.SIGUSR1, on_signal)
+
+    assert profile.snapshot is not None
+    try:
+        session = SnapshotSession(profile.snapshot, profile.command, profile.topics)
+    except ValueError as e:
+        print("[SmartBagRec] " + str(e))
+        return 2
+    print(f"[SmartBagRec] Snapshot output is logged to: {session.output.log_path}")
+    print(f"[SmartBagRec] Send SIGUSR1 to dump the buffers: kill -USR1 {os.getpid()}", flush=True)
+
+    while session.poll() is None and not requests["stop"]:
+        if not wake.wait(status_interval):
+            print(format_snapshot_status(session), flush=True)
+            continue
+        wake.clear()
+        while requests["dump"]:
+            requests["dump"] -= 1
+            print("[SmartBagRec] Dumping to: " + session.dump(), flush=True)
+
+    failed = session.poll() is not None
+    session.shutdown()
+    print(format_snapshot_status(session), flush=True)
+    if failed:
+        print("[SmartBagRec] rosbag_snapshot exited. Causes may be:")
+        for line in session.output.buffer.tail(20, "stderr"):
+            print(line)
+        return 1
+    return 1 if any(not dump.ok for dump in session.dumps) else 0
+
+
+def print_bag_info(paths: Sequence[str]) -> int:
+    """ Prints the summaries of bag files and of the bag files in directories.
+
+    Returns:
+        int: The exit code for the command line, 0 if every bag could be read and 1 otherwise
+    """
+    from .baginfo import BagInfoCache, format_bag_info
+
+    # None lists the whole directory
+    files_by_directory: Dict[str, Optional[List[str]]] = {}
+    for path in paths:
+        if os.path.isdir(path):
+            files_by_directory[path] = None
+        else:
+            files_by_directory.setdefault(os.path.dirname(os.path.abspath(path)), []).append(path)  # type: ignore
+    errors = 0
+    for directory, files in files_by_directory.items():
+        cache = BagInfoCache(directory)
+        for info in cache.list() if files is None else cache.get(files):
+            print("\n".join(format_bag_info(info)))
+        for bag, error in cache.errors.items():
+            print(f"[SmartBagRec] Cannot read {bag}: {error}")
+        errors += len(cache.errors)
+    return 1 if errors else 0
+
+
+def repair_directory(directory: str, workers: int, status_interval: float = STATUS_INTERVAL_SEC) -> int:
+    """ Reindexes the ``.bag.active`` files under the directory until done or until SIGINT/SIGTERM.
+
+    Returns:
+        int: The exit code for the command line, 0 if every file was repaired or skipped and 1 otherwise
+    """
+    from .repair import RepairJob, format_repair_status
+
+    job = RepairJob(directory, workers)
+    status = job.status()
+    if not status.items:
+        print("[SmartBagRec] No .bag.active files under " + directory)
+        return 0
+    print(f"[SmartBagRec] Repairing {len(status.items)} files with {workers} processes...", flush=True)
+
+    def on_signal(signum: int, frame: Any) -> None:
+        print("[SmartBagRec] Cancelled; finishing the files being reindexed...", flush=True)
+        job.cancel()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    job.start()
+    next_print = time.monotonic() + status_interval
+    while not status.finished:
+        time.sleep(0.1)
+        status = job.status()
+        if status.finished or time.monotonic() >= next_print:
+            print("[SmartBagRec] " + format_repair_status(status), flush=True)
+            next_print += status_interval
+    job.wait()
+    for item in status.items:
+        if item.state == "skipped":
+            print(f"[SmartBagRec] Skipped {item.path}: {item.message}")
+    return 1 if status.count("failed") else 0
+
+
+def offload_directory(source: str, settings: OffloadSettings, status_interval: float = STATUS_INTERVAL_SEC) -> int:
+    """ Copies the finished bag files in the source directory to the destination of the settings,
+    resuming copies an earlier run left unfinished, until done or until SIGINT/SIGTERM.
+
+    Returns:
+        int: The exit code for the command line, 0 if every file was copied, 1 if a copy failed
+            and 5 if it was interrupted
+    """
+    from .offload import OffloadQueue, find_finished_bags
+
+    paths = find_finished_bags(source)
+    if not paths:
+        print("[SmartBagRec] No bag files in " + source)
+        return 0
+    stop_requested = threading.Event()
+
+    def on_signal(signum: int, frame: Any) -> None:
+        stop_requested.set()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    print(f"[SmartBagRec] Offloading {len(paths)} files to {settings.destination}...", flush=True)
+    queue = OffloadQueue(settings)
+    for path in paths:
+        queue.submit(path)
+    status = wait_for_offload(queue, stop_requested, status_interval)
+    if status.failed:
+        return 1
+    return 5 if status.backlog else 0
+
+
+def verify_directory(directory: str, workers: Optional[int] = None, status_interval: float = STATUS_INTERVAL_SEC) -> int:
+    """ Checks the bag files of a directory against its checksum manifest.
+
+    Returns:
+        int: The exit code for the command line, 0 if every listed file matches,
+            1 if a file is missing or does not match and 2 if there is no manifest
+    """
+    from .checksum import VerifyJob, format_verify_summary
+
+    try:
+        job = VerifyJob(directory, workers)
+    except ValueError as e:
+        print("[SmartBagRec] " + str(e))
+        return 2
+    print(f"[SmartBagRec] Verifying {job.file_count} files...", flush=True)
+
+    def on_result(result: VerifyResult) -> None:
+        if result.state != "ok":
+            print(f"[SmartBagRec] {result.name}: {result.state.upper()}", flush=True)
+
+    results: List[VerifyResult] = []
+    worker = threading.Thread(target=lambda: results.extend(job.run(on_result)), daemon=True)
+    worker.start()
+    while worker.is_alive():
+        worker.join(status_interval)
+        if worker.is_alive():
+            done, total, _ = job.progress()
+            print(f"[SmartBagRec] {format_bytes(done)} of {format_bytes(total)} checked", flush=True)
+    for name in job.unlisted:
+        print(f"[SmartBagRec] {name}: not in the manifest")
+    print("[SmartBagRec] " + format_verify_summary(results, job.progress()[2]))
+    return 0 if all(result.state == "ok" for result in results) else 1
+
+
+def manifest_directory(directory: str, settings: ChecksumSettings) -> int:
+    """ Adds the bag files of a directory that are not listed yet to its checksum manifest.
+
+    Returns:
+        int: The exit code for the command line, 0 on success and 1 if a file could not be read
+    """
+    from .checksum import write_manifest
+
+    try:
+        done, failed = write_manifest(directory, settings)
+    except ValueError as e:
+        print("[SmartBagRec] " + str(e))
+        return 2
+    print(f"[SmartBagRec] Added {done} files to the manifest of {directory}"
+          + (f", {failed} failed" if failed else ""))
+    return 1 if failed else 0
+
+
+def serve(socket_path: Optional[str], http_port: Optional[int] = None, stop_timeout: Optional[float] = None,
+          telemetry: Optional[TelemetrySettings] = None) -> int:
+    """ Serves the control API until SIGINT/SIGTERM, then stops the sessions it started.
+
+    With ``telemetry`` every session writes its telemetry there, whatever its profile says.
+
+    Returns:
+        int: The exit code for the command line, 0 on success and 2 if the API could not be served
+    """
+    import asyncio
+
+    from .control import ControlServer
+    from .manager import SessionManager
+    from .session import STOP_TIMEOUT_SEC
+
+    if stop_timeout is None:
+        stop_timeout = STOP_TIMEOUT_SEC
+    manager = SessionManager(telemetry)
+    server = ControlServer(manager, socket_path, http_port, stop_timeout)
+
+    def on_signal(signum: int, frame: Any) -> None:
+        server.close()
+
+    signal.signal(signal.SIGINT, on_signal)
+    signal.signal(signal.SIGTERM, on_signal)
+
+    try:
+        asyncio.run(server.run())
+    except OSError as e:
+        print(f"[SmartBagRec] Control API could not be started: {e}")
+        return 2
+    manager.shutdown(stop_timeout)
+    return 0
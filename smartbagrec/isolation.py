@@ -0,0 +1,402 @@
+""" CPU, I/O and memory isolation of the recorder processes, so that recording does not compete with control loops.
+
+The limits of a profile are applied by starting every recorder through the standard Linux tools,
+each of which sets one limit and then executes the next::
+
+    systemd-run --scope -p CPUQuota=.. -p MemoryHigh=.. -- ionice -c C -n L nice -n N taskset -c CPUS rosbag ..
+
+So the recorder keeps the process id it is signalled by, and its children, e.g. the ``record`` process
+of ``rosbag record``, inherit every limit. The cgroup limits need cgroup v2 and systemd, and unless running
+as root a systemd user instance with the cpu and memory controllers delegated; without them the recorders
+run with the other limits only. The memory limit is a MemoryHigh one: a recorder above it is slowed down
+and its memory reclaimed, instead of being killed halfway through a bag file.
+
+``ResourceMonitor`` reads back from /proc what the recorder actually runs with, since an unprivileged user
+may lower the priority of a process but not raise it, and samples the CPU time and the resident memory
+of the recorder and its children.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from .monitor import format_bytes
+
+IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+NICE_MIN = -20
+NICE_MAX = 19
+IONICE_LEVELS = 8
+CGROUP_ROOT = "/sys/fs/cgroup"
+# the tools of the prefix, which the recorder process runs as until it executes the recorder itself
+PREFIX_COMMANDS = {"systemd-run", "ionice", "nice", "taskset"}
+# CPU time is counted in clock ticks, so shorter windows would mostly show 0 or a multiple of a core
+MIN_USAGE_WINDOW_SEC = 0.5
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+PAGE_SIZE = os.sysconf("SC_PAGE_SIZE")
+
+
+class ResourceLimits:
+    """ The limits each recorder process of a session runs with.
+
+    Attributes:
+        cpus (List[int]): The CPUs the recorders are pinned to, or [] for any
+        nice (Optional[int]): The nice level, from -20 to 19; negative levels need root
+        io_class (Optional[str]): The I/O scheduling class, one of IONICE_CLASSES; realtime needs root
+        io_level (Optional[int]): The priority within the realtime or best-effort class, from 0 (highest) to 7
+        cpu_quota (Optional[float]): The CPUs' worth of time each recorder may use, in a cgroup
+        memory_high (Optional[int]): The bytes of memory above which each recorder is throttled, in a cgroup
+    """
+
+    cpus: List[int]
+    nice: Optional[int]
+    io_class: Optional[str]
+    io_level: Optional[int]
+    cpu_quota: Optional[float]
+    memory_high: Optional[int]
+
+    def __init__(self, cpus: Optional[Sequence[int]] = None, nice: Optional[int] = None, io_class: Optional[str] = None,
+                 io_level: Optional[int] = None, cpu_quota: Optional[float] = None,
+                 memory_high: Optional[int] = None) -> None:
+        """
+        Raises:
+            ValueError: If a limit is out of its range
+        """
+        self.cpus = sorted(set(cpus or []))
+        if self.cpus and self.cpus[0] < 0:
+            raise ValueError(f"Not a CPU: {self.cpus[0]}")
+        if nice is not None and not NICE_MIN <= nice <= NICE_MAX:
+            raise ValueError(f"The nice level must be from {NICE_MIN} to {NICE_MAX}, not {nice}")
+        if io_class is not None and io_class not in IONICE_CLASSES:
+            raise ValueError(f"Unknown I/O class {io_class}, not one of {', '.join(IONICE_CLASSES)}")
+        if io_level is not None:
+            if io_class not in ("realtime", "best-effort"):
+                raise ValueError("Only the realtime and best-effort I/O classes have levels")
+            if not 0 <= io_level < IONICE_LEVELS:
+                raise ValueError(f"The I/O level must be from 0 to {IONICE_LEVELS - 1}, not {io_level}")
+        if cpu_quota is not None and not cpu_quota > 0:
+            raise ValueError(f"The CPU quota must be positive, not {cpu_quota}")
+        if memory_high is not None and not memory_high > 0:
+            raise ValueError(f"The memory limit must be positive, not {memory_high}")
+        self.nice = nice
+        self.io_class = io_class
+        self.io_level = io_level
+        self.cpu_quota = cpu_quota
+        self.memory_high = memory_high
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.cpus) or self.nice is not None or self.io_class is not None or self.cgroup_limited
+
+    @property
+    def cgroup_limited(self) -> bool:
+        return self.cpu_quota is not None or self.memory_high is not None
+
+    def describe(self) -> str:
+        parts = []
+        if self.cpus:
+            parts.append("CPUs " + format_cpu_list(self.cpus))
+        if self.nice is not None:
+            parts.append(f"nice {self.nice}")
+        if self.io_class is not None:
+            parts.append("io " + self.io_class + (f" {self.io_level}" if self.io_level is not None else ""))
+        if self.cpu_quota is not None:
+            parts.append(f"at most {self.cpu_quota:g} CPUs")
+        if self.memory_high is not None:
+            parts.append(f"throttled above {format_bytes(self.memory_high)}")
+        return ", ".join(parts)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"cpus": self.cpus, "nice": self.nice, "io_class": self.io_class, "io_level": self.io_level,
+                "cpu_quota": self.cpu_quota, "memory_high": self.memory_high}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> ResourceLimits:
+        nice = data.get("nice")
+        io_class = data.get("io_class")
+        io_level = data.get("io_level")
+        cpu_quota = data.get("cpu_quota")
+        memory_high = data.get("memory_high")
+        return cls([int(cpu) for cpu in data.get("cpus", [])],
+                   int(nice) if nice is not None else None,
+                   str(io_class) if io_class is not None else None,
+                   int(io_level) if io_level is not None else None,
+                   float(cpu_quota) if cpu_quota is not None else None,
+                   int(memory_high) if memory_high is not None else None)
+
+
+class ResourceUsage:
+    """ What a recorder and its children used.
+
+    Attributes:
+        cpu_percent (float): CPU time per wall time since the previous sample, 100 for each busy core
+        rss_bytes (int): Their resident memory
+        processes (int): The number of processes, 0 once the recorder has exited
+    """
+
+    cpu_percent: float
+    rss_bytes: int
+    processes: int
+
+    def __init__(self, cpu_percent: float, rss_bytes: int, processes: int) -> None:
+        self.cpu_percent = cpu_percent
+        self.rss_bytes = rss_bytes
+        self.processes = processes
+
+
+class ResourceMonitor:
+    """ The limits one recorder runs with and the resources it uses, read from /proc.
+
+    Samples taken within MIN_USAGE_WINDOW_SEC of the previous one return it again,
+    so the GUI, the status lines and the control API can all sample without skewing the CPU figures.
+
+    Attributes:
+        pid (int): The recorder process
+        command (List[str]): The record command it runs, once through the prefix
+    """
+
+    pid: int
+    command: List[str]
+    _last_time: float
+    _last_ticks: Dict[int, int]
+    _usage: Optional[ResourceUsage]
+    _applied: Optional[List[str]]
+    _lock: threading.Lock
+
+    def __init__(self, pid: int, command: Sequence[str], spawned: float) -> None:
+        """
+        Args:
+            pid (int): The recorder process
+            command (Sequence[str]): The record command it runs, once through the prefix
+            spawned (float): The time.monotonic() value at which it was spawned, the start of the first CPU window
+        """
+        self.pid = pid
+        self.command = list(command)
+        self._last_time = spawned
+        self._last_ticks = {}
+        self._usage = None
+        self._applied = None
+        self._lock = threading.Lock()
+
+    def sample(self) -> ResourceUsage:
+        with self._lock:
+            now = time.monotonic()
+            if self._usage is not None and now - self._last_time < MIN_USAGE_WINDOW_SEC:
+                return self._usage
+            ticks = {}
+            rss = 0
+            for pid in _process_tree(self.pid):
+                fields = _read_stat(pid)
+                if fields is None:
+                    continue
+                ticks[pid] = int(fields[11]) + int(fields[12])
+                rss += int(fields[21]) * PAGE_SIZE
+            # a child that exited takes its CPU time with it, which must not count as negative
+            used = sum(max(0, count - self._last_ticks.get(pid, 0)) for pid, count in ticks.items())
+            elapsed = max(now - self._last_time, 1e-3)
+            self._usage = ResourceUsage(used / CLOCK_TICKS / elapsed * 100, rss, len(ticks))
+            self._last_time = now
+            self._last_ticks = ticks
+            return self._usage
+
+    def applied(self) -> Optional[List[str]]:
+        """ The limits the recorder actually runs with, or None while it is still starting through the prefix.
+
+        They are read once; none of them changes afterwards.
+        """
+        with self._lock:
+            if self._applied is None:
+                self._applied = _read_limits(self.pid, self.command)
+            return self._applied
+
+
+def isolation_prefix(limits: ResourceLimits) -> List[str]:
+    """ The commands to start a recorder through, so that it runs with the limits.
+
+    Raises:
+        ValueError: If a CPU to pin to is not available to this process
+    """
+    prefix = []
+    if limits.cgroup_limited:
+        reason = cgroup_unavailable_reason(limits)
+        if reason is not None:
+            print(f"[SmartBagRec] No cgroup limits on the recorders, as {reason}; recording with the other limits.")
+        else:
+            prefix += ["systemd-run", "--scope", "--quiet", "--collect"]
+            if os.geteuid() != 0:
+                prefix.append("--user")
+            if limits.cpu_quota is not None:
+                prefix += ["-p", f"CPUQuota={limits.cpu_quota * 100:g}%"]
+            if limits.memory_high is not None:
+                prefix += ["-p", f"MemoryHigh={limits.memory_high}"]
+            prefix.append("--")
+    if limits.io_class is not None:
+        # -t: without root the realtime class fails, and the recorder should run all the same
+        prefix += ["ionice", "-t", "-c", str(IONICE_CLASSES[limits.io_class])]
+        if limits.io_level is not None:
+            prefix += ["-n", str(limits.io_level)]
+    if limits.nice is not None:
+        # nice warns and runs the command anyway if it may not set the level
+        prefix += ["nice", "-n", str(limits.nice)]
+    if limits.cpus:
+        unavailable = sorted(set(limits.cpus) - os.sched_getaffinity(0))
+        if unavailable:
+            raise ValueError("Cannot pin the recorders to CPUs not available here: " + format_cpu_list(unavailable))
+        prefix += ["taskset", "-c", format_cpu_list(limits.cpus)]
+    return prefix
+
+
+def cgroup_unavailable_reason(limits: ResourceLimits) -> Optional[str]:
+    """ Why the cgroup limits cannot be applied here, or None if they can.
+    """
+    if shutil.which("systemd-run") is None:
+        return "systemd-run is not installed"
+    if not os.path.isdir("/run/systemd/system"):
+        return "systemd is not running"
+    if not os.path.exists(os.path.join(CGROUP_ROOT, "cgroup.controllers")):
+        return "the system does not use cgroup v2"
+    if os.geteuid() == 0:
+        return None
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR", "")
+    if not runtime_dir or not os.path.exists(os.path.join(runtime_dir, "bus")):
+        return "there is no systemd user session"
+    uid = os.getuid()
+    try:
+        with open(f"{CGROUP_ROOT}/user.slice/user-{uid}.slice/user@{uid}.service/cgroup.controllers") as f:
+            controllers = f.read().split()
+    except OSError:
+        # a layout other than the usual one; systemd-run reports what it cannot do
+        return None
+    needed = (["cpu"] if limits.cpu_quota is not None else []) + (["memory"] if limits.memory_high is not None else [])
+    missing = [controller for controller in needed if controller not in controllers]
+    if missing:
+        return f"the {' and '.join(missing)} controller is not delegated to the user (systemd Delegate=)"
+    return None
+
+
+def parse_cpu_list(text: str) -> List[int]:
+    """ Parses a CPU list such as "2,3" or "0-3,6", as taskset and /sys take it.
+
+    Raises:
+        ValueError: If it is not a CPU list
+    """
+    cpus = []
+    for part in text.replace(" ", "").split(","):
+        first, _, last = part.partition("-")
+        cpus.extend(range(int(first), int(last or first) + 1))
+    return sorted(set(cpus))
+
+
+def format_cpu_list(cpus: Sequence[int]) -> str:
+    """ Formats sorted CPUs as a CPU list, with runs as ranges.
+    """
+    ranges: List[List[int]] = []
+    for cpu in cpus:
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else f"{first}-{last}" for first, last in ranges)
+
+
+def format_usage(usage: ResourceUsage) -> str:
+    return f"CPU {usage.cpu_percent:.0f}%, RSS {format_bytes(usage.rss_bytes)}"
+
+
+def _process_tree(pid: int) -> List[int]:
+    pids = [pid]
+    i = 0
+    while i < len(pids):
+        # every thread lists the children it forked
+        try:
+            tids = os.listdir(f"/proc/{pids[i]}/task")
+        except OSError:
+            tids = []
+        for tid in tids:
+            try:
+                with open(f"/proc/{pids[i]}/task/{tid}/children") as f:
+                    pids.extend(int(child) for child in f.read().split())
+            except OSError:
+                continue
+        i += 1
+    return pids
+
+
+def _read_stat(pid: int) -> Optional[List[str]]:
+    """ The fields of /proc/PID/stat from the state on, i.e. field n of proc(5) at index n - 3.
+    """
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            text = f.read()
+    except OSError:
+        return None
+    # the command name in parentheses may itself contain spaces and parentheses
+    return text.rpartition(")")[2].split()
+
+
+def _read_limits(pid: int, command: Sequence[str]) -> Optional[List[str]]:
+    try:
+        with open(f"/proc/{pid}/cmdline", "rb") as f:
+            arguments = f.read().decode(errors="replace").split("\0")[:-1]
+        affinity = os.sched_getaffinity(pid)
+    except OSError:
+        return []
+    # the command line is that of this process until the spawn has executed, and then that of each tool
+    # of the prefix; once the recorder runs, it ends with the record command, run by a script interpreter or not
+    head = arguments[:len(arguments) - len(command) + 1]
+    if (arguments[len(head):] != list(command[1:]) or not head
+            or any(os.path.basename(argument) in PREFIX_COMMANDS for argument in head)):
+        return None
+    fields = _read_stat(pid)
+    if fields is None:
+        return []
+    limits = ["CPUs " + format_cpu_list(sorted(affinity)), "nice " + fields[16]]
+    io_class = _read_io_class(pid)
+    if io_class is not None:
+        limits.append("io " + io_class)
+    return limits + _read_cgroup_limits(pid)
+
+
+def _read_io_class(pid: int) -> Optional[str]:
+    try:
+        result = subprocess.run(["ionice", "-p", str(pid)], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True, timeout=1.0)
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+    if result.returncode != 0 or not result.stdout.strip():
+        return None
+    # e.g. "best-effort: prio 7", or "none: prio 4" for the class derived from the nice level
+    return result.stdout.strip().replace(": prio ", " ")
+
+
+def _read_cgroup_limits(pid: int) -> List[str]:
+    try:
+        with open(f"/proc/{pid}/cgroup") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+    paths = [line[len("0::"):] for line in lines if line.startswith("0::")]
+    if not paths:
+        return []
+    directory = CGROUP_ROOT + paths[0]
+    limits = []
+    quota = _read_first_line(os.path.join(directory, "cpu.max")).split()
+    if len(quota) == 2 and quota[0] != "max":
+        limits.append(f"at most {int(quota[0]) / int(quota[1]):g} CPUs")
+    for name in ("memory.high", "memory.max"):
+        value = _read_first_line(os.path.join(directory, name))
+        if value.isdigit():
+            limits.append(f"{name} {format_bytes(int(value))}")
+    return limits
+
+
+def _read_first_line(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return ""
@@ -0,0 +1,202 @@
+""" The recording sessions of one smartbagrec process, shared by the GUI and the control API.
+
+Every session is started through ``SessionManager``, whichever side asks for it, so that
+the control API lists and can stop a recording started from the GUI and the other way round.
+A ``RecordingSession`` can be shut down from both sides at once; the second caller gets the
+report of the first.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence
+
+from .command import split_record_command
+from .planner import compression_of, plan_shards
+from .profile import Profile
+from .session import STOP_TIMEOUT_SEC, RecordingSession, ShutdownReport
+from .telemetry import TelemetrySettings
+
+SESSION_SOURCES = ("gui", "api")
+SESSION_STATES = ("recording", "stopping", "stopped", "exited", "failed")
+ERROR_LINES = 10
+
+
+def profile_shards(profile: Profile) -> List[List[str]]:
+    """ The topics of each recorder process of a profile, planned without measuring them if not fixed.
+    """
+    if profile.shards:
+        return profile.shards
+    options, topics = split_record_command(profile.command)
+    return plan_shards(topics, {}, profile.shard_count, compression_of(options)).shards
+
+
+class ManagedSession:
+    """ A recording session known to the manager.
+
+    Attributes:
+        id (int): The number of the session, unique within the process
+        source (str): Who started it, one of SESSION_SOURCES
+        profile (Profile): What it records
+        session (RecordingSession): The recorders
+    """
+
+    id: int
+    source: str
+    profile: Profile
+    session: RecordingSession
+
+    def __init__(self, id: int, source: str, profile: Profile, session: RecordingSession) -> None:
+        self.id = id
+        self.source = source
+        self.profile = profile
+        self.session = session
+
+    @property
+    def state(self) -> str:
+        """ One of SESSION_STATES; "exited" is a session whose recorders finished on their own,
+        e.g. after --duration, and "failed" one whose recorder exited with an error.
+        """
+        report = self.session.report
+        if self.session.stopping:
+            return "stopping"
+        code = self.session.poll()
+        if code is None and report is None:
+            return "recording"
+        if report is not None:
+            # a recorder killed by the stop request is not a failure
+            return "failed" if code is not None and code > 0 else "stopped"
+        return "failed" if code else "exited"
+
+    def status(self) -> Dict[str, Any]:
+        """ The state and the throughput of the session, as JSON-compatible values.
+        """
+        sample = self.session.sample()
+        state = self.state
+        status: Dict[str, Any] = {
+            "session": self.id,
+            "source": self.source,
+            "state": state,
+            "started": self.session.started,
+            "elapsed": time.time() - self.session.started,
+            "topics": len(self.profile.topics),
+            "recorders": len(self.session.recorders),
+            "bytes": sample.total_bytes,
+            "rate": sample.rate,
+            "splits": sample.split_count,
+            "active": sample.active_count,
+            "free_bytes": sample.free_bytes,
+            "dropped": self.session.overflow_count if self.session.tracks_overflows else None,
+            "resources": [{"cpu_percent": usage.cpu_percent, "rss_bytes": usage.rss_bytes,
+                           "limits": recorder.resources.applied()}
+                          for recorder, usage in zip(self.session.recorders, self.session.resource_usage())],
+            "errors": self.session.error_lines(ERROR_LINES) if state == "failed" else [],
+            "finishing": self.session.finishing,
+        }
+        relays = self.session.relays
+        if relays is not None:
+            status["throttled"] = {"relays": len(relays.processes), "exited": sorted(relays.exited())}
+        report = self.session.report
+        if report is not None:
+            status["stop_latency"] = report.latency
+            status["unfinalized"] = report.unfinalized
+        for name, stage in (("pipeline", self.session.pipeline_status()),
+                            ("checksums", self.session.checksum_status()),
+                            ("offload", self.session.offload_status())):
+            if stage is not None:
+                status[name] = {"done": stage.done, "failed": stage.failed, "left": stage.backlog}
+        return status
+
+
+class SessionManager:
+    """ Starts, lists and stops the recording sessions of the process; safe to use from several threads.
+
+    Attributes:
+        telemetry (Optional[TelemetrySettings]): Where the telemetry of every session goes,
+            in place of the settings of its profile, e.g. as given on the command line
+    """
+
+    telemetry: Optional[TelemetrySettings]
+    _sessions: Dict[int, ManagedSession]
+    _next_id: int
+    _lock: threading.Lock
+
+    def __init__(self, telemetry: Optional[TelemetrySettings] = None) -> None:
+        self.telemetry = telemetry
+        self._sessions = {}
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def start(self, profile: Profile, shards: Optional[Sequence[Sequence[str]]] = None,
+              source: str = "api") -> ManagedSession:
+        """ Starts recording with a profile, returning as soon as the recorders are spawned.
+
+        Args:
+            profile (Profile): What to record
+            shards (Optional[Sequence[Sequence[str]]]): The topics of each recorder process,
+                planned from the profile if not given
+            source (str): Who starts it, one of SESSION_SOURCES
+
+        Raises:
+            ValueError: If the profile is in snapshot mode, or a checksum algorithm is not available
+            OSError: If a recorder or a throttling relay cannot be started, or the telemetry file cannot be opened
+        """
+        if profile.snapshot is not None:
+            raise ValueError("snapshot profiles cannot be recorded as a session")
+        options, _ = split_record_command(profile.command)
+        session = RecordingSession(options, shards if shards is not None else profile_shards(profile),
+                                   profile.pipeline, profile.retention, profile.offload, profile.checksums,
+                                   profile.throttles, self.telemetry or profile.telemetry, profile.resources)
+        with self._lock:
+            managed = ManagedSession(self._next_id, source, profile, session)
+            self._sessions[managed.id] = managed
+            self._next_id += 1
+        return managed
+
+    def get(self, id: int) -> ManagedSession:
+        """
+        Raises:
+            KeyError: If there is no such session
+        """
+        with self._lock:
+            return self._sessions[id]
+
+    def list(self) -> List[ManagedSession]:
+        with self._lock:
+            return list(self._sessions.values())
+
+    def stop(self, id: int, timeout: float = STOP_TIMEOUT_SEC) -> ShutdownReport:
+        """ Stops a session and waits for its recorders; the last splits are processed in the background.
+
+        Raises:
+            KeyError: If there is no such session
+        """
+        managed = self.get(id)
+        report = managed.session.shutdown(timeout)
+        managed.session.finish_splits_in_background()
+        return report
+
+    def shutdown(self, timeout: float = STOP_TIMEOUT_SEC) -> None:
+        """ Stops every running session, in parallel, for when the process exits.
+
+        Offloads still copying stop after their current chunk, to be resumed with ``bagrec --offload``.
+        """
+        threads = [threading.Thread(target=self._stop_on_exit, args=(managed, timeout)) for managed in self.list()]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    def _stop_on_exit(self, managed: ManagedSession, timeout: float) -> None:
+        if managed.session.report is None:
+            if managed.session.poll() is None:
+                print(f"[SmartBagRec] Stopping the recorders of session {managed.id}...")
+            for line in self.stop(managed.id, timeout).lines():
+                print("[SmartBagRec] " + line)
+        offload = managed.session.offload
+        if offload is not None:
+            backlog = offload.status().backlog
+            if backlog:
+                print(f"[SmartBagRec] Leaving the offload of {backlog} files to be resumed later.")
+            offload.shutdown()
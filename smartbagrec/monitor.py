@@ -0,0 +1,159 @@
+""" Write-throughput sampling of a running recording.
+
+The sampler only calls stat on the output files and statvfs on the target filesystem;
+it never reads file contents, so it adds no load even at high data rates.
+The output directory itself is only rescanned when its mtime changes,
+i.e. when the recorder creates, renames or removes a file.
+"""
+
+from __future__ import annotations
+
+import collections
+import os
+import time
+from typing import Deque, Dict, Optional, Tuple
+
+from .output import OutputSpec, active_bag_files
+
+MTIME_SLACK_SEC = 2.0
+
+
+class ThroughputSample:
+    """ One reading of the recording's output files.
+
+    Attributes:
+        time (float): The time.monotonic() value of the reading
+        total_bytes (int): The size of all output files of the recording
+        rate (float): The write rate in bytes per second, averaged over the last few readings
+        split_count (int): The number of finished bag files
+        active_count (int): The number of bag files still being written
+        free_bytes (int): The space left on the target filesystem
+        seconds_until_full (Optional[float]): The time until the filesystem is full at the current rate
+    """
+
+    time: float
+    total_bytes: int
+    rate: float
+    split_count: int
+    active_count: int
+    free_bytes: int
+    seconds_until_full: Optional[float]
+
+    def __init__(self, time: float, total_bytes: int, rate: float, split_count: int,
+                 active_count: int, free_bytes: int) -> None:
+        self.time = time
+        self.total_bytes = total_bytes
+        self.rate = rate
+        self.split_count = split_count
+        self.active_count = active_count
+        self.free_bytes = free_bytes
+        self.seconds_until_full = free_bytes / rate if rate > 0 else None
+
+
+class ThroughputMonitor:
+    """ Samples the output files of one recording.
+
+    Finished bag files never change again, so their size is remembered
+    and only the files still being written are stat'ed on every sample.
+    """
+
+    RATE_WINDOW = 5
+
+    _spec: OutputSpec
+    _dir_mtime: Optional[int]
+    _finished: Dict[str, Tuple[int, float]]
+    _active: Dict[str, int]
+    _history: Deque[Tuple[float, int]]
+
+    def __init__(self, spec: OutputSpec) -> None:
+        self._spec = spec
+        self._dir_mtime = None
+        self._finished = {}
+        self._active = {}
+        self._history = collections.deque(maxlen=self.RATE_WINDOW + 1)
+
+    @property
+    def spec(self) -> OutputSpec:
+        return self._spec
+
+    def finished_files(self) -> Tuple[str, ...]:
+        """ Returns the paths of the finished bag files found so far, oldest first.
+
+        Files are listed even if they have been removed or rewritten since, e.g. by
+        --max-splits or by post-processing, as they still count as written by the recorder.
+        """
+        return tuple(sorted(self._finished, key=lambda path: self._finished[path][1]))
+
+    def sample(self) -> ThroughputSample:
+        now = time.monotonic()
+        try:
+            dir_mtime = os.stat(self._spec.directory).st_mtime_ns
+        except OSError:
+            dir_mtime = None
+        if dir_mtime is None or dir_mtime != self._dir_mtime or not self._stat_active():
+            self._rescan()
+            self._dir_mtime = dir_mtime
+
+        total_bytes = sum(size for size, _ in self._finished.values()) + sum(self._active.values())
+        self._history.append((now, total_bytes))
+        oldest_time, oldest_bytes = self._history[0]
+        rate = (total_bytes - oldest_bytes) / (now - oldest_time) if now > oldest_time else 0.0
+
+        try:
+            vfs = os.statvfs(self._spec.directory)
+            free_bytes = vfs.f_bavail * vfs.f_frsize
+        except OSError:
+            free_bytes = 0
+
+        return ThroughputSample(now, total_bytes, max(rate, 0.0), len(self._finished),
+                                len(self._active), free_bytes)
+
+    def _rescan(self) -> None:
+        active: Dict[str, int] = {}
+        try:
+            entries = list(os.scandir(self._spec.directory))
+        except OSError:
+            entries = []
+        active_names = active_bag_files(entry.name for entry in entries)
+        for entry in entries:
+            if entry.path in self._finished or not self._spec.matches(entry.name):
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if self._spec.stem is None and st.st_mtime < self._spec.started - MTIME_SLACK_SEC:
+                continue
+            if entry.name in active_names:
+                active[entry.path] = st.st_size
+            else:
+                self._finished[entry.path] = (st.st_size, st.st_mtime)
+        self._active = active
+
+    def _stat_active(self) -> bool:
+        """ Updates the sizes of the active files, returning False if one of them has gone.
+        """
+        for path in self._active:
+            try:
+                self._active[path] = os.stat(path).st_size
+            except OSError:
+                # renamed to .bag in the meantime
+                return False
+        return True
+
+
+def format_bytes(n: float) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if abs(n) < 1024:
+            return f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
+
+
+def format_duration(sec: Optional[float]) -> str:
+    if sec is None:
+        return "--:--"
+    sec = int(sec)
+    if sec >= 3600:
+        return f"{sec // 3600}h{sec % 3600 // 60:02d}m"
+    return f"{sec // 60:02d}:{sec % 60:02d}"
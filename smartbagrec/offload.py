@@ -0,0 +1,413 @@
+""" Throttled, resumable copying of finished bag files to an archive, such as a NAS mount.
+
+Copying with ``cp`` while recording takes the disk bandwidth the recorder needs.
+``OffloadQueue`` copies one file at a time in large chunks from a background thread,
+paced to a bandwidth cap that is lowered while a recording is active.
+
+Every chunk is written to ``<name>.part`` in the destination, flushed, read back and
+compared with the source, and only then recorded in the journal ``<name>.part.json``.
+An interrupted copy resumes after the last chunk in the journal. Once the whole file is
+verified, its SHA-256 is written next to it as ``<name>.sha256`` in the format of
+``sha256sum`` and appended to the ``SHA256SUMS`` manifest of the destination,
+the part file is renamed, and the local file is deleted if so configured.
+"""
+
+from __future__ import annotations
+
+import collections
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
+
+from .checksum import append_to_manifest, manifest_path
+from .monitor import format_bytes
+from .output import active_bag_files, is_bag_file
+
+PART_SUFFIX = ".part"
+JOURNAL_SUFFIX = ".part.json"
+CHECKSUM_SUFFIX = ".sha256"
+CHUNK_MB = 8
+RECORDING_RATE = 10 * 1024 ** 2
+READ_BLOCK = 1024 ** 2
+
+
+class OffloadSettings:
+    """ Where and how fast finished bag files are offloaded.
+
+    Attributes:
+        destination (str): The directory the files are copied to
+        max_rate (Optional[float]): Bytes per second copied while not recording, or None for no limit
+        recording_rate (Optional[float]): Bytes per second copied while a recording is active, or None for no limit
+        delete_after (bool): Whether the local file is deleted once its copy is verified
+        chunk_mb (int): The size of the chunks copied and verified at a time, in MB
+    """
+
+    destination: str
+    max_rate: Optional[float]
+    recording_rate: Optional[float]
+    delete_after: bool
+    chunk_mb: int
+
+    def __init__(self, destination: str, max_rate: Optional[float] = None,
+                 recording_rate: Optional[float] = RECORDING_RATE, delete_after: bool = False,
+                 chunk_mb: int = CHUNK_MB) -> None:
+        self.destination = destination
+        self.max_rate = max_rate
+        self.recording_rate = recording_rate
+        self.delete_after = delete_after
+        self.chunk_mb = max(1, chunk_mb)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.destination)
+
+    def rate(self, recording: bool) -> Optional[float]:
+        """ The bandwidth cap in effect, the lower of the two while recording.
+        """
+        if not recording or self.recording_rate is None:
+            return self.max_rate
+        if self.max_rate is None:
+            return self.recording_rate
+        return min(self.max_rate, self.recording_rate)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"destination": self.destination, "max_rate": self.max_rate, "recording_rate": self.recording_rate,
+                "delete_after": self.delete_after, "chunk_mb": self.chunk_mb}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> OffloadSettings:
+        max_rate = data.get("max_rate")
+        recording_rate = data.get("recording_rate", RECORDING_RATE)
+        return cls(str(data.get("destination", "")),
+                   float(max_rate) if max_rate is not None else None,
+                   float(recording_rate) if recording_rate is not None else None,
+                   bool(data.get("delete_after", False)),
+                   int(data.get("chunk_mb", CHUNK_MB)))
+
+
+class OffloadStatus:
+    """ Progress of an offload queue.
+
+    Attributes:
+        done (int): The number of files copied and verified
+        failed (int): The number of files that could not be copied
+        queued (int): The number of files waiting, not counting the current one
+        current (Optional[str]): The file being copied
+        current_bytes (int): Bytes of the current file copied so far
+        current_size (int): The size of the current file
+        copied (int): Bytes copied since the queue was started
+        rate (float): Bytes per second copied on average while there was a file to copy
+        limit (Optional[float]): The bandwidth cap in effect, or None for no limit
+    """
+
+    done: int
+    failed: int
+    queued: int
+    current: Optional[str]
+    current_bytes: int
+    current_size: int
+    copied: int
+    rate: float
+    limit: Optional[float]
+
+    def __init__(self, done: int, failed: int, queued: int, current: Optional[str], current_bytes: int,
+                 current_size: int, copied: int, rate: float, limit: Optional[float]) -> None:
+        self.done = done
+        self.failed = failed
+        self.queued = queued
+        self.current = current
+        self.current_bytes = current_bytes
+        self.current_size = current_size
+        self.copied = copied
+        self.rate = rate
+        self.limit = limit
+
+    @property
+    def backlog(self) -> int:
+        return self.queued + (1 if self.current is not None else 0)
+
+
+class OffloadError(Exception):
+    pass
+
+
+class OffloadQueue:
+    """ Copies the submitted files to the destination one after another, in a background thread.
+    """
+
+    _settings: OffloadSettings
+    _recording: Callable[[], bool]
+    _queue: Deque[str]
+    _queued: Set[str]
+    _lock: threading.Lock
+    _wake: threading.Event
+    _stop: threading.Event
+    _thread: Optional[threading.Thread]
+    _done: int
+    _failed: int
+    _current: Optional[str]
+    _current_bytes: int
+    _current_size: int
+    _copied: int
+    _busy: float
+    _current_started: float
+    _next_time: float
+
+    def __init__(self, settings: OffloadSettings, recording: Optional[Callable[[], bool]] = None) -> None:
+        """
+        Args:
+            settings (OffloadSettings): The destination and the bandwidth caps
+            recording (Optional[Callable[[], bool]]): Tells whether a recording is active,
+                so that the lower cap applies
+        """
+        self._settings = settings
+        self._recording = recording if recording is not None else (lambda: False)
+        self._queue = collections.deque()
+        self._queued = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._done = 0
+        self._failed = 0
+        self._current = None
+        self._current_bytes = 0
+        self._current_size = 0
+        self._copied = 0
+        self._busy = 0.0
+        self._current_started = 0.0
+        self._next_time = 0.0
+
+    def submit(self, path: str) -> None:
+        """ Queues a finished file, starting the copying thread if needed.
+        """
+        with self._lock:
+            if path in self._queued or path == self._current:
+                return
+            self._queued.add(path)
+            self._queue.append(path)
+            if self._thread is None and not self._stop.is_set():
+                # a daemon, since an interrupted copy resumes from its journal the next time
+                self._thread = threading.Thread(target=self._run, name="smartbagrec-offload", daemon=True)
+                self._thread.start()
+        self._wake.set()
+
+    def in_use(self, path: str) -> bool:
+        """ Tells whether a file is waiting to be copied or being copied.
+        """
+        with self._lock:
+            return path in self._queued or path == self._current
+
+    def status(self) -> OffloadStatus:
+        with self._lock:
+            busy = self._busy
+            if self._current is not None:
+                busy += time.monotonic() - self._current_started
+            return OffloadStatus(self._done, self._failed, len(self._queue), self._current, self._current_bytes,
+                                 self._current_size, self._copied, self._copied / busy if busy > 0 else 0.0,
+                                 self._settings.rate(self._recording()))
+
+    @property
+    def idle(self) -> bool:
+        with self._lock:
+            return not self._queue and self._current is None
+
+    def shutdown(self, timeout: float = 5.0) -> None:
+        """ Stops after the chunk being copied, leaving the rest to be resumed later.
+        """
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._lock:
+                path = self._queue.popleft() if self._queue else None
+                if path is not None:
+                    self._queued.discard(path)
+                    self._current = path
+                    self._current_bytes = 0
+                    self._current_size = 0
+                    self._current_started = time.monotonic()
+            if path is None:
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            try:
+                ok = self._offload(path)
+            except (OSError, OffloadError) as e:
+                print(f"[SmartBagRec] Offload of {path} failed: {e}")
+                ok = False
+            with self._lock:
+                self._current = None
+                self._busy += time.monotonic() - self._current_started
+                if ok is None:
+                    # interrupted, so it is still to be copied
+                    self._queued.add(path)
+                    self._queue.appendleft(path)
+                elif ok:
+                    self._done += 1
+                else:
+                    self._failed += 1
+
+    def _offload(self, path: str) -> Optional[bool]:
+        """ Copies one file, returning None if it was interrupted by shutdown().
+        """
+        name = os.path.basename(path)
+        target = os.path.join(self._settings.destination, name)
+        os.makedirs(self._settings.destination, exist_ok=True)
+        stat = os.stat(path)
+        with self._lock:
+            self._current_size = stat.st_size
+        if os.path.exists(target):
+            return self._check_existing(path, target)
+
+        chunk_bytes = self._settings.chunk_mb * 1024 ** 2
+        journal = _load_journal(target + JOURNAL_SUFFIX, stat, chunk_bytes)
+        digests: List[str] = journal["digests"] if journal is not None else []
+        whole = hashlib.sha256()
+        offset = 0
+        with open(path, "rb") as src, open(target + PART_SUFFIX, "r+b" if digests else "w+b") as dst:
+            if digests:
+                # the resumed part of the file is hashed again, and must still match the source
+                for digest in digests:
+                    data = self._read(src, chunk_bytes)
+                    if hashlib.sha256(data).hexdigest() != digest:
+                        raise OffloadError("the file changed since its copy was interrupted")
+                    whole.update(data)
+                    offset += len(data)
+                print(f"[SmartBagRec] Resuming offload of {name} at {format_bytes(offset)}")
+                with self._lock:
+                    self._current_bytes = offset
+            dst.truncate(offset)
+            while offset < stat.st_size:
+                data = self._read(src, chunk_bytes)
+                # shutdown() also cuts the wait of the throttle short
+                if self._stop.is_set():
+                    return None
+                if not data:
+                    raise OffloadError("the file became shorter while being copied")
+                digest = hashlib.sha256(data).hexdigest()
+                self._write_verified(dst, offset, data, digest)
+                whole.update(data)
+                offset += len(data)
+                digests.append(digest)
+                _save_journal(target + JOURNAL_SUFFIX, path, stat, chunk_bytes, digests)
+                with self._lock:
+                    self._current_bytes = offset
+                    self._copied += len(data)
+        with open(target + CHECKSUM_SUFFIX + ".tmp", "w") as f:
+            f.write(f"{whole.hexdigest()}  {name}\n")
+        os.replace(target + CHECKSUM_SUFFIX + ".tmp", target + CHECKSUM_SUFFIX)
+        os.replace(target + PART_SUFFIX, target)
+        os.remove(target + JOURNAL_SUFFIX)
+        append_to_manifest(manifest_path(self._settings.destination), name, whole.hexdigest())
+        print(f"[SmartBagRec] Offloaded: {target}")
+        self._finish(path)
+        return True
+
+    def _check_existing(self, path: str, target: str) -> bool:
+        # a copy finished by an earlier run, e.g. one interrupted before it deleted the local file
+        try:
+            with open(target + CHECKSUM_SUFFIX, "r") as f:
+                expected = f.read().split()[0]
+        except (OSError, IndexError):
+            raise OffloadError(f"{target} already exists")
+        whole = hashlib.sha256()
+        with open(path, "rb") as src:
+            for data in iter(lambda: self._read(src, self._settings.chunk_mb * 1024 ** 2), b""):
+                whole.update(data)
+        if whole.hexdigest() != expected or os.path.getsize(target) != os.path.getsize(path):
+            raise OffloadError(f"{target} already exists with different contents")
+        print(f"[SmartBagRec] Already offloaded: {target}")
+        self._finish(path)
+        return True
+
+    def _finish(self, path: str) -> None:
+        if self._settings.delete_after:
+            os.remove(path)
+            print(f"[SmartBagRec] Deleted the offloaded local file: {path}")
+
+    def _read(self, src: Any, size: int) -> bytes:
+        data = src.read(size)
+        self._throttle(len(data))
+        return data
+
+    def _write_verified(self, dst: Any, offset: int, data: bytes, digest: str) -> None:
+        dst.seek(offset)
+        dst.write(data)
+        dst.flush()
+        os.fsync(dst.fileno())
+        # drop the chunk from the page cache, so that it is read back from the destination
+        if hasattr(os, "posix_fadvise"):
+            os.posix_fadvise(dst.fileno(), offset, len(data), os.POSIX_FADV_DONTNEED)
+        dst.seek(offset)
+        check = hashlib.sha256()
+        for i in range(0, len(data), READ_BLOCK):
+            check.update(dst.read(min(READ_BLOCK, len(data) - i)))
+        if check.hexdigest() != digest:
+            raise OffloadError(f"verification failed at {format_bytes(offset)}")
+
+    def _throttle(self, size: int) -> None:
+        # waits out the time the chunk just read takes at the cap in effect, so that the rate never exceeds it
+        rate = self._settings.rate(self._recording())
+        now = time.monotonic()
+        if rate is None or rate <= 0:
+            self._next_time = now
+            return
+        self._next_time = max(self._next_time, now) + size / rate
+        self._stop.wait(self._next_time - now)
+
+
+def _load_journal(path: str, stat: os.stat_result, chunk_bytes: int) -> Optional[Dict[str, Any]]:
+    """ Reads the journal of an interrupted copy, or returns None if there is none the copy can resume from.
+    """
+    try:
+        with open(path, "r") as f:
+            journal = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (not isinstance(journal, dict) or journal.get("size") != stat.st_size
+            or journal.get("mtime_ns") != stat.st_mtime_ns or journal.get("chunk_bytes") != chunk_bytes
+            or not isinstance(journal.get("digests"), list)):
+        return None
+    part = path[:-len(JOURNAL_SUFFIX)] + PART_SUFFIX
+    try:
+        if os.path.getsize(part) < len(journal["digests"]) * chunk_bytes:
+            return None
+    except OSError:
+        return None
+    return journal
+
+
+def _save_journal(path: str, source: str, stat: os.stat_result, chunk_bytes: int, digests: List[str]) -> None:
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"source": source, "size": stat.st_size, "mtime_ns": stat.st_mtime_ns,
+                   "chunk_bytes": chunk_bytes, "digests": digests}, f)
+    os.replace(tmp_path, path)
+
+
+def find_finished_bags(directory: str) -> List[str]:
+    """ Returns the finished bag files in a directory, oldest first.
+    """
+    entries: List[Tuple[float, str]] = []
+    scanned = list(os.scandir(directory))
+    active = active_bag_files(entry.name for entry in scanned)
+    for entry in scanned:
+        if (is_bag_file(entry.name) and entry.name not in active and not entry.name.endswith(".orig.bag")
+                and entry.is_file()):
+            entries.append((entry.stat().st_mtime, entry.path))
+    return [path for _, path in sorted(entries)]
+
+
+def format_offload_status(status: OffloadStatus) -> str:
+    text = f"offloaded {status.done}, {status.backlog} left, {status.failed} failed"
+    if status.current is not None and status.current_size:
+        text += f" ({os.path.basename(status.current)} {status.current_bytes * 100 // status.current_size}%)"
+    limit = f" of {format_bytes(status.limit)}/s" if status.limit is not None else ""
+    return text + f" at {format_bytes(status.rate)}/s{limit}"
@@ -0,0 +1,161 @@
+""" Naming of the files written by ``rosbag record`` and ``ros2 bag record``.
+
+rosbag names its output from ``-O``/``-o`` and the start time, so the files of a
+recording can be found again from its command line without asking the recorder.
+rosbag2 writes into a bag directory named by ``-o``, one ``<name>_<n>.mcap`` (or ``.db3``) file per split.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import time
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+TIMESTAMP_FORMAT = "%Y-%m-%d-%H-%M-%S"
+ROS2_TIMESTAMP_FORMAT = "%Y_%m_%d-%H_%M_%S"
+# finished bag files; rosbag2 compresses whole splits to .zstd in --compression-mode file
+BAG_EXTENSIONS = (".bag", ".mcap", ".db3", ".mcap.zstd", ".db3.zstd")
+ROS2_METADATA = "metadata.yaml"
+_TIMESTAMPED_NAME_RE = re.compile(r"\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2}(_\d+)?")
+_ROS2_SPLIT_RE = re.compile(r"(.+)_(\d+)\.(?:mcap|db3)(?:\.zstd)?")
+
+
+class OutputSpec:
+    """ Where a recording writes its bag files and how they are named.
+
+    Attributes:
+        directory (str): The directory the bag files are written to
+        stem (Optional[str]): The fixed file name without ".bag" given by -O, or None for timestamped names
+        prefix (str): The prefix given by -o, put in front of the timestamp
+        started (float): The time.time() value at which the recording was started
+    """
+
+    directory: str
+    stem: Optional[str]
+    prefix: str
+    started: float
+
+    def __init__(self, directory: str, stem: Optional[str], prefix: str, started: float) -> None:
+        self.directory = directory
+        self.stem = stem
+        self.prefix = prefix
+        self.started = started
+
+    @property
+    def base_name(self) -> str:
+        """ The file name without extension that the first bag file is expected to have.
+        """
+        if self.stem is not None:
+            return self.stem
+        timestamp = time.strftime(TIMESTAMP_FORMAT, time.localtime(self.started))
+        return f"{self.prefix}_{timestamp}" if self.prefix else timestamp
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.directory, self.base_name + ".log")
+
+    @property
+    def parent_directory(self) -> str:
+        """ The directory that has to exist before the recorder starts, e.g. for checking its disk.
+        """
+        return self.directory
+
+    def matches(self, file_name: str) -> bool:
+        """ Tells whether a file name in the output directory belongs to this recording.
+
+        For timestamped names only the name is checked here,
+        so callers should also compare the modification time with ``started``.
+        """
+        if file_name.endswith(".bag.active"):
+            name = file_name[:-len(".bag.active")]
+        elif file_name.endswith(".bag"):
+            name = file_name[:-len(".bag")]
+        else:
+            return False
+        if self.stem is not None:
+            return name == self.stem or _is_split_of(name, self.stem)
+        if self.prefix:
+            if not name.startswith(self.prefix + "_"):
+                return False
+            name = name[len(self.prefix) + 1:]
+        return _TIMESTAMPED_NAME_RE.fullmatch(name) is not None
+
+
+class BagDirectorySpec(OutputSpec):
+    """ The bag directory of a ``ros2 bag record`` process and its ``<stem>_<n>`` splits.
+
+    The directory is created by the recorder, so the log goes next to it.
+    """
+
+    def __init__(self, directory: str, started: float) -> None:
+        super().__init__(directory, os.path.basename(directory), "", started)
+
+    @property
+    def log_path(self) -> str:
+        return self.directory + ".log"
+
+    @property
+    def parent_directory(self) -> str:
+        return os.path.dirname(self.directory)
+
+    def matches(self, file_name: str) -> bool:
+        match = _ROS2_SPLIT_RE.fullmatch(file_name)
+        return match is not None and match.group(1) == self.stem
+
+
+def is_bag_file(file_name: str) -> bool:
+    """ Tells whether a file name is that of a bag file, or of a split of a ROS 2 bag.
+    """
+    return file_name.endswith(BAG_EXTENSIONS)
+
+
+def active_bag_files(names: Iterable[str]) -> Set[str]:
+    """ Returns the bag files still being written, out of all the file names in one directory.
+
+    rosbag marks them with ".active". rosbag2 has no marker, so the last split of a bag directory
+    counts as being written until the recorder has written the metadata.yaml on exit.
+    """
+    names = list(names)
+    active = {name for name in names if name.endswith(".bag.active")}
+    if ROS2_METADATA in names:
+        return active
+    last: Dict[str, Tuple[int, str]] = {}
+    for name in names:
+        match = _ROS2_SPLIT_RE.fullmatch(name)
+        if match is None:
+            continue
+        index = int(match.group(2))
+        if match.group(1) not in last or index > last[match.group(1)][0]:
+            last[match.group(1)] = (index, name)
+    active.update(name for _, name in last.values())
+    return active
+
+
+def _is_split_of(name: str, stem: str) -> bool:
+    return name.startswith(stem + "_") and name[len(stem) + 1:].isdigit()
+
+
+def parse_output_spec(command: List[str], started: Optional[float] = None) -> OutputSpec:
+    """ Reads -o/-O from a ``rosbag record`` command line.
+    """
+    if started is None:
+        started = time.time()
+    stem = None
+    prefix = ""
+    for i, arg in enumerate(command[:-1]):
+        if arg in ("-O", "--output-name"):
+            stem = command[i + 1]
+        elif arg in ("-o", "--output-prefix"):
+            prefix = command[i + 1]
+
+    if stem is not None:
+        if stem.endswith(".bag"):
+            stem = stem[:-len(".bag")]
+        directory, stem = os.path.split(os.path.abspath(stem))
+        return OutputSpec(directory, stem, "", started)
+
+    if prefix.endswith(".bag"):
+        prefix = prefix[:-len(".bag")]
+    directory, prefix = os.path.split(os.path.abspath(prefix)) if prefix else (os.getcwd(), "")
+    return OutputSpec(directory, None, prefix, started)
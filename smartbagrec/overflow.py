@@ -0,0 +1,157 @@
+""" Detection of messages dropped because the recorder's buffer was full.
+
+``rosbag record`` queues incoming messages in a buffer of ``-b`` MB and drops the oldest
+queued message, with a "buffer exceeded" warning, whenever the disk does not keep up.
+The warnings are counted per second as the output is drained, so the count stays small
+however many messages are dropped, and a larger buffer is recommended after the session
+from the longest run of overflows and the rate the recorder was writing at.
+``ros2 bag record`` has no such warning, and its ``-b`` is the split size, so this is for ROS 1 only.
+"""
+
+from __future__ import annotations
+
+import bisect
+import math
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+from .command import BUFFER_OPTIONS, DEFAULT_BUFFER_MB, DEFAULT_CHUNK_KB, option_value, set_option
+
+OVERFLOW_MARKER = "buffer exceeded"
+# overflows less than this apart belong to the same episode
+EPISODE_GAP_SEC = 1.0
+BUFFER_HEADROOM = 1.5
+BUFFER_STEP_MB = 64
+# a chunk should hold about this much of the recorder's data, so writes stay large
+CHUNK_TARGET_SEC = 0.1
+CHUNK_STEP_KB = 256
+MAX_CHUNK_KB = 8192
+
+
+class OverflowTracker:
+    """ Counts the overflow warnings of one recorder per second, safely across threads.
+    """
+
+    _seconds: List[int]
+    _counts: List[int]
+    _total: int
+    _lock: threading.Lock
+
+    def __init__(self) -> None:
+        self._seconds = []
+        self._counts = []
+        self._total = 0
+        self._lock = threading.Lock()
+
+    def feed(self, line: str, when: Optional[float] = None) -> bool:
+        """ Counts the line if it is an overflow warning, returning whether it was.
+        """
+        if OVERFLOW_MARKER not in line.lower():
+            return False
+        second = int(when if when is not None else time.time())
+        with self._lock:
+            if self._seconds and self._seconds[-1] == second:
+                self._counts[-1] += 1
+            else:
+                self._seconds.append(second)
+                self._counts.append(1)
+            self._total += 1
+        return True
+
+    @property
+    def count(self) -> int:
+        return self._total
+
+    def count_since(self, since: float) -> int:
+        with self._lock:
+            return sum(self._counts[bisect.bisect_left(self._seconds, int(since)):])
+
+    def episodes(self, gap: float = EPISODE_GAP_SEC) -> List[Tuple[int, int, int]]:
+        """ Returns (first second, last second, dropped messages) of each run of overflows.
+        """
+        with self._lock:
+            seconds = list(self._seconds)
+            counts = list(self._counts)
+        episodes: List[Tuple[int, int, int]] = []
+        for second, count in zip(seconds, counts):
+            if episodes and second - episodes[-1][1] <= gap:
+                first, _, dropped = episodes[-1]
+                episodes[-1] = (first, second, dropped + count)
+            else:
+                episodes.append((second, second, count))
+        return episodes
+
+
+class BufferRecommendation:
+    """ Buffer and chunk sizes that would have absorbed the observed overflows.
+
+    Attributes:
+        buffer_mb (int): The recommended -b value in MB
+        chunk_kb (int): The recommended --chunksize value in KB
+        reason (str): What was observed
+    """
+
+    buffer_mb: int
+    chunk_kb: int
+    reason: str
+
+    def __init__(self, buffer_mb: int, chunk_kb: int, reason: str) -> None:
+        self.buffer_mb = buffer_mb
+        self.chunk_kb = chunk_kb
+        self.reason = reason
+
+    def apply(self, options: Sequence[str]) -> List[str]:
+        """ Returns the rosbag record options with the recommended sizes set.
+        """
+        options = set_option(options, BUFFER_OPTIONS, str(self.buffer_mb))
+        return set_option(options, ("--chunksize",), str(self.chunk_kb))
+
+
+def recommend_buffer(options: Sequence[str],
+                     recorders: Sequence[Tuple[OverflowTracker, float]]) -> Optional[BufferRecommendation]:
+    """ Works out a buffer that absorbs the longest overflow episode of any recorder.
+
+    Args:
+        options (Sequence[str]): The rosbag record options of the session
+        recorders (Sequence[Tuple[OverflowTracker, float]]): The overflows of each recorder
+            and the bytes per second it wrote on average
+
+    Returns:
+        Optional[BufferRecommendation]: None if nothing was dropped or the buffer is unlimited
+    """
+    buffer_mb = _int_option(options, BUFFER_OPTIONS, DEFAULT_BUFFER_MB)
+    chunk_kb = _int_option(options, ("--chunksize",), DEFAULT_CHUNK_KB)
+    if buffer_mb == 0:
+        return None
+
+    needed = 0.0
+    busiest = 0.0
+    dropped = 0
+    longest = 0.0
+    for tracker, rate in recorders:
+        episodes = tracker.episodes()
+        if not episodes:
+            continue
+        # an episode of a single second still lost up to a second of data
+        duration = max(last - first + 1 for first, last, _ in episodes)
+        # the data that did not fit, with some headroom, on top of the buffer that was already full
+        needed = max(needed, buffer_mb * 1024 ** 2 + rate * duration * BUFFER_HEADROOM)
+        busiest = max(busiest, rate)
+        dropped += tracker.count
+        longest = max(longest, duration)
+    if dropped == 0:
+        return None
+
+    step = BUFFER_STEP_MB * 1024 ** 2
+    recommended_buffer = int(math.ceil(needed / step)) * BUFFER_STEP_MB
+    target_chunk = busiest * CHUNK_TARGET_SEC / 1024
+    recommended_chunk = max(chunk_kb, min(MAX_CHUNK_KB, int(math.ceil(target_chunk / CHUNK_STEP_KB)) * CHUNK_STEP_KB))
+    reason = (f"{dropped} messages were dropped; the longest run of overflows lasted {longest:.0f} s "
+              f"with a recorder writing {busiest / 1024 ** 2:.1f} MB/s into a {buffer_mb} MB buffer.")
+    return BufferRecommendation(max(recommended_buffer, buffer_mb), recommended_chunk, reason)
+
+
+def _int_option(options: Sequence[str], names: Sequence[str], default: int) -> int:
+    value = option_value(options, *names)
+    return int(value) if value is not None and value.isdigit() else default
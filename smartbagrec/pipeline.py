@@ -0,0 +1,193 @@
+""" Background processing of finished split files.
+
+Compressing while recording ties the recorder to one busy core.
+With a pipeline the recorder writes uncompressed splits, and every split is compressed,
+and passed through user-defined steps such as ``rosbag filter``, as soon as it is closed.
+At most ``workers`` splits are processed at a time, each by one external process.
+
+The pipeline accepts at most ``max_backlog`` splits that are queued or running.
+Beyond that ``submit()`` refuses new splits, and the caller keeps them and offers them
+again later, so a pipeline that falls behind never piles up unbounded work.
+"""
+
+from __future__ import annotations
+
+import os
+import shlex
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+COMPRESS_OPTIONS = {"bz2": "-j", "lz4": "--lz4"}
+
+
+class PipelineSettings:
+    """ How finished splits are processed.
+
+    Attributes:
+        compression (Optional[str]): "bz2", "lz4" or None
+        workers (int): The number of splits processed at the same time
+        steps (List[str]): Commands run on every split before compression,
+            where {input} is the split and {output} a temporary file replacing it
+    """
+
+    compression: Optional[str]
+    workers: int
+    steps: List[str]
+
+    def __init__(self, compression: Optional[str] = None, workers: int = 1, steps: Optional[List[str]] = None) -> None:
+        if compression is not None and compression not in COMPRESS_OPTIONS:
+            raise ValueError("Unknown compression: " + compression)
+        self.compression = compression
+        self.workers = max(1, workers)
+        self.steps = steps if steps is not None else []
+
+    @property
+    def enabled(self) -> bool:
+        return self.compression is not None or bool(self.steps)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"compression": self.compression, "workers": self.workers, "steps": self.steps}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> PipelineSettings:
+        return cls(data.get("compression"), int(data.get("workers", 1)),
+                   [str(step) for step in data.get("steps", [])])
+
+
+class PipelineStatus:
+    """ Progress of a pipeline.
+
+    Attributes:
+        done (int): The number of splits processed successfully
+        failed (int): The number of splits whose processing failed
+        running (int): The number of splits being processed
+        queued (int): The number of splits waiting for a worker
+        current (List[str]): The paths of the splits being processed
+    """
+
+    done: int
+    failed: int
+    running: int
+    queued: int
+    current: List[str]
+
+    def __init__(self, done: int, failed: int, running: int, queued: int, current: List[str]) -> None:
+        self.done = done
+        self.failed = failed
+        self.running = running
+        self.queued = queued
+        self.current = current
+
+    @property
+    def backlog(self) -> int:
+        return self.running + self.queued
+
+
+class SplitPipeline:
+    """ Processes finished splits with a bounded pool of workers.
+    """
+
+    _settings: PipelineSettings
+    _max_backlog: int
+    _executor: ThreadPoolExecutor
+    _lock: threading.Lock
+    _done: int
+    _failed: int
+    _queued: int
+    _current: List[str]
+    _on_done: Optional[Callable[[str], None]]
+
+    def __init__(self, settings: PipelineSettings, max_backlog: Optional[int] = None,
+                 on_done: Optional[Callable[[str], None]] = None) -> None:
+        """
+        Args:
+            settings (PipelineSettings): How to process the splits
+            max_backlog (Optional[int]): The number of splits accepted at a time, 4 per worker by default
+            on_done (Optional[Callable[[str], None]]): Called with every split once the pipeline is done with it,
+                whether or not its processing succeeded
+        """
+        self._settings = settings
+        self._max_backlog = max_backlog if max_backlog is not None else settings.workers * 4
+        self._executor = ThreadPoolExecutor(max_workers=settings.workers, thread_name_prefix="smartbagrec-pipeline")
+        self._lock = threading.Lock()
+        self._done = 0
+        self._failed = 0
+        self._queued = 0
+        self._current = []
+        self._on_done = on_done
+
+    def submit(self, path: str) -> bool:
+        """ Queues a finished split, returning False if the backlog is full.
+        """
+        with self._lock:
+            if self._queued + len(self._current) >= self._max_backlog:
+                return False
+            self._queued += 1
+        self._executor.submit(self._process, path)
+        return True
+
+    def status(self) -> PipelineStatus:
+        with self._lock:
+            return PipelineStatus(self._done, self._failed, len(self._current), self._queued, list(self._current))
+
+    def in_use(self, path: str) -> bool:
+        """ Tells whether a file is being processed, including the backup rosbag compress keeps meanwhile.
+        """
+        with self._lock:
+            return any(path in (current, _backup_path(current)) for current in self._current)
+
+    def shutdown(self, wait: bool = True) -> None:
+        self._executor.shutdown(wait=wait)
+
+    def _process(self, path: str) -> None:
+        name = os.path.basename(path)
+        with self._lock:
+            self._queued -= 1
+            self._current.append(path)
+        try:
+            ok = all(self._run_step(step, path) for step in self._settings.steps) and self._compress(path)
+        except OSError as e:
+            print(f"[SmartBagRec] Post-processing of {name} failed: {e}")
+            ok = False
+        # handed on while still in use, so that retention never sees the split unclaimed
+        if self._on_done is not None and os.path.exists(path):
+            self._on_done(path)
+        with self._lock:
+            self._current.remove(path)
+            if ok:
+                self._done += 1
+            else:
+                self._failed += 1
+
+    def _run_step(self, step: str, path: str) -> bool:
+        tmp_path = path + ".step.tmp"
+        argv = [arg.replace("{input}", path).replace("{output}", tmp_path) for arg in shlex.split(step)]
+        result = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            print(f"[SmartBagRec] Step '{step}' failed on {path}: {result.stderr.strip()}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return False
+        if "{output}" in step:
+            os.replace(tmp_path, path)
+        return True
+
+    def _compress(self, path: str) -> bool:
+        if self._settings.compression is None:
+            return True
+        argv = ["rosbag", "compress", "-q", "-f", COMPRESS_OPTIONS[self._settings.compression], path]
+        result = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            print(f"[SmartBagRec] Compression of {path} failed: {result.stderr.strip()}")
+            return False
+        backup = _backup_path(path)
+        if os.path.exists(backup):
+            os.remove(backup)
+        return True
+
+
+def _backup_path(path: str) -> str:
+    # rosbag compress keeps the original as <name>.orig.bag
+    return path[:-len(".bag")] + ".orig.bag"
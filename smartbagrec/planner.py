@@ -0,0 +1,102 @@
+""" Assignment of topics to recorder processes by estimated load.
+
+Each topic gets a cost from its measured bandwidth and message rate,
+and the topics are packed into shards with the longest-processing-time-first heuristic:
+the most expensive topic goes to the least loaded shard, and so on.
+This is O(n log n) and plans thousands of topics in milliseconds.
+"""
+
+from __future__ import annotations
+
+import heapq
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+if TYPE_CHECKING:
+    # probe pulls in concurrent.futures, which the headless path does not need
+    from .probe import TopicStats
+
+# CPU cost of a recorded byte relative to an uncompressed one
+BYTE_WEIGHTS = {None: 1.0, "lz4": 3.0, "zstd": 4.0, "bz2": 20.0}
+# fixed cost of a message, expressed in uncompressed bytes
+MESSAGE_COST_BYTES = 2048.0
+
+
+class ShardPlan:
+    """ Topics assigned to recorder processes.
+
+    Attributes:
+        shards (List[List[str]]): The topics of each recorder process
+        bandwidths (List[float]): The estimated bytes per second of each process
+        measured (int): The number of topics the plan had measurements for
+    """
+
+    shards: List[List[str]]
+    bandwidths: List[float]
+    measured: int
+
+    def __init__(self, shards: List[List[str]], bandwidths: List[float], measured: int) -> None:
+        self.shards = shards
+        self.bandwidths = bandwidths
+        self.measured = measured
+
+    @property
+    def imbalance(self) -> float:
+        """ The ratio of the busiest process's bandwidth to the average, 1.0 being perfectly balanced.
+        """
+        if not self.bandwidths or sum(self.bandwidths) == 0:
+            return 1.0
+        return max(self.bandwidths) / (sum(self.bandwidths) / len(self.bandwidths))
+
+
+def compression_of(options: Sequence[str]) -> Optional[str]:
+    """ Returns "bz2", "lz4", "zstd" or None according to the rosbag record or ros2 bag record options.
+    """
+    if "-j" in options or "--bz2" in options:
+        return "bz2"
+    if "--lz4" in options:
+        return "lz4"
+    for i, option in enumerate(options[:-1]):
+        if option in ("--compression-format", "--storage-preset-profile") and options[i + 1].startswith("zstd"):
+            return "zstd"
+    return None
+
+
+def plan_shards(topics: Sequence[str], stats: Dict[str, TopicStats], count: int,
+                compression: Optional[str] = None) -> ShardPlan:
+    """ Packs the topics into at most ``count`` shards with balanced estimated cost.
+
+    Topics without measurements are assumed to cost as much as the average measured topic,
+    or all the same if none was measured.
+    """
+    count = max(1, min(count, len(topics)))
+    byte_weight = BYTE_WEIGHTS.get(compression, 1.0)
+
+    def cost_of(topic_stats: TopicStats) -> float:
+        return topic_stats.bandwidth * byte_weight + topic_stats.rate * MESSAGE_COST_BYTES
+
+    measured = [stats[topic] for topic in topics if topic in stats]
+    default_cost = sum(cost_of(s) for s in measured) / len(measured) if measured else 1.0
+    costs = sorted(((cost_of(stats[topic]) if topic in stats else default_cost, topic) for topic in topics),
+                   reverse=True)
+
+    shards: List[List[str]] = [[] for _ in range(count)]
+    bandwidths = [0.0] * count
+    heap = [(0.0, i) for i in range(count)]
+    for cost, topic in costs:
+        load, i = heapq.heappop(heap)
+        shards[i].append(topic)
+        if topic in stats:
+            bandwidths[i] += stats[topic].bandwidth
+        heapq.heappush(heap, (load + cost, i))
+
+    for shard in shards:
+        shard.sort()
+    return ShardPlan(shards, bandwidths, len(measured))
+
+
+def fixed_plan(shards: List[List[str]], stats: Dict[str, TopicStats]) -> ShardPlan:
+    """ Wraps an already decided split, e.g. one saved in a profile, with its estimated bandwidths.
+    """
+    bandwidths = [sum(stats[topic].bandwidth for topic in topics if topic in stats) for topics in shards]
+    measured = sum(1 for topics in shards for topic in topics if topic in stats)
+    return ShardPlan(shards, bandwidths, measured)
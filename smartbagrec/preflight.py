@@ -0,0 +1,234 @@
+""" Checks of the output disk before recording starts.
+
+The expected data rate of the recording, from the measured bandwidth of its topics,
+is compared with a short sequential write benchmark of the output directory,
+the free space is compared with what ``--duration``/``--size``/``--max-splits`` allow to be written,
+and the ``-b`` buffer, or the ``--max-cache-size`` cache of ROS 2, is checked for how long
+a stalled disk it can absorb.
+Each check adds a finding, and the worst finding is the verdict: go, warn or stop.
+
+The write benchmark is cached per filesystem, so checking again a few minutes later is instant.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from .backend import ROS2, get_backend
+from .command import BUFFER_OPTIONS, DEFAULT_BUFFER_MB, option_value
+from .config import config_path
+from .monitor import format_bytes, format_duration
+from .planner import ShardPlan
+from .profile import Profile
+from .retention import RetentionPolicy
+
+VERDICTS = ("go", "warn", "stop")
+WRITE_TEST_BYTES = 64 * 1024 ** 2
+WRITE_BLOCK_BYTES = 1024 ** 2
+SPEED_CACHE_FILE = "disk_speed.cache"
+SPEED_CACHE_TTL_SEC = 600.0
+# warn when the recording needs more than this share of the measured write speed
+DISK_HEADROOM = 0.5
+# warn when the buffer of a recorder cannot absorb a stall of the disk this long
+MIN_STALL_SEC = 2.0
+# warn when an unbounded recording fills the disk sooner than this
+MIN_TIME_UNTIL_FULL_SEC = 3600.0
+_DURATION_UNITS = {"s": 1, "m": 60, "h": 3600}
+DEFAULT_ROS2_CACHE_BYTES = 100 * 1024 ** 2
+
+
+class PreflightReport:
+    """ The findings of a pre-flight check.
+
+    Attributes:
+        findings (List[Tuple[str, str]]): (verdict, message) of each check, in the order they ran
+    """
+
+    findings: List[Tuple[str, str]]
+
+    def __init__(self) -> None:
+        self.findings = []
+
+    @property
+    def verdict(self) -> str:
+        """ The worst verdict of all findings, "go" if there is none.
+        """
+        return max((verdict for verdict, _ in self.findings), key=VERDICTS.index, default="go")
+
+    def add(self, verdict: str, message: str) -> None:
+        self.findings.append((verdict, message))
+
+    def lines(self) -> List[str]:
+        return [f"[{verdict}] {message}" for verdict, message in self.findings]
+
+
+def measure_write_speed(directory: str, size: int = WRITE_TEST_BYTES) -> float:
+    """ Writes ``size`` bytes to a temporary file in the directory, returning bytes per second including fsync.
+
+    Raises:
+        OSError: If the directory is not writable
+    """
+    # random data, so that filesystems compressing on write do not look faster than they are
+    block = os.urandom(WRITE_BLOCK_BYTES)
+    fd, path = tempfile.mkstemp(prefix=".smartbagrec_preflight_", dir=directory)
+    try:
+        start = time.perf_counter()
+        written = 0
+        while written < size:
+            written += os.write(fd, block)
+        os.fsync(fd)
+        elapsed = time.perf_counter() - start
+    finally:
+        os.close(fd)
+        os.remove(path)
+    return written / max(elapsed, 1e-6)
+
+
+def cached_write_speed(directory: str, max_age: float = SPEED_CACHE_TTL_SEC) -> Tuple[float, bool]:
+    """ Returns the write speed of the filesystem of the directory, and whether it came from the cache.
+
+    Raises:
+        OSError: If the directory is not writable
+    """
+    key = str(os.stat(directory).st_dev)
+    cache = _load_speed_cache()
+    entry = cache.get(key)
+    if entry is not None and time.time() - entry["measured"] < max_age:
+        return entry["bytes_per_sec"], True
+    speed = measure_write_speed(directory)
+    cache[key] = {"bytes_per_sec": speed, "measured": time.time()}
+    _save_speed_cache(cache)
+    return speed, False
+
+
+def parse_duration(text: str) -> Optional[float]:
+    """ Reads a ``--duration`` value such as "30", "5m" or "2h" in seconds.
+    """
+    text = text.strip()
+    unit = _DURATION_UNITS.get(text[-1:], None)
+    number = text[:-1] if unit is not None else text
+    try:
+        return float(number) * (unit if unit is not None else 1)
+    except ValueError:
+        return None
+
+
+def bytes_to_write(options: Sequence[str], rate: float,
+                   retention: Optional[RetentionPolicy] = None) -> Optional[float]:
+    """ Returns how many bytes the recording leaves on disk at most, or None if it is unbounded.
+    """
+    size = option_value(options, "--size")
+    duration = option_value(options, "--duration")
+    bounds: List[float] = []
+    if size is not None and size.isdigit() and int(size) > 0:
+        bounds.append(int(size) * 1024 ** 2)
+    if duration is not None and rate > 0:
+        seconds = parse_duration(duration)
+        if seconds is not None and seconds > 0:
+            bounds.append(seconds * rate)
+    per_bag = min(bounds) if bounds else None
+
+    total = None
+    if "--split" not in options:
+        total = per_bag
+    elif per_bag is not None:
+        max_splits = option_value(options, "--max-splits")
+        if max_splits is not None and max_splits.isdigit() and int(max_splits) > 0:
+            # the kept splits plus the one being written
+            total = per_bag * (int(max_splits) + 1)
+    if retention is not None and retention.max_bytes is not None:
+        total = min(total, retention.max_bytes) if total is not None else float(retention.max_bytes)
+    return total
+
+
+def run_preflight(profile: Profile, plan: ShardPlan, max_age: float = SPEED_CACHE_TTL_SEC) -> PreflightReport:
+    """ Checks the output disk of the profile against the estimated load of the plan.
+
+    This blocks while the write benchmark runs, so the GUI runs it in a thread of its own.
+    """
+    report = PreflightReport()
+    directory = get_backend(profile.backend).output_spec(profile.command).parent_directory
+    options = profile.options
+    rate = sum(plan.bandwidths)
+
+    if not os.path.isdir(directory):
+        report.add("stop", f"The output directory {directory} does not exist.")
+        return report
+    if plan.measured == 0:
+        report.add("warn", "No topic has been measured, so the data rate is unknown. Click 'measure' first.")
+    elif plan.measured < len(profile.topics):
+        report.add("warn", f"Only {plan.measured} of {len(profile.topics)} topics have been measured; "
+                           "the estimates cover the measured ones only.")
+
+    try:
+        speed, cached = cached_write_speed(directory, max_age)
+    except OSError as e:
+        report.add("stop", f"Cannot write to {directory}: {e}")
+        return report
+    speed_text = f"The disk writes {format_bytes(speed)}/s" + (" (measured recently)" if cached else "")
+    if rate > speed:
+        report.add("stop", f"{speed_text}, slower than the expected {format_bytes(rate)}/s.")
+    elif rate > speed * DISK_HEADROOM:
+        report.add("warn", f"{speed_text}; the expected {format_bytes(rate)}/s leaves little headroom.")
+    else:
+        report.add("go", f"{speed_text}; the expected rate is {format_bytes(rate)}/s.")
+
+    vfs = os.statvfs(directory)
+    free = vfs.f_bavail * vfs.f_frsize
+    retention = profile.retention
+    total = bytes_to_write(options, rate, retention)
+    if retention is not None and retention.min_free_bytes is not None:
+        report.add("go", f"{format_bytes(free)} free; the retention policy keeps "
+                         f"{format_bytes(retention.min_free_bytes)} free.")
+    elif total is not None:
+        if total > free:
+            report.add("stop", f"The recording may write {format_bytes(total)}, "
+                               f"but only {format_bytes(free)} is free.")
+        elif total > free * 0.9:
+            report.add("warn", f"The recording may write {format_bytes(total)} of the {format_bytes(free)} free.")
+        else:
+            report.add("go", f"The recording writes at most {format_bytes(total)} of the {format_bytes(free)} free.")
+    elif rate > 0:
+        until_full = free / rate
+        verdict = "warn" if until_full < MIN_TIME_UNTIL_FULL_SEC else "go"
+        report.add(verdict, f"The recording is not bounded; the disk is full in {format_duration(until_full)}.")
+
+    if profile.backend == ROS2:
+        cache = option_value(options, "--max-cache-size")
+        buffer_bytes = float(int(cache) if cache and cache.isdigit() else DEFAULT_ROS2_CACHE_BYTES)
+    else:
+        buffer_mb = option_value(options, *BUFFER_OPTIONS)
+        buffer_bytes = float(int(buffer_mb) if buffer_mb and buffer_mb.isdigit() else DEFAULT_BUFFER_MB) * 1024 ** 2
+    busiest = max(plan.bandwidths, default=0.0)
+    if buffer_bytes == 0 and profile.backend == ROS2:
+        report.add("warn", "The cache is disabled, so every message waits for the disk.")
+    elif buffer_bytes == 0:
+        report.add("warn", "The buffer is unbounded, so a slow disk makes the recorder grow its memory instead.")
+    elif busiest > 0:
+        stall = buffer_bytes / busiest
+        verdict = "warn" if stall < MIN_STALL_SEC else "go"
+        report.add(verdict, f"The {format_bytes(buffer_bytes)} buffer absorbs a disk stall of "
+                            f"{stall:.1f} s at the busiest recorder's {format_bytes(busiest)}/s.")
+    return report
+
+
+def _load_speed_cache() -> Dict[str, Dict[str, float]]:
+    try:
+        with open(config_path(SPEED_CACHE_FILE), "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_speed_cache(cache: Dict[str, Dict[str, float]]) -> None:
+    try:
+        path = config_path(SPEED_CACHE_FILE)
+        with open(path + ".tmp", "w") as f:
+            json.dump(cache, f)
+        os.replace(path + ".tmp", path)
+    except OSError as e:
+        print(f"[SmartBagRec] Could not write the disk speed cache: {e}")
@@ -0,0 +1,155 @@
+""" Measurement of the message rate and bandwidth of topics.
+
+Each topic is sampled with ``rostopic bw``, or ``ros2 topic bw``, for a short fixed window.
+Topics are measured in parallel by a bounded pool of workers,
+so measuring many topics takes about as long as measuring one.
+"""
+
+from __future__ import annotations
+
+import os
+import queue
+import re
+import signal
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Iterable, Optional, Tuple
+
+from .backend import RecorderBackend, default_backend_name, get_backend
+
+PROBE_WINDOW_SEC = 4.0
+MAX_PROBE_WORKERS = 8
+
+_UNITS = {"B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+# "average: 1.50MB/s" from rostopic, "1.50 MB/s from 100 messages" from ros2 topic
+_AVERAGE_RE = re.compile(r"(?:average:\s*)?([\d.]+)\s*([KMG]?B)/s")
+_MEAN_RE = re.compile(r"mean:\s*([\d.]+)\s*([KMG]?B)")
+
+
+class TopicStats:
+    """ The measured load of one topic.
+
+    Attributes:
+        topic (str): The topic name
+        rate (float): Messages per second
+        bandwidth (float): Bytes per second
+    """
+
+    topic: str
+    rate: float
+    bandwidth: float
+
+    def __init__(self, topic: str, rate: float, bandwidth: float) -> None:
+        self.topic = topic
+        self.rate = rate
+        self.bandwidth = bandwidth
+
+
+def parse_bw_output(topic: str, output: str) -> Optional[TopicStats]:
+    """ Reads the last report printed by ``rostopic bw`` or ``ros2 topic bw``.
+    """
+    averages = _AVERAGE_RE.findall(output)
+    means = _MEAN_RE.findall(output)
+    if not averages:
+        return None
+    bandwidth = float(averages[-1][0]) * _UNITS[averages[-1][1]]
+    mean_size = float(means[-1][0]) * _UNITS[means[-1][1]] if means else 0.0
+    rate = bandwidth / mean_size if mean_size > 0 else 0.0
+    return TopicStats(topic, rate, bandwidth)
+
+
+def probe_topic(topic: str, window: float = PROBE_WINDOW_SEC, backend: Optional[RecorderBackend] = None) -> TopicStats:
+    """ Samples one topic for ``window`` seconds, counted from the start of the measuring tool.
+
+    A topic without any message in the window is reported with zero rate and bandwidth.
+    The tool is that of ``backend``, or of the sourced ROS environment if it is not given.
+    """
+    if backend is None:
+        backend = get_backend(default_backend_name())
+    env = dict(os.environ, PYTHONUNBUFFERED="1")
+    try:
+        process = subprocess.Popen(backend.bandwidth_command + [topic], stdout=subprocess.PIPE,
+                                   stderr=subprocess.DEVNULL, text=True, env=env)
+    except OSError:
+        return TopicStats(topic, 0.0, 0.0)
+    try:
+        output, _ = process.communicate(timeout=window)
+    except subprocess.TimeoutExpired:
+        process.send_signal(signal.SIGINT)
+        try:
+            output, _ = process.communicate(timeout=2.0)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            output, _ = process.communicate()
+    stats = parse_bw_output(topic, output or "")
+    return stats if stats is not None else TopicStats(topic, 0.0, 0.0)
+
+
+def probe_topics(topics: Iterable[str], window: float = PROBE_WINDOW_SEC, max_workers: int = MAX_PROBE_WORKERS,
+                 backend: Optional[RecorderBackend] = None) -> Dict[str, TopicStats]:
+    """ Samples the topics in parallel, blocking for about ``window`` seconds.
+    """
+    topics = tuple(topics)
+    if not topics:
+        return {}
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(topics))) as executor:
+        return {stats.topic: stats for stats in executor.map(lambda topic: probe_topic(topic, window, backend), topics)}
+
+
+class TopicProber:
+    """ Measures topics in a background thread.
+
+    Results arrive one topic at a time through ``poll()``,
+    which is meant to be called from the Tk event loop.
+
+    Attributes:
+        backend (Optional[RecorderBackend]): The backend whose tool measures the topics,
+            or None for that of the sourced ROS environment
+    """
+
+    backend: Optional[RecorderBackend]
+    _results: queue.Queue
+    _thread: Optional[threading.Thread]
+    _window: float
+    _max_workers: int
+
+    def __init__(self, window: float = PROBE_WINDOW_SEC, max_workers: int = MAX_PROBE_WORKERS,
+                 backend: Optional[RecorderBackend] = None) -> None:
+        self.backend = backend
+        self._results = queue.Queue()
+        self._thread = None
+        self._window = window
+        self._max_workers = max_workers
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, topics: Iterable[str]) -> bool:
+        """ Starts measuring the topics, returning False if a measurement is already running.
+        """
+        if self.running:
+            return False
+        self._thread = threading.Thread(target=self._run, args=(tuple(topics),), daemon=True)
+        self._thread.start()
+        return True
+
+    def poll(self) -> Dict[str, TopicStats]:
+        """ Returns the results that have arrived since the last call.
+        """
+        results: Dict[str, TopicStats] = {}
+        while True:
+            try:
+                stats = self._results.get_nowait()
+            except queue.Empty:
+                return results
+            results[stats.topic] = stats
+
+    def _run(self, topics: Tuple[str, ...]) -> None:
+        if not topics:
+            return
+        with ThreadPoolExecutor(max_workers=min(self._max_workers, len(topics))) as executor:
+            futures = [executor.submit(probe_topic, topic, self._window, self.backend) for topic in topics]
+            for future in as_completed(futures):
+                self._results.put(future.result())
@@ -0,0 +1,324 @@
+""" Reading and writing of profiles.
+
+A profile is a JSON file holding the topics, the record options and the other settings of a recording,
+one key per attribute of ``Profile``. It compiles straight to a command line without building any widget.
+
+Profiles written by older versions are a text file whose first line is the recording command,
+optionally followed by "key value" lines such as "shards 4" or "shard /topic_a /topic_b".
+They are still loaded.
+
+``ProfileIndex`` summarizes all profiles of a directory and caches the summaries
+by file mtime, so that the profile list shows at once even with hundreds of profiles.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from .backend import BACKEND_NAMES, ROS1, backend_of, get_backend
+from .checksum import ChecksumSettings
+from .config import CONFIG_DIR
+from .isolation import ResourceLimits
+from .offload import OffloadSettings
+from .pipeline import PipelineSettings
+from .retention import RetentionPolicy
+from .snapshot import SnapshotSettings
+from .telemetry import TelemetrySettings
+from .throttle import validate_throttles
+
+PROFILE_FORMAT = 1
+SAVE_MODES = ("current_dir", "prefix", "file_path")
+INDEX_FILE = "profiles.index.json"
+
+
+class Profile:
+    """ The contents of a profile file.
+
+    Attributes:
+        topics (List[str]): The topics to record
+        options (List[str]): The record options other than those naming the output
+        save_mode (str): One of SAVE_MODES
+        output (str): The prefix or the file path, depending on save_mode
+        shard_count (int): The number of recorder processes the topics are split across
+        shards (List[List[str]]): The topics of each recorder process, if the split is fixed
+        pipeline (Optional[PipelineSettings]): The post-processing of finished splits, if any
+        retention (Optional[RetentionPolicy]): The limits on the disk usage of the output directory, if any
+        snapshot (Optional[SnapshotSettings]): What to keep in memory in snapshot mode, or None to record continuously
+        offload (Optional[OffloadSettings]): Where to copy finished splits to, if anywhere
+        checksums (Optional[ChecksumSettings]): How to checksum finished splits into a manifest, if at all
+        backend (str): The recorder backend the profile targets, one of BACKEND_NAMES;
+            profiles without one were written for ROS 1
+        throttles (Dict[str, float]): The maximum messages per second of the topics recorded through
+            a throttling relay; the other topics are recorded as published
+        telemetry (Optional[TelemetrySettings]): Where the timing events and metrics of the recording go, if anywhere
+        resources (Optional[ResourceLimits]): The CPU, I/O and memory limits of each recorder process, if any
+        description (str): A free text shown in the profile list
+        created (str): The time the profile was saved, in ISO 8601, or "" if unknown
+    """
+
+    topics: List[str]
+    options: List[str]
+    save_mode: str
+    output: str
+    shard_count: int
+    shards: List[List[str]]
+    pipeline: Optional[PipelineSettings]
+    retention: Optional[RetentionPolicy]
+    snapshot: Optional[SnapshotSettings]
+    offload: Optional[OffloadSettings]
+    checksums: Optional[ChecksumSettings]
+    backend: str
+    throttles: Dict[str, float]
+    telemetry: Optional[TelemetrySettings]
+    resources: Optional[ResourceLimits]
+    description: str
+    created: str
+
+    def __init__(self, topics: List[str], options: List[str], save_mode: str = "current_dir", output: str = "",
+                 shard_count: int = 1, shards: Optional[List[List[str]]] = None,
+                 pipeline: Optional[PipelineSettings] = None, description: str = "", created: str = "",
+                 retention: Optional[RetentionPolicy] = None, snapshot: Optional[SnapshotSettings] = None,
+                 offload: Optional[OffloadSettings] = None, checksums: Optional[ChecksumSettings] = None,
+                 backend: str = ROS1, throttles: Optional[Dict[str, float]] = None,
+                 telemetry: Optional[TelemetrySettings] = None, resources: Optional[ResourceLimits] = None) -> None:
+        if save_mode not in SAVE_MODES:
+            raise ValueError("Unknown save mode: " + save_mode)
+        if backend not in BACKEND_NAMES:
+            raise ValueError("Unknown recorder backend: " + backend)
+        self.throttles = throttles if throttles is not None else {}
+        validate_throttles(self.throttles)
+        self.telemetry = telemetry
+        self.resources = resources
+        self.topics = topics
+        self.options = options
+        self.save_mode = save_mode
+        self.output = output
+        self.shards = shards if shards is not None else []
+        self.shard_count = len(self.shards) if self.shards else max(1, shard_count)
+        self.pipeline = pipeline
+        self.retention = retention
+        self.snapshot = snapshot
+        self.offload = offload
+        self.checksums = checksums
+        self.backend = backend
+        self.description = description
+        self.created = created
+
+    @classmethod
+    def from_command(cls, command: List[str], shard_count: int = 1, shards: Optional[List[List[str]]] = None,
+                     description: str = "") -> Profile:
+        """ Builds a profile from a ``rosbag record`` or ``ros2 bag record`` command line.
+
+        Raises:
+            ValueError: If it is not a record command of any backend
+        """
+        backend = backend_of(command)
+        options, topics = backend.split_command(command)
+        save_mode, output, remaining = backend.parse_output_arguments(options[len(backend.record_prefix):])
+        return cls(topics, remaining, save_mode, output, shard_count, shards, description=description,
+                   backend=backend.name)
+
+    @property
+    def command(self) -> List[str]:
+        """ The record command line of the profile, for its backend.
+        """
+        backend = get_backend(self.backend)
+        output = backend.output_arguments(self.save_mode, self.output)
+        return backend.record_prefix + self.options + output + self.topics
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "format": PROFILE_FORMAT,
+            "backend": self.backend,
+            "throttles": self.throttles,
+            "description": self.description,
+            "created": self.created,
+            "topics": self.topics,
+            "options": self.options,
+            "save_mode": self.save_mode,
+            "output": self.output,
+            "shard_count": self.shard_count,
+            "shards": self.shards,
+            "pipeline": self.pipeline.to_dict() if self.pipeline is not None else None,
+            "retention": self.retention.to_dict() if self.retention is not None else None,
+            "snapshot": self.snapshot.to_dict() if self.snapshot is not None else None,
+            "offload": self.offload.to_dict() if self.offload is not None else None,
+            "checksums": self.checksums.to_dict() if self.checksums is not None else None,
+            "telemetry": self.telemetry.to_dict() if self.telemetry is not None else None,
+            "resources": self.resources.to_dict() if self.resources is not None else None,
+        }
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> Profile:
+        pipeline = data.get("pipeline")
+        retention = data.get("retention")
+        snapshot = data.get("snapshot")
+        offload = data.get("offload")
+        checksums = data.get("checksums")
+        telemetry = data.get("telemetry")
+        resources = data.get("resources")
+        return cls([str(topic) for topic in data["topics"]],
+                   [str(option) for option in data.get("options", [])],
+                   data.get("save_mode", "current_dir"),
+                   data.get("output", ""),
+                   int(data.get("shard_count", 1)),
+                   [[str(topic) for topic in shard] for shard in data.get("shards", [])],
+                   PipelineSettings.from_dict(pipeline) if pipeline else None,
+                   data.get("description", ""),
+                   data.get("created", ""),
+                   RetentionPolicy.from_dict(retention) if retention else None,
+                   SnapshotSettings.from_dict(snapshot) if snapshot else None,
+                   OffloadSettings.from_dict(offload) if offload else None,
+                   ChecksumSettings.from_dict(checksums) if checksums else None,
+                   data.get("backend", ROS1),
+                   {str(topic): float(rate) for topic, rate in data.get("throttles", {}).items()},
+                   TelemetrySettings.from_dict(telemetry) if telemetry else None,
+                   ResourceLimits.from_dict(resources) if resources else None)
+
+
+def save_profile(file_name: str, profile: Profile) -> None:
+    if not profile.created:
+        profile.created = time.strftime("%Y-%m-%dT%H:%M:%S")
+    tmp_name = file_name + ".tmp"
+    with open(tmp_name, "w") as f:
+        json.dump(profile.to_dict(), f, indent=2)
+        f.write("\n")
+    os.replace(tmp_name, file_name)
+
+
+def load_profile(file_name: str) -> Optional[Profile]:
+    """ Reads a profile, returning None if the file is not a valid profile.
+    """
+    try:
+        with open(file_name, "r") as f:
+            text = f.read()
+    except (OSError, UnicodeDecodeError):
+        return None
+    if text.lstrip().startswith("{"):
+        try:
+            return Profile.from_dict(json.loads(text))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return None
+    return _parse_legacy_profile(text)
+
+
+def _parse_legacy_profile(text: str) -> Optional[Profile]:
+    lines = text.splitlines()
+    if not lines:
+        return None
+    command = lines[0]
+    if ("rosbag record" not in command or
+            ";" in command or
+            "|" in command or
+            "&" in command):
+        return None
+    shard_count = 1
+    shards = []
+    for line in lines[1:]:
+        key, _, value = line.strip().partition(" ")
+        if key == "shards" and value.isdigit():
+            shard_count = max(1, int(value))
+        elif key == "shard" and value:
+            shards.append(value.split())
+    try:
+        return Profile.from_command(command.split(), shard_count, shards)
+    except ValueError:
+        return None
+
+
+class ProfileSummary:
+    """ What the profile list shows about one profile.
+
+    Attributes:
+        path (str): The path of the profile file
+        description (str): The description of the profile
+        topic_count (int): The number of topics recorded
+        shard_count (int): The number of recorder processes
+        created (str): The time the profile was saved
+    """
+
+    path: str
+    description: str
+    topic_count: int
+    shard_count: int
+    created: str
+
+    def __init__(self, path: str, description: str, topic_count: int, shard_count: int, created: str) -> None:
+        self.path = path
+        self.description = description
+        self.topic_count = topic_count
+        self.shard_count = shard_count
+        self.created = created
+
+
+class ProfileIndex:
+    """ Summaries of the profiles in a directory, cached on disk by file mtime and size.
+
+    Only files that changed since the last listing are parsed again.
+    Files that are not profiles are remembered as such, so they are not parsed again either.
+    """
+
+    _directory: str
+    _index_path: str
+    _entries: Dict[str, Dict[str, Any]]
+
+    def __init__(self, directory: str = CONFIG_DIR) -> None:
+        self._directory = directory
+        self._index_path = os.path.join(directory, INDEX_FILE)
+        try:
+            with open(self._index_path, "r") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+    def list(self) -> List[ProfileSummary]:
+        """ Returns the summaries of all valid profiles, sorted by file name.
+        """
+        entries: Dict[str, Dict[str, Any]] = {}
+        changed = False
+        try:
+            dir_entries = list(os.scandir(self._directory))
+        except OSError:
+            dir_entries = []
+        for dir_entry in dir_entries:
+            name = dir_entry.name
+            if name == INDEX_FILE or name.endswith(".tmp") or not dir_entry.is_file():
+                continue
+            st = dir_entry.stat()
+            entry = self._entries.get(name)
+            if entry is None or entry["mtime_ns"] != st.st_mtime_ns or entry["size"] != st.st_size:
+                entry = self._summarize(dir_entry.path, st)
+                changed = True
+            entries[name] = entry
+        if changed or len(entries) != len(self._entries):
+            self._entries = entries
+            self._save()
+
+        return [ProfileSummary(os.path.join(self._directory, name), entry["description"], entry["topic_count"],
+                               entry["shard_count"], entry["created"])
+                for name, entry in sorted(entries.items()) if entry["valid"]]
+
+    @staticmethod
+    def _summarize(path: str, st: os.stat_result) -> Dict[str, Any]:
+        entry: Dict[str, Any] = {"mtime_ns": st.st_mtime_ns, "size": st.st_size, "valid": False}
+        # profiles are small; anything large in the config directory is something else
+        profile = load_profile(path) if st.st_size < 1024 * 1024 else None
+        if profile is not None:
+            created = profile.created or time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(st.st_mtime))
+            entry.update({"valid": True, "description": profile.description, "topic_count": len(profile.topics),
+                          "shard_count": profile.shard_count, "created": created})
+        return entry
+
+    def _save(self) -> None:
+        if not os.path.isdir(self._directory):
+            return
+        tmp_path = self._index_path + ".tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self._index_path)
+        except OSError as e:
+            print(f"[SmartBagRec] Could not write profile index: {e}")
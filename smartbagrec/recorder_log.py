@@ -0,0 +1,129 @@
+""" Continuous draining of the recorder's console output.
+
+If nobody reads the stdout/stderr pipes of ``rosbag record``, the kernel pipe buffer
+fills up during a long session and rosbag blocks on write, which stalls the recording.
+``RecorderOutput`` reads both pipes in daemon threads, keeps the most recent lines
+in a bounded ring buffer for the GUI and writes every line to a log file.
+Buffer overflow warnings are counted as they arrive.
+"""
+
+from __future__ import annotations
+
+import collections
+import itertools
+import subprocess
+import threading
+from typing import IO, Deque, List, Optional, Tuple
+
+from .overflow import OverflowTracker
+
+LogLine = Tuple[int, str, str]
+
+
+class RingBuffer:
+    """ A thread-safe buffer of the last ``capacity`` lines.
+
+    Every line gets a sequence number, so a reader can ask for the lines
+    it has not seen yet without copying the whole buffer.
+    """
+
+    _lines: Deque[LogLine]
+    _next_seq: int
+    _lock: threading.Lock
+
+    def __init__(self, capacity: int) -> None:
+        self._lines = collections.deque(maxlen=capacity)
+        self._next_seq = 0
+        self._lock = threading.Lock()
+
+    def append(self, stream: str, line: str) -> None:
+        with self._lock:
+            self._lines.append((self._next_seq, stream, line))
+            self._next_seq += 1
+
+    def since(self, seq: int) -> List[LogLine]:
+        """ Returns the buffered lines whose sequence number is ``seq`` or later.
+        """
+        with self._lock:
+            if not self._lines or self._lines[-1][0] < seq:
+                return []
+            start = max(0, seq - self._lines[0][0])
+            return list(itertools.islice(self._lines, start, None))
+
+    def tail(self, n: int, stream: Optional[str] = None) -> List[str]:
+        with self._lock:
+            lines = [line for _, s, line in self._lines if stream is None or s == stream]
+        return lines[-n:]
+
+
+class RecorderOutput:
+    """ Drains stdout and stderr of a recorder process.
+
+    Attributes:
+        buffer (RingBuffer): The most recent lines of both streams
+        log_path (Optional[str]): The file every line is written to, if any
+        overflow (OverflowTracker): The buffer overflow warnings seen so far
+    """
+
+    DEFAULT_CAPACITY = 2000
+
+    buffer: RingBuffer
+    log_path: Optional[str]
+    overflow: OverflowTracker
+    _log_file: Optional[IO[str]]
+    _log_lock: threading.Lock
+    _open_pipes: int
+    _threads: List[threading.Thread]
+
+    def __init__(self, process: subprocess.Popen, log_path: Optional[str] = None,
+                 capacity: int = DEFAULT_CAPACITY) -> None:
+        self.buffer = RingBuffer(capacity)
+        self.log_path = log_path
+        self.overflow = OverflowTracker()
+        self._log_file = None
+        self._log_lock = threading.Lock()
+        if log_path is not None:
+            try:
+                self._log_file = open(log_path, "a", buffering=1)
+            except OSError as e:
+                print(f"[SmartBagRec] Could not open log file {log_path}: {e}")
+                self.log_path = None
+
+        self._threads = []
+        pipes = [(stream, pipe) for stream, pipe in (("stdout", process.stdout), ("stderr", process.stderr))
+                 if pipe is not None]
+        self._open_pipes = len(pipes)
+        for stream, pipe in pipes:
+            thread = threading.Thread(target=self._drain, args=(stream, pipe), daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    @property
+    def finished(self) -> bool:
+        """ True once both pipes have been read to the end.
+        """
+        return not any(thread.is_alive() for thread in self._threads)
+
+    def join(self, timeout: Optional[float] = None) -> None:
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def _drain(self, stream: str, pipe: IO[bytes]) -> None:
+        for raw in iter(pipe.readline, b""):
+            line = raw.decode("utf-8", errors="replace").rstrip("\n")
+            self.buffer.append(stream, line)
+            self.overflow.feed(line)
+            self._write_log(stream, line)
+        pipe.close()
+        with self._log_lock:
+            self._open_pipes -= 1
+            if self._open_pipes == 0 and self._log_file is not None:
+                self._log_file.close()
+                self._log_file = None
+
+    def _write_log(self, stream: str, line: str) -> None:
+        with self._log_lock:
+            if self._log_file is None:
+                return
+            prefix = "[stderr] " if stream == "stderr" else ""
+            self._log_file.write(prefix + line + "\n")
@@ -0,0 +1,247 @@
+""" Repair of bag files whose recorder died before writing the index.
+
+A crash or a power loss leaves ``.bag.active`` files without an index, which ``rosbag reindex``
+rebuilds by reading the whole file. The files under a directory are reindexed by a bounded pool
+of ``rosbag reindex`` processes, each writing into a temporary directory next to the file,
+so the original stays untouched until its repaired copy replaces it as ``.bag``.
+
+Files that a running process still holds open are skipped, as they belong to a live recorder.
+"""
+
+from __future__ import annotations
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Set
+
+from .monitor import format_bytes
+
+ACTIVE_SUFFIX = ".bag.active"
+REPAIR_STATES = ("queued", "running", "done", "failed", "skipped")
+
+
+class RepairItem:
+    """ One ``.bag.active`` file and how far its repair is.
+
+    Attributes:
+        path (str): The ``.bag.active`` file
+        size (int): Its size in bytes
+        state (str): One of REPAIR_STATES
+        message (str): Why the file failed or was skipped
+        output (Optional[str]): The repaired ``.bag`` file once it is done
+        written (int): Bytes of the repaired copy written so far
+    """
+
+    path: str
+    size: int
+    state: str
+    message: str
+    output: Optional[str]
+    written: int
+
+    def __init__(self, path: str, size: int) -> None:
+        self.path = path
+        self.size = size
+        self.state = "queued"
+        self.message = ""
+        self.output = None
+        self.written = 0
+
+    @property
+    def progress(self) -> float:
+        if self.state == "done":
+            return 1.0
+        return min(1.0, self.written / self.size) if self.size else 0.0
+
+
+class RepairStatus:
+    """ Progress of a repair job.
+
+    Attributes:
+        items (List[RepairItem]): A snapshot of every file, in the order they are repaired
+        elapsed (float): Seconds since the job started
+        bytes_done (int): Bytes reindexed so far, including the part of the running files
+    """
+
+    items: List[RepairItem]
+    elapsed: float
+    bytes_done: int
+
+    def __init__(self, items: List[RepairItem], elapsed: float, bytes_done: int) -> None:
+        self.items = items
+        self.elapsed = elapsed
+        self.bytes_done = bytes_done
+
+    @property
+    def rate(self) -> float:
+        return self.bytes_done / self.elapsed if self.elapsed > 0 else 0.0
+
+    def count(self, state: str) -> int:
+        return sum(1 for item in self.items if item.state == state)
+
+    @property
+    def finished(self) -> bool:
+        return not any(item.state in ("queued", "running") for item in self.items)
+
+
+class RepairJob:
+    """ Reindexes the ``.bag.active`` files under a directory with at most ``workers`` processes at a time.
+    """
+
+    _items: List[RepairItem]
+    _workers: int
+    _executor: Optional[ThreadPoolExecutor]
+    _lock: threading.Lock
+    _started: float
+    _cancelled: bool
+
+    def __init__(self, directory: str, workers: int = 2, recursive: bool = True) -> None:
+        self._items = []
+        for path in find_active_files(directory, recursive):
+            try:
+                self._items.append(RepairItem(path, os.path.getsize(path)))
+            except OSError:
+                continue
+        self._workers = max(1, workers)
+        self._executor = None
+        self._lock = threading.Lock()
+        self._started = 0.0
+        self._cancelled = False
+
+    def start(self) -> None:
+        """ Starts the repair in the background.
+        """
+        open_files = files_open_by_processes()
+        self._started = time.monotonic()
+        # the largest files first, so one of them does not finish long after the rest
+        self._items.sort(key=lambda item: item.size, reverse=True)
+        self._executor = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="smartbagrec-repair")
+        for item in self._items:
+            if item.path in open_files:
+                item.state = "skipped"
+                item.message = "still open by a running process"
+            else:
+                self._executor.submit(self._repair, item)
+        self._executor.shutdown(wait=False)
+
+    def cancel(self) -> None:
+        """ Leaves the queued files as they are; files being reindexed are finished.
+        """
+        with self._lock:
+            self._cancelled = True
+
+    def wait(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+
+    def status(self) -> RepairStatus:
+        with self._lock:
+            for item in self._items:
+                if item.state == "running" and item.output is not None:
+                    try:
+                        item.written = os.path.getsize(item.output)
+                    except OSError:
+                        pass
+            items = [_copy(item) for item in self._items]
+        done = sum(item.size if item.state == "done" else item.written for item in items)
+        return RepairStatus(items, time.monotonic() - self._started if self._started else 0.0, done)
+
+    def _repair(self, item: RepairItem) -> None:
+        with self._lock:
+            if self._cancelled:
+                item.state = "skipped"
+                item.message = "cancelled"
+                return
+            item.state = "running"
+        target = item.path[:-len(".active")]
+        if os.path.exists(target):
+            self._finish(item, "failed", f"{os.path.basename(target)} already exists")
+            return
+        work_dir = tempfile.mkdtemp(prefix=".smartbagrec_repair_", dir=os.path.dirname(item.path))
+        try:
+            with self._lock:
+                item.output = os.path.join(work_dir, os.path.basename(item.path))
+            argv = ["rosbag", "reindex", "-q", "--output-dir", work_dir, item.path]
+            try:
+                result = subprocess.run(argv, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            except OSError as e:
+                self._finish(item, "failed", str(e))
+                return
+            if result.returncode != 0 or not os.path.exists(item.output):
+                lines = result.stderr.strip().splitlines()
+                self._finish(item, "failed", lines[-1] if lines else f"rosbag reindex exited with {result.returncode}")
+                return
+            os.replace(item.output, target)
+            os.remove(item.path)
+            with self._lock:
+                item.output = target
+            self._finish(item, "done")
+        except OSError as e:
+            self._finish(item, "failed", str(e))
+        finally:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    def _finish(self, item: RepairItem, state: str, message: str = "") -> None:
+        with self._lock:
+            item.state = state
+            item.message = message
+        if state == "done":
+            print(f"[SmartBagRec] Repaired: {item.output}")
+        else:
+            print(f"[SmartBagRec] Could not repair {item.path}: {message}")
+
+
+def find_active_files(directory: str, recursive: bool = True) -> List[str]:
+    """ Returns the ``.bag.active`` files under the directory as real paths, sorted.
+    """
+    paths = []
+    for root, dirs, files in os.walk(os.path.realpath(directory)):
+        paths.extend(os.path.join(root, name) for name in files if name.endswith(ACTIVE_SUFFIX))
+        # skip the work directories of a repair that is running elsewhere
+        dirs[:] = [name for name in dirs if recursive and not name.startswith(".smartbagrec_repair_")]
+    return sorted(paths)
+
+
+def files_open_by_processes() -> Set[str]:
+    """ Returns the files held open by any process that can be inspected, from /proc.
+
+    Elsewhere than on Linux the set is empty, so no file is skipped.
+    """
+    paths: Set[str] = set()
+    try:
+        pids = [name for name in os.listdir("/proc") if name.isdigit()]
+    except OSError:
+        return paths
+    for pid in pids:
+        fd_dir = os.path.join("/proc", pid, "fd")
+        try:
+            fds = os.listdir(fd_dir)
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                paths.add(os.readlink(os.path.join(fd_dir, fd)))
+            except OSError:
+                continue
+    return paths
+
+
+def format_repair_status(status: RepairStatus) -> str:
+    counts: Dict[str, int] = {state: status.count(state) for state in REPAIR_STATES}
+    return (f"{counts['done']}/{len(status.items)} repaired, {counts['failed']} failed, "
+            f"{counts['skipped']} skipped, {counts['running']} running | "
+            f"{format_bytes(status.bytes_done)} at {format_bytes(status.rate)}/s")
+
+
+def _copy(item: RepairItem) -> RepairItem:
+    copy = RepairItem(item.path, item.size)
+    copy.state = item.state
+    copy.message = item.message
+    copy.output = item.output
+    copy.written = item.written
+    return copy
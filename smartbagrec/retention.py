@@ -0,0 +1,230 @@
+""" Byte-budget retention of the bag files in an output directory.
+
+``--max-splits`` only bounds the number of files, which does not bound the disk usage
+when split sizes vary. ``RetentionManager`` deletes the oldest finished bag files
+until the directory fits a byte budget and/or the filesystem keeps a minimum of free space.
+Only the files of the recordings writing to the directory count and are deleted: other bag files,
+e.g. of earlier recordings, of sessions running side by side or kept by the user, are left alone.
+The active file is never touched, and every eviction is logged.
+
+The directory is indexed once and then only rescanned when its mtime changes,
+and a rescan only stats names that are new, so directories with tens of thousands
+of bag files cost a stat of the directory per tick. A file known already that is rewritten,
+e.g. compressed by the post-processing, is re-read through ``refresh``.
+"""
+
+from __future__ import annotations
+
+import heapq
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+from .monitor import MTIME_SLACK_SEC
+from .output import OutputSpec, active_bag_files, is_bag_file
+
+EVICTION_LOG = "smartbagrec_retention.log"
+
+
+class RetentionPolicy:
+    """ Limits on an output directory.
+
+    Attributes:
+        max_bytes (Optional[int]): The maximum total size of the bag files in the directory
+        min_free_bytes (Optional[int]): The minimum free space to keep on the filesystem
+    """
+
+    max_bytes: Optional[int]
+    min_free_bytes: Optional[int]
+
+    def __init__(self, max_bytes: Optional[int] = None, min_free_bytes: Optional[int] = None) -> None:
+        self.max_bytes = max_bytes
+        self.min_free_bytes = min_free_bytes
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes is not None or self.min_free_bytes is not None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"max_bytes": self.max_bytes, "min_free_bytes": self.min_free_bytes}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> RetentionPolicy:
+        max_bytes = data.get("max_bytes")
+        min_free_bytes = data.get("min_free_bytes")
+        return cls(int(max_bytes) if max_bytes is not None else None,
+                   int(min_free_bytes) if min_free_bytes is not None else None)
+
+
+class RetentionManager:
+    """ Enforces a retention policy on one directory.
+
+    Attributes:
+        directory (str): The directory whose bag files are managed
+        evicted (int): The number of files deleted so far
+        evicted_bytes (int): The size of the files deleted so far
+    """
+
+    directory: str
+    evicted: int
+    evicted_bytes: int
+    _policy: RetentionPolicy
+    _specs: List[OutputSpec]
+    _is_protected: Callable[[str], bool]
+    _dir_mtime: Optional[int]
+    _finished: Dict[str, Tuple[int, float]]
+    _finished_bytes: int
+    _active: Set[str]
+    _ignored: Set[str]
+    _oldest: List[Tuple[float, str]]
+
+    def __init__(self, directory: str, policy: RetentionPolicy, specs: Sequence[OutputSpec],
+                 is_protected: Callable[[str], bool] = lambda path: False) -> None:
+        """
+        Args:
+            directory (str): The directory whose bag files are managed
+            policy (RetentionPolicy): The limits to enforce
+            specs (Sequence[OutputSpec]): The recordings writing to the directory, whose bag files are managed
+            is_protected (Callable[[str], bool]): Tells whether a finished file is still in use,
+                e.g. by post-processing, and must not be deleted yet
+        """
+        self.directory = directory
+        self.evicted = 0
+        self.evicted_bytes = 0
+        self._policy = policy
+        self._specs = list(specs)
+        self._is_protected = is_protected
+        self._dir_mtime = None
+        self._finished = {}
+        self._finished_bytes = 0
+        self._active = set()
+        self._ignored = set()
+        self._oldest = []
+
+    def enforce(self) -> List[str]:
+        """ Deletes the oldest finished bag files until the policy is met, returning their paths.
+        """
+        self._update_index()
+        evicted = []
+        skipped = []
+        while self._over_limit() and self._oldest:
+            mtime, path = heapq.heappop(self._oldest)
+            entry = self._finished.get(path)
+            if entry is None or entry[1] != mtime:
+                continue  # deleted or replaced since it was pushed
+            if self._is_protected(path):
+                skipped.append((mtime, path))
+                continue
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                self._forget(path)
+                continue
+            except OSError as e:
+                print(f"[SmartBagRec] Could not delete {path}: {e}")
+                skipped.append((mtime, path))
+                continue
+            self._forget(path)
+            self.evicted += 1
+            self.evicted_bytes += entry[0]
+            evicted.append(path)
+            self._log_eviction(path, entry[0])
+        for item in skipped:
+            heapq.heappush(self._oldest, item)
+        return evicted
+
+    def refresh(self, path: str) -> None:
+        """ Re-reads the size and the mtime of a finished file that has been rewritten,
+        e.g. compressed by the post-processing, which a rescan of the directory would not.
+        """
+        if path not in self._finished:
+            return  # not indexed yet, so the next rescan stats it anyway
+        self._forget(path)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return
+        self._finished[path] = (st.st_size, st.st_mtime)
+        self._finished_bytes += st.st_size
+        # the entry pushed with the old mtime is skipped when popped
+        heapq.heappush(self._oldest, (st.st_mtime, path))
+
+    def _over_limit(self) -> bool:
+        if self._policy.max_bytes is not None and self._used_bytes() > self._policy.max_bytes:
+            return True
+        if self._policy.min_free_bytes is not None and self._free_bytes() < self._policy.min_free_bytes:
+            return True
+        return False
+
+    def _used_bytes(self) -> int:
+        used = self._finished_bytes
+        for path in self._active:
+            try:
+                used += os.stat(path).st_size
+            except OSError:
+                pass
+        return used
+
+    def _free_bytes(self) -> int:
+        try:
+            vfs = os.statvfs(self.directory)
+        except OSError:
+            return 0
+        return vfs.f_bavail * vfs.f_frsize
+
+    def _update_index(self) -> None:
+        try:
+            dir_mtime = os.stat(self.directory).st_mtime_ns
+        except OSError:
+            return
+        if dir_mtime == self._dir_mtime:
+            return
+        self._dir_mtime = dir_mtime
+
+        names = set()
+        active = set()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        active_names = active_bag_files(entry.name for entry in entries)
+        for entry in entries:
+            is_active = entry.name in active_names
+            if not is_active and not is_bag_file(entry.name):
+                continue
+            names.add(entry.path)
+            if entry.path in self._ignored or entry.path in self._finished:
+                continue
+            try:
+                st = entry.stat()
+            except OSError:
+                continue
+            if not self._owns(entry.name, st.st_mtime):
+                self._ignored.add(entry.path)
+            elif is_active:
+                active.add(entry.path)
+            else:
+                self._finished[entry.path] = (st.st_size, st.st_mtime)
+                self._finished_bytes += st.st_size
+                heapq.heappush(self._oldest, (st.st_mtime, entry.path))
+        for path in [path for path in self._finished if path not in names]:
+            self._forget(path)
+        self._ignored &= names
+        self._active = active
+
+    def _owns(self, name: str, mtime: float) -> bool:
+        # a timestamped name may also be that of an earlier recording with the same prefix, written before it started
+        return any(spec.matches(name) and (spec.stem is not None or mtime >= spec.started - MTIME_SLACK_SEC)
+                   for spec in self._specs)
+
+    def _forget(self, path: str) -> None:
+        self._finished_bytes -= self._finished.pop(path)[0]
+
+    def _log_eviction(self, path: str, size: int) -> None:
+        line = f"{time.strftime('%Y-%m-%dT%H:%M:%S')} deleted {path} ({size} bytes)"
+        print("[SmartBagRec] Retention " + line)
+        try:
+            with open(os.path.join(self.directory, EVICTION_LOG), "a") as f:
+                f.write(line + "\n")
+        except OSError:
+            pass
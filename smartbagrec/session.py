@@ -0,0 +1,562 @@
+""" Recording sessions made of one or more ``rosbag record`` or ``ros2 bag record`` processes.
+
+With compression enabled a single recorder is bound to one core,
+so the topics of a session can be split into shards, each recorded by its own process.
+The shards are started and stopped together and report their status as one session.
+
+Each recorder runs in a process group of its own. ``rosbag record`` is a wrapper that ignores
+SIGINT and leaves it to its ``record`` child, so stopping signals the whole group: SIGINT first,
+which lets rosbag write the index and rename the ``.bag.active`` file, and SIGTERM/SIGKILL
+only if the recorder does not exit in time. ``ros2 bag record`` handles SIGINT itself,
+closing the last split and writing ``metadata.yaml``, so only the recorder process is signalled.
+"""
+
+from __future__ import annotations
+
+import collections
+import os
+import signal
+import subprocess
+import threading
+import time
+from typing import Callable, Deque, List, Mapping, Optional, Sequence, Set, Tuple
+
+from .backend import ROS1, RecorderBackend, backend_of
+from .checksum import ChecksumQueue, ChecksumSettings, ChecksumStatus
+from .command import shard_commands
+from .isolation import ResourceLimits, ResourceMonitor, ResourceUsage, isolation_prefix
+from .monitor import MTIME_SLACK_SEC, ThroughputMonitor, ThroughputSample
+from .offload import OffloadQueue, OffloadSettings, OffloadStatus
+from .output import OutputSpec, active_bag_files
+from .overflow import BufferRecommendation, recommend_buffer
+from .pipeline import PipelineSettings, PipelineStatus, SplitPipeline
+from .recorder_log import RecorderOutput
+from .retention import RetentionManager, RetentionPolicy
+from .telemetry import SessionTelemetry, TelemetrySettings
+from .throttle import ThrottleRelays, recorded_topics
+
+COMPRESSION_OPTIONS = ("-j", "--bz2", "--lz4")
+STOP_TIMEOUT_SEC = 10.0
+KILL_TIMEOUT_SEC = 5.0
+
+
+class Recorder:
+    """ One recorder process with its drained output and output files.
+
+    Attributes:
+        command (List[str]): The command line of the process
+        backend (RecorderBackend): The backend the command line belongs to
+        process (subprocess.Popen): The recorder process
+        output (RecorderOutput): The drained stdout/stderr of the process
+        spec (OutputSpec): The naming of the bag files the process writes
+        monitor (ThroughputMonitor): The sampler of the bag files
+        resources (ResourceMonitor): The limits the process runs with and the CPU and memory it uses
+        spawned (float): The time.monotonic() value at which the process was about to be spawned
+        spawn_latency (float): Seconds the spawning took
+    """
+
+    command: List[str]
+    backend: RecorderBackend
+    spawned: float
+    spawn_latency: float
+    process: subprocess.Popen
+    output: RecorderOutput
+    spec: OutputSpec
+    monitor: ThroughputMonitor
+    resources: ResourceMonitor
+
+    def __init__(self, command: List[str], started: float, prefix: Sequence[str] = ()) -> None:
+        """
+        Args:
+            command (List[str]): The record command line
+            started (float): The time.time() value at which the session was started
+            prefix (Sequence[str]): The commands applying the resource limits, which execute the record command
+        """
+        self.command = command
+        self.backend = backend_of(command)
+        self.spec = self.backend.output_spec(command, started)
+        self.spawned = time.monotonic()
+        self.process = subprocess.Popen(list(prefix) + command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                        start_new_session=True)
+        self.spawn_latency = time.monotonic() - self.spawned
+        self.output = RecorderOutput(self.process, self.spec.log_path)
+        self.monitor = ThroughputMonitor(self.spec)
+        self.resources = ResourceMonitor(self.process.pid, command, self.spawned)
+
+    def poll(self) -> Optional[int]:
+        return self.process.poll()
+
+    def stop(self, signum: int = signal.SIGINT) -> bool:
+        """ Signals the recorder, or its process group if the backend needs it,
+        returning False if it had already exited.
+        """
+        if self.process.poll() is not None:
+            return False
+        try:
+            if self.backend.signal_group:
+                os.killpg(self.process.pid, signum)
+            else:
+                self.process.send_signal(signum)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def unfinalized_files(self) -> List[str]:
+        """ Returns the bag files of this recording that are still being written,
+        i.e. ".bag.active" files, or the last split of a ROS 2 bag without metadata.yaml.
+        """
+        paths = []
+        try:
+            entries = list(os.scandir(self.spec.directory))
+        except OSError:
+            return paths
+        active = active_bag_files(entry.name for entry in entries)
+        for entry in entries:
+            if entry.name not in active or not self.spec.matches(entry.name):
+                continue
+            try:
+                if entry.stat().st_mtime >= self.spec.started - MTIME_SLACK_SEC:
+                    paths.append(entry.path)
+            except OSError:
+                continue
+        return paths
+
+
+class ShutdownReport:
+    """ How the recorders of a session were stopped.
+
+    Attributes:
+        latency (float): Seconds from the stop request until every recorder had exited
+        signals (List[Optional[str]]): The last signal each recorder needed, or None if it had already exited
+        unfinalized (List[str]): Bag files left unfinished, which need ``rosbag reindex`` or ``ros2 bag reindex``
+    """
+
+    latency: float
+    signals: List[Optional[str]]
+    unfinalized: List[str]
+
+    def __init__(self, latency: float, signals: List[Optional[str]], unfinalized: List[str]) -> None:
+        self.latency = latency
+        self.signals = signals
+        self.unfinalized = unfinalized
+
+    @property
+    def finalized(self) -> bool:
+        return not self.unfinalized
+
+    def lines(self) -> List[str]:
+        lines = [f"Recorders stopped in {self.latency:.2f} s."]
+        for i, name in enumerate(self.signals):
+            if name in ("SIGTERM", "SIGKILL"):
+                lines.append(f"Recorder {i} did not exit on SIGINT in time and needed {name}.")
+        for path in self.unfinalized:
+            if path.endswith(".active"):
+                lines.append("Not finalized, needs rosbag reindex: " + path)
+            else:
+                # rosbag2 reindexes a whole bag directory
+                lines.append(f"Not finalized, needs ros2 bag reindex {os.path.dirname(path)}: {path}")
+        return lines
+
+
+class RecordingSession:
+    """ A set of recorders started and stopped together.
+
+    Attributes:
+        recorders (List[Recorder]): One recorder per shard
+        name (str): The name of the recording, which the names of its output files start with
+        started (float): The time.time() value at which the session was started
+        options (List[str]): The record command and the options the session was asked to record with
+        pipeline (Optional[SplitPipeline]): The post-processing of finished splits, if enabled
+        retention (List[RetentionManager]): One retention manager per output directory, if a policy is set
+        checksums (Optional[ChecksumQueue]): The hashing of finished splits into a manifest, if enabled
+        offload (Optional[OffloadQueue]): The copying of finished splits to an archive, if enabled
+        relays (Optional[ThrottleRelays]): The relays of the throttled topics, if any topic is throttled
+        telemetry (Optional[SessionTelemetry]): The timing events and metrics of the session, if enabled
+        resource_limits (Optional[ResourceLimits]): The CPU, I/O and memory limits of each recorder, if any
+    """
+
+    recorders: List[Recorder]
+    name: str
+    started: float
+    options: List[str]
+    pipeline: Optional[SplitPipeline]
+    retention: List[RetentionManager]
+    checksums: Optional[ChecksumQueue]
+    offload: Optional[OffloadQueue]
+    relays: Optional[ThrottleRelays]
+    telemetry: Optional[SessionTelemetry]
+    resource_limits: Optional[ResourceLimits]
+    _after_pipeline: Optional[Callable[[str], None]]
+    _handed_over: Set[str]
+    _pending: Deque[str]
+    _feed_lock: threading.Lock
+    _finisher: Optional[threading.Thread]
+    _sample_lock: threading.Lock
+    _shutdown_lock: threading.Lock
+    _stop_requested: bool
+    _report: Optional[ShutdownReport]
+
+    def __init__(self, options: Sequence[str], shards: Sequence[Sequence[str]],
+                 pipeline_settings: Optional[PipelineSettings] = None,
+                 retention_policy: Optional[RetentionPolicy] = None,
+                 offload_settings: Optional[OffloadSettings] = None,
+                 checksum_settings: Optional[ChecksumSettings] = None,
+                 throttles: Optional[Mapping[str, float]] = None,
+                 telemetry_settings: Optional[TelemetrySettings] = None,
+                 resource_limits: Optional[ResourceLimits] = None) -> None:
+        """
+        Args:
+            options (Sequence[str]): The record command of a backend and its options, without topics
+            shards (Sequence[Sequence[str]]): The topics of each recorder process
+            pipeline_settings (Optional[PipelineSettings]): How to process finished splits.
+                If it compresses, the recorders themselves write uncompressed bags.
+            retention_policy (Optional[RetentionPolicy]): Limits on the disk usage of the output directories
+            offload_settings (Optional[OffloadSettings]): Where to copy finished splits to,
+                after the pipeline and the checksum if there are
+            checksum_settings (Optional[ChecksumSettings]): How to checksum finished splits,
+                after the pipeline if there is one
+            throttles (Optional[Mapping[str, float]]): The maximum messages per second of the topics
+                recorded through a throttling relay
+            telemetry_settings (Optional[TelemetrySettings]): Where to write the timing events and metrics
+            resource_limits (Optional[ResourceLimits]): The CPU, I/O and memory limits of each recorder
+
+        Raises:
+            ValueError: If the checksum algorithm is not available,
+                or the pipeline compresses with ``rosbag compress`` but the backend is not ROS 1,
+                or a CPU to pin the recorders to is not available
+            OSError: If a recorder or a relay cannot be started, or the telemetry file cannot be opened
+        """
+        if (pipeline_settings is not None and pipeline_settings.compression is not None
+                and backend_of(options).name != ROS1):
+            raise ValueError("Compressing finished splits needs the ros1 backend; "
+                             "record MCAP with a zstd storage preset instead")
+        self.resource_limits = resource_limits if resource_limits is not None and resource_limits.enabled else None
+        prefix = isolation_prefix(self.resource_limits) if self.resource_limits is not None else []
+        self.started = time.time()
+        self.options = list(options)
+        self.pipeline = None
+        self.retention = []
+        self._handed_over = set()
+        self._pending = collections.deque()
+        self._feed_lock = threading.Lock()
+        self._finisher = None
+        self._sample_lock = threading.Lock()
+        self._shutdown_lock = threading.Lock()
+        self._stop_requested = False
+        self._report = None
+        # every finished split goes through the pipeline, the checksum and the offload, in this order
+        self._after_pipeline = None
+        self.offload = None
+        if offload_settings is not None and offload_settings.enabled:
+            self.offload = OffloadQueue(offload_settings, self._recording)
+            self._after_pipeline = self.offload.submit
+        self.checksums = None
+        if checksum_settings is not None:
+            self.checksums = ChecksumQueue(checksum_settings, self._after_pipeline)
+            self._after_pipeline = self.checksums.submit
+        if pipeline_settings is not None and pipeline_settings.enabled:
+            self.pipeline = SplitPipeline(pipeline_settings, on_done=self._on_processed)
+            if pipeline_settings.compression is not None:
+                options = [option for option in options if option not in COMPRESSION_OPTIONS]
+        self.recorders = []
+        backend = backend_of(options)
+        log_path = backend.output_spec(options, self.started).log_path
+        self.name = os.path.basename(log_path)[:-len(".log")]
+        self.telemetry = None
+        if telemetry_settings is not None and telemetry_settings.enabled:
+            self.telemetry = SessionTelemetry(telemetry_settings, self)
+        self.relays = None
+        throttled = {topic: rate for topic, rate in (throttles or {}).items() if any(topic in s for s in shards)}
+        if throttled:
+            self.relays = ThrottleRelays(throttled, backend, log_path[:-len(".log")] + "_throttle.log")
+            shards = [recorded_topics(topics, throttled) for topics in shards]
+        if prefix:
+            print(f"[SmartBagRec] Recorders are started through: {' '.join(prefix)}")
+        try:
+            for command in shard_commands(options, shards, self.started):
+                print(f"[SmartBagRec] Recording command is: {' '.join(command)}")
+                self.recorders.append(Recorder(command, self.started, prefix))
+        except OSError:
+            self.stop()
+            if self.relays is not None:
+                self.relays.shutdown()
+            if self.telemetry is not None:
+                self.telemetry.close()
+            raise
+        if retention_policy is not None and retention_policy.enabled:
+            directories = sorted({recorder.spec.directory for recorder in self.recorders})
+            self.retention = [RetentionManager(directory, retention_policy,
+                                               [recorder.spec for recorder in self.recorders
+                                                if recorder.spec.directory == directory], self._in_use)
+                              for directory in directories]
+        if self.telemetry is not None:
+            # started last, as its thread samples the session
+            self.telemetry.start()
+
+    def poll(self) -> Optional[int]:
+        """ Returns None while recording, 0 when all recorders have exited normally,
+        or the exit code of the first recorder that failed.
+        """
+        codes = [recorder.poll() for recorder in self.recorders]
+        for code in codes:
+            if code:
+                return code
+        if any(code is None for code in codes):
+            return None
+        return 0
+
+    def stop(self) -> None:
+        """ Asks every recorder to finish its bag file and exit, without waiting.
+        """
+        for recorder in self.recorders:
+            recorder.stop()
+
+    @property
+    def stopping(self) -> bool:
+        """ True from the first shutdown() call until the recorders have exited.
+        """
+        return self._stop_requested and self._report is None
+
+    @property
+    def report(self) -> Optional[ShutdownReport]:
+        """ How the session was shut down, or None if shutdown() has not finished.
+        """
+        return self._report
+
+    def shutdown(self, timeout: float = STOP_TIMEOUT_SEC, kill_timeout: float = KILL_TIMEOUT_SEC) -> ShutdownReport:
+        """ Stops the recorders and waits for them, escalating to SIGTERM and then SIGKILL
+        for recorders that do not exit within ``timeout`` and ``kill_timeout`` seconds.
+
+        The session can be shut down from several threads, e.g. the GUI and the control API:
+        the first call stops it, and the others wait for it and return the same report.
+        This blocks, so the GUI runs it in a thread of its own.
+        """
+        self._stop_requested = True
+        with self._shutdown_lock:
+            if self._report is None:
+                self._report = self._shutdown(timeout, kill_timeout)
+            return self._report
+
+    def _shutdown(self, timeout: float, kill_timeout: float) -> ShutdownReport:
+        start = time.monotonic()
+        signals: List[Optional[str]] = [("SIGINT" if recorder.stop() else None) for recorder in self.recorders]
+        deadline = start + timeout
+        for signum in (signal.SIGTERM, signal.SIGKILL):
+            if self._wait(deadline):
+                break
+            for i, recorder in enumerate(self.recorders):
+                if recorder.stop(signum):
+                    signals[i] = signal.Signals(signum).name
+            deadline = time.monotonic() + kill_timeout
+        for recorder in self.recorders:
+            recorder.process.wait()
+        latency = time.monotonic() - start
+        if self.relays is not None:
+            self.relays.shutdown()
+        unfinalized = [path for recorder in self.recorders for path in recorder.unfinalized_files()]
+        report = ShutdownReport(latency, signals, unfinalized)
+        if self.telemetry is not None:
+            self.telemetry.on_stop(report, time.monotonic() - start)
+        return report
+
+    def _wait(self, deadline: float) -> bool:
+        while any(recorder.poll() is None for recorder in self.recorders):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def sample(self) -> ThroughputSample:
+        """ Samples the bag files of all recorders and sums them up.
+
+        Splits found finished since the last sample are handed over to the pipeline,
+        or to the checksum or the offload if there is no pipeline, and then the retention policy is enforced.
+        """
+        with self._sample_lock:
+            samples = [recorder.monitor.sample() for recorder in self.recorders]
+            if self.pipeline is not None:
+                self._feed_pipeline()
+            elif self._after_pipeline is not None:
+                self._feed_finished()
+            if self.retention:
+                with self._feed_lock:
+                    for manager in self.retention:
+                        manager.enforce()
+            total = ThroughputSample(
+                max(sample.time for sample in samples),
+                sum(sample.total_bytes for sample in samples),
+                sum(sample.rate for sample in samples),
+                sum(sample.split_count for sample in samples),
+                sum(sample.active_count for sample in samples),
+                min(sample.free_bytes for sample in samples))
+            if self.telemetry is not None:
+                self.telemetry.on_sample(samples, total)
+        return total
+
+    def resource_usage(self) -> List[ResourceUsage]:
+        """ The CPU and memory use of each recorder and its children.
+        """
+        return [recorder.resources.sample() for recorder in self.recorders]
+
+    def pipeline_status(self) -> Optional[PipelineStatus]:
+        """ Returns the progress of the pipeline, counting splits held back by back-pressure as queued.
+        """
+        if self.pipeline is None:
+            return None
+        status = self.pipeline.status()
+        status.queued += len(self._pending)
+        return status
+
+    def checksum_status(self) -> Optional[ChecksumStatus]:
+        if self.checksums is None:
+            return None
+        return self.checksums.status()
+
+    def offload_status(self) -> Optional[OffloadStatus]:
+        if self.offload is None:
+            return None
+        return self.offload.status()
+
+    @property
+    def evicted(self) -> Tuple[int, int]:
+        """ The number and the total size of the files deleted by the retention policy.
+        """
+        return (sum(manager.evicted for manager in self.retention),
+                sum(manager.evicted_bytes for manager in self.retention))
+
+    @property
+    def tracks_overflows(self) -> bool:
+        """ True if dropped messages are counted, which needs the "buffer exceeded" warnings of ``rosbag record``.
+        """
+        return backend_of(self.options).name == ROS1
+
+    @property
+    def overflow_count(self) -> int:
+        """ The number of messages the recorders dropped because their buffer was full.
+        """
+        return sum(recorder.output.overflow.count for recorder in self.recorders)
+
+    def overflows_since(self, since: float) -> int:
+        return sum(recorder.output.overflow.count_since(since) for recorder in self.recorders)
+
+    def recommend_buffer(self) -> Optional[BufferRecommendation]:
+        """ Returns a buffer and chunk size that would have avoided the drops, or None if nothing was dropped.
+        """
+        # -b and --chunksize mean something else to ros2 bag record, which does not report its drops
+        if not self.tracks_overflows:
+            return None
+        elapsed = max(time.time() - self.started, 1.0)
+        with self._sample_lock:
+            rates = [recorder.monitor.sample().total_bytes / elapsed for recorder in self.recorders]
+        return recommend_buffer(self.options, [
+            (recorder.output.overflow, rate) for recorder, rate in zip(self.recorders, rates)])
+
+    @property
+    def falling_behind(self) -> bool:
+        """ True while finished splits are held back because the pipeline's backlog is full.
+        """
+        return bool(self._pending)
+
+    @property
+    def finishing(self) -> bool:
+        """ True while the splits left at the stop are still being post-processed or checksummed.
+        """
+        return self._finisher is not None and self._finisher.is_alive()
+
+    def finish_splits(self) -> None:
+        """ Waits for the recorders to exit, hands the splits they closed last over to the pipeline,
+        or to the checksum or the offload if there is no pipeline, and waits for the pipeline and the checksums.
+
+        Nothing samples the bag files once the recorders have exited, so this is the only hand-over
+        of the last split, which is the only one without splitting. The offload goes on copying in the background.
+        This blocks, so the GUI and the control API run it in a thread of its own.
+        """
+        if self.pipeline is None and self._after_pipeline is None:
+            return
+        for recorder in self.recorders:
+            recorder.process.wait()
+        with self._sample_lock:
+            for recorder in self.recorders:
+                recorder.monitor.sample()
+        if self.pipeline is not None:
+            self._feed_pipeline()
+            while self._pending:
+                time.sleep(0.5)
+                self._feed_pipeline()
+            self.pipeline.shutdown()
+            status = self.pipeline.status()
+            print(f"[SmartBagRec] Post-processing finished: {status.done} done, {status.failed} failed.")
+        else:
+            self._feed_finished()
+        if self.checksums is not None:
+            self.checksums.shutdown(wait=True)
+
+    def finish_splits_in_background(self) -> None:
+        """ Runs finish_splits in a thread of its own, once.
+
+        The thread is not a daemon, so the process finishes the pipeline and the checksums before it exits.
+        """
+        with self._shutdown_lock:
+            if (self.pipeline is None and self._after_pipeline is None) or self._finisher is not None:
+                return
+            self._finisher = threading.Thread(target=self.finish_splits)
+            self._finisher.start()
+
+    def _feed_pipeline(self) -> None:
+        assert self.pipeline is not None
+        with self._feed_lock:
+            for recorder in self.recorders:
+                for path in recorder.monitor.finished_files():
+                    if path not in self._handed_over:
+                        self._handed_over.add(path)
+                        self._pending.append(path)
+            while self._pending:
+                path = self._pending[0]
+                if os.path.exists(path) and not self.pipeline.submit(path):
+                    break
+                self._pending.popleft()
+
+    def _on_processed(self, path: str) -> None:
+        # the pipeline rewrote the split, so the retention managers must count its new size
+        with self._feed_lock:
+            for manager in self.retention:
+                manager.refresh(path)
+        if self._after_pipeline is not None:
+            self._after_pipeline(path)
+
+    def _feed_finished(self) -> None:
+        assert self._after_pipeline is not None
+        with self._feed_lock:
+            for recorder in self.recorders:
+                for path in recorder.monitor.finished_files():
+                    if path not in self._handed_over:
+                        self._handed_over.add(path)
+                        self._after_pipeline(path)
+
+    def _in_use(self, path: str) -> bool:
+        # called by the retention managers with _feed_lock held
+        if self.checksums is not None and self.checksums.in_use(path):
+            return True
+        if self.offload is not None and self.offload.in_use(path):
+            return True
+        if self.pipeline is None:
+            return False
+        return path in self._pending or self.pipeline.in_use(path)
+
+    def _recording(self) -> bool:
+        # the return codes are kept up to date by poll(), so this never waits
+        return any(recorder.process.returncode is None for recorder in self.recorders)
+
+    def error_lines(self, n: int) -> List[str]:
+        """ Returns the last stderr lines of the recorders that failed.
+        """
+        lines = []
+        for i, recorder in enumerate(self.recorders):
+            if not recorder.poll():
+                continue
+            recorder.output.join(1.0)
+            tail = recorder.output.buffer.tail(n, "stderr")
+            if len(self.recorders) > 1:
+                tail = [f"[shard {i}] {line}" for line in tail]
+            lines.extend(tail)
+        return lines
@@ -0,0 +1,245 @@
+""" Snapshot mode: keep only the last seconds or megabytes of the topics, and dump them on demand.
+
+The ring buffer is kept by ``rosbag_snapshot``, which buffers every topic in memory up to
+a duration and a size and writes the buffers to a bag file when its ``trigger_snapshot``
+service is called, without pausing the capture. The memory limit of the profile is split
+evenly across the topics, since rosbag_snapshot limits each topic on its own.
+
+A dump goes through a persistent rospy service connection when rospy is importable,
+so repeated dumps cost a service round trip, and otherwise through ``rosbag_snapshot -t``.
+Dumps are handed to a single background thread, so pressing dump never blocks,
+and the dumps are written in the order they were requested.
+"""
+
+from __future__ import annotations
+
+import os
+import signal
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Tuple
+
+from .backend import ROS1, backend_of
+from .output import TIMESTAMP_FORMAT, parse_output_spec
+from .recorder_log import RecorderOutput
+
+SNAPSHOT_COMMAND = ["rosrun", "rosbag_snapshot", "snapshot"]
+TRIGGER_SERVICE = "/trigger_snapshot"
+# what rosbag_snapshot takes as "no limit"
+NO_LIMIT = "-1"
+STOP_TIMEOUT_SEC = 5.0
+
+
+class SnapshotSettings:
+    """ How much of the topics snapshot mode keeps.
+
+    Attributes:
+        duration (Optional[float]): Seconds kept of every topic, or None for no limit
+        size_mb (Optional[float]): MB kept of all topics together, or None for no limit
+    """
+
+    duration: Optional[float]
+    size_mb: Optional[float]
+
+    def __init__(self, duration: Optional[float] = None, size_mb: Optional[float] = None) -> None:
+        self.duration = duration
+        self.size_mb = size_mb
+
+    @property
+    def enabled(self) -> bool:
+        return self.duration is not None or self.size_mb is not None
+
+    def command(self, topics: List[str]) -> List[str]:
+        """ The rosbag_snapshot command line buffering the topics within the limits.
+        """
+        duration = f"{self.duration:g}" if self.duration is not None else NO_LIMIT
+        size = f"{self.size_mb / max(1, len(topics)):g}" if self.size_mb is not None else NO_LIMIT
+        return SNAPSHOT_COMMAND + ["-d", duration, "-s", size] + topics
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"duration": self.duration, "size_mb": self.size_mb}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> SnapshotSettings:
+        duration = data.get("duration")
+        size_mb = data.get("size_mb")
+        return cls(float(duration) if duration is not None else None, float(size_mb) if size_mb is not None else None)
+
+
+class SnapshotDump:
+    """ The outcome of one dump.
+
+    Attributes:
+        path (str): The bag file written
+        requested (float): The time.time() value at which the dump was requested
+        latency (float): Seconds from the request until the bag file was written
+        ok (bool): Whether the bag file was written
+        message (str): Why it was not
+    """
+
+    path: str
+    requested: float
+    latency: float
+    ok: bool
+    message: str
+
+    def __init__(self, path: str, requested: float, latency: float, ok: bool, message: str = "") -> None:
+        self.path = path
+        self.requested = requested
+        self.latency = latency
+        self.ok = ok
+        self.message = message
+
+
+class SnapshotSession:
+    """ A running rosbag_snapshot process buffering the topics of a profile.
+
+    Attributes:
+        settings (SnapshotSettings): The limits of the buffers
+        topics (List[str]): The buffered topics
+        directory (str): The directory the dumps are written to
+        started (float): The time.time() value at which the session was started
+        process (subprocess.Popen): The rosbag_snapshot process
+        output (RecorderOutput): Its console output
+    """
+
+    settings: SnapshotSettings
+    topics: List[str]
+    directory: str
+    started: float
+    process: subprocess.Popen
+    output: RecorderOutput
+    _name_prefix: str
+    _dumps: List[SnapshotDump]
+    _pending: int
+    _count: int
+    _lock: threading.Lock
+    _executor: ThreadPoolExecutor
+    _proxy: Any
+    _service_available: bool
+
+    def __init__(self, settings: SnapshotSettings, command: List[str], topics: List[str]) -> None:
+        """
+        Args:
+            settings (SnapshotSettings): The limits of the buffers
+            command (List[str]): A rosbag record command line, whose -o/-O names the dumps
+            topics (List[str]): The topics to buffer
+
+        Raises:
+            ValueError: If the command line is not one of ``rosbag record``, as rosbag_snapshot is a ROS 1 tool
+        """
+        if backend_of(command).name != ROS1:
+            raise ValueError("Snapshot mode needs the ros1 backend, as rosbag_snapshot is a ROS 1 tool")
+        self.settings = settings
+        self.topics = topics
+        self.started = time.time()
+        spec = parse_output_spec(command, self.started)
+        self.directory = spec.directory
+        base = spec.stem or spec.prefix
+        self._name_prefix = base + "_snapshot" if base else "snapshot"
+        self._dumps = []
+        self._pending = 0
+        self._count = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="smartbagrec-snapshot")
+        self._proxy = None
+        self._service_available = True
+
+        snapshot_command = settings.command(topics)
+        print("[SmartBagRec] Snapshot command is: " + " ".join(snapshot_command))
+        self.process = subprocess.Popen(snapshot_command, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                         start_new_session=True)
+        self.output = RecorderOutput(self.process, os.path.join(self.directory, spec.base_name + "_snapshot.log"))
+
+    def poll(self) -> Optional[int]:
+        return self.process.poll()
+
+    def dump(self) -> str:
+        """ Requests a dump of the buffers, returning the path it will be written to without waiting.
+        """
+        requested = time.time()
+        with self._lock:
+            self._count += 1
+            self._pending += 1
+            timestamp = time.strftime(TIMESTAMP_FORMAT, time.localtime(requested))
+            path = os.path.join(self.directory, f"{self._name_prefix}_{timestamp}_{self._count}.bag")
+        self._executor.submit(self._write, path, requested)
+        return path
+
+    @property
+    def dumps(self) -> List[SnapshotDump]:
+        with self._lock:
+            return list(self._dumps)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def memory_bytes(self) -> Optional[int]:
+        """ The resident memory of rosbag_snapshot, from /proc, or None where that is not available.
+        """
+        try:
+            with open(f"/proc/{self.process.pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    def shutdown(self, timeout: float = STOP_TIMEOUT_SEC) -> None:
+        """ Writes the requested dumps and stops rosbag_snapshot; the buffers are not written.
+        """
+        self._executor.shutdown(wait=True)
+        if self.process.poll() is None:
+            try:
+                os.killpg(self.process.pid, signal.SIGINT)
+                self.process.wait(timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(self.process.pid, signal.SIGKILL)
+                self.process.wait()
+            except ProcessLookupError:
+                pass
+
+    def _write(self, path: str, requested: float) -> None:
+        ok, message = self._trigger(path)
+        result = SnapshotDump(path, requested, time.time() - requested, ok, message)
+        with self._lock:
+            self._pending -= 1
+            self._dumps.append(result)
+        if ok:
+            print(f"[SmartBagRec] Snapshot written in {result.latency * 1000:.0f} ms: {path}")
+        else:
+            print(f"[SmartBagRec] Snapshot {path} failed: {message}")
+
+    def _trigger(self, path: str) -> Tuple[bool, str]:
+        proxy = self._service_proxy()
+        if proxy is not None:
+            try:
+                import rospy
+                response = proxy(topics=[], filename=path, start_time=rospy.Time(0), stop_time=rospy.Time(0))
+                return bool(response.success), str(response.message)
+            except Exception as e:  # rospy.ServiceException and connection errors
+                print(f"[SmartBagRec] Snapshot service call failed, falling back to rosbag_snapshot -t: {e}")
+                self._proxy = None
+        result = subprocess.run(SNAPSHOT_COMMAND + ["-t", "-O", path],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        if result.returncode != 0:
+            lines = result.stderr.strip().splitlines()
+            return False, lines[-1] if lines else f"exited with {result.returncode}"
+        return True, ""
+
+    def _service_proxy(self) -> Any:
+        # only ever called from the dump thread
+        if self._proxy is None and self._service_available:
+            try:
+                import rospy
+                from rosbag_snapshot_msgs.srv import TriggerSnapshot
+            except ImportError:
+                self._service_available = False
+                return None
+            self._proxy = rospy.ServiceProxy(TRIGGER_SERVICE, TriggerSnapshot, persistent=True)
+        return self._proxy
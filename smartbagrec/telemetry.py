@@ -0,0 +1,342 @@
+""" Structured telemetry of recording sessions, as JSON Lines and as a Prometheus textfile.
+
+A session with telemetry appends one JSON object per event to a JSONL file:
+
+- ``session_start``, and ``spawn`` with the time each recorder process took to start
+- ``first_bytes``: the time from spawning a recorder until its first bytes were on disk
+- ``sample``: the bytes, the rate, the splits and the free space, every interval
+- ``split`` for every finished split, and ``overflow`` when a recorder drops messages
+- ``stop``: how long the recorders took to exit, and to have their bag files checked
+- ``session_end`` with the totals
+
+With a textfile path, the latest values are also written as Prometheus metrics for the
+textfile collector of the node exporter, replaced atomically after every sample, so that
+dashboards can alert on recorders falling behind or dropping messages.
+
+Collection reuses the samples the GUI, the status lines or the control API take anyway,
+and samples by itself only when nobody else has for an interval. Until the first bytes
+of every recorder are seen, their output directories are listed every 50 ms, which only
+costs a directory read.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import threading
+import time
+from typing import IO, TYPE_CHECKING, Any, Dict, List, Optional, Sequence, Set, Tuple
+
+from .monitor import MTIME_SLACK_SEC, ThroughputSample
+from .output import OutputSpec
+
+if TYPE_CHECKING:
+    from .session import RecordingSession, ShutdownReport
+
+TELEMETRY_INTERVAL_SEC = 1.0
+MIN_TELEMETRY_INTERVAL_SEC = 0.1
+FIRST_BYTES_POLL_SEC = 0.05
+# a sample taken by someone else this close to the interval counts as the sample of the interval
+INTERVAL_SLACK = 0.9
+# name, type and help of every metric of the textfile, in the order they are written
+METRICS = (
+    ("smartbagrec_recording", "gauge", "1 while the recorders of the session are running, 0 once stopped."),
+    ("smartbagrec_written_bytes_total", "counter", "Bytes written by the recorders of the session."),
+    ("smartbagrec_write_rate_bytes", "gauge", "Write rate of the recorders in bytes per second."),
+    ("smartbagrec_splits_total", "counter", "Finished bag files of the session."),
+    ("smartbagrec_active_files", "gauge", "Bag files still being written."),
+    ("smartbagrec_free_bytes", "gauge", "Free space on the output filesystem."),
+    ("smartbagrec_dropped_messages_total", "counter", "Messages dropped because a recorder buffer was full."),
+    ("smartbagrec_falling_behind", "gauge", "1 while the post-processing of splits falls behind, 0 otherwise."),
+    ("smartbagrec_spawn_latency_seconds", "gauge", "Time the recorder process took to start."),
+    ("smartbagrec_first_bytes_latency_seconds", "gauge", "Time from spawning a recorder to its first bytes on disk."),
+    ("smartbagrec_stop_latency_seconds", "gauge", "Time from the stop request until every recorder had exited."),
+    ("smartbagrec_finalize_latency_seconds", "gauge", "Time from the stop request until the bag files were checked."),
+    ("smartbagrec_unfinalized_files", "gauge", "Bag files left unfinished by the stop."),
+    ("smartbagrec_last_sample_timestamp_seconds", "gauge", "Unix time of the last sample."),
+)
+
+# the metrics of every session writing to each textfile, by path and then by session
+_textfiles: Dict[str, Dict[str, List[Tuple[str, Dict[str, str], float]]]] = {}
+_textfiles_lock = threading.Lock()
+
+
+class TelemetrySettings:
+    """ Where the telemetry of a recording is written.
+
+    Attributes:
+        jsonl_path (Optional[str]): The JSONL file the events are appended to, if any
+        textfile_path (Optional[str]): The Prometheus textfile, ending in .prom, the metrics are written to, if any
+        interval (float): Seconds between samples, at least MIN_TELEMETRY_INTERVAL_SEC
+    """
+
+    jsonl_path: Optional[str]
+    textfile_path: Optional[str]
+    interval: float
+
+    def __init__(self, jsonl_path: Optional[str] = None, textfile_path: Optional[str] = None,
+                 interval: float = TELEMETRY_INTERVAL_SEC) -> None:
+        if not interval >= MIN_TELEMETRY_INTERVAL_SEC:
+            raise ValueError(f"The telemetry interval must be at least {MIN_TELEMETRY_INTERVAL_SEC} s, not {interval}")
+        self.jsonl_path = jsonl_path
+        self.textfile_path = textfile_path
+        self.interval = interval
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.jsonl_path or self.textfile_path)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"jsonl_path": self.jsonl_path, "textfile_path": self.textfile_path, "interval": self.interval}
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> TelemetrySettings:
+        jsonl_path = data.get("jsonl_path")
+        textfile_path = data.get("textfile_path")
+        return cls(str(jsonl_path) if jsonl_path else None, str(textfile_path) if textfile_path else None,
+                   float(data.get("interval", TELEMETRY_INTERVAL_SEC)))
+
+
+class SessionTelemetry:
+    """ The telemetry of one recording session, collected by a thread of its own.
+
+    Attributes:
+        settings (TelemetrySettings): Where to write it
+    """
+
+    settings: TelemetrySettings
+    _session: RecordingSession
+    _jsonl: Optional[IO[str]]
+    _write_lock: threading.Lock
+    _closed: threading.Event
+    _thread: Optional[threading.Thread]
+    _waiting_for_bytes: Set[int]
+    _bytes_lock: threading.Lock
+    _split_counts: List[int]
+    _dropped: int
+    _last_sample: float
+    _last_sample_event: float
+    _force_sample: bool
+    _metrics: Dict[str, List[Tuple[Dict[str, str], float]]]
+
+    def __init__(self, settings: TelemetrySettings, session: RecordingSession) -> None:
+        """
+        Raises:
+            OSError: If the JSONL file cannot be opened
+        """
+        self.settings = settings
+        self._session = session
+        self._jsonl = None
+        if settings.jsonl_path:
+            os.makedirs(os.path.dirname(os.path.abspath(settings.jsonl_path)), exist_ok=True)
+            self._jsonl = open(settings.jsonl_path, "a")
+        self._write_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        self._waiting_for_bytes = set()
+        self._bytes_lock = threading.Lock()
+        self._split_counts = []
+        self._dropped = 0
+        self._last_sample = 0.0
+        self._last_sample_event = 0.0
+        self._force_sample = False
+        self._metrics = {name: [] for name, _, _ in METRICS}
+
+    def start(self) -> None:
+        """ Writes the start and spawn events of the recorders, which have just been spawned,
+        and starts collecting.
+        """
+        recorders = self._session.recorders
+        self._emit("session_start", backend=recorders[0].backend.name if recorders else None,
+                   recorders=len(recorders), options=self._session.options)
+        for i, recorder in enumerate(recorders):
+            self._emit("spawn", recorder=i, pid=recorder.process.pid, latency=recorder.spawn_latency,
+                       command=recorder.command)
+            self._set_metric("smartbagrec_spawn_latency_seconds", recorder.spawn_latency, recorder=str(i))
+        self._waiting_for_bytes = set(range(len(recorders)))
+        self._split_counts = [0] * len(recorders)
+        self._set_metric("smartbagrec_recording", 1.0)
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def on_sample(self, samples: Sequence[ThroughputSample], total: ThroughputSample) -> None:
+        """ Records a sample of the session; called by RecordingSession.sample() with its sample lock held.
+        """
+        if self._closed.is_set():
+            return
+        now = time.monotonic()
+        self._last_sample = now
+        for i, (recorder, sample) in enumerate(zip(self._session.recorders, samples)):
+            if i in self._waiting_for_bytes and sample.total_bytes > 0:
+                self._first_bytes(i, now)
+            finished = recorder.monitor.finished_files()
+            for path in finished[self._split_counts[i]:]:
+                self._emit("split", recorder=i, path=path, bytes=_file_size(path))
+            self._split_counts[i] = len(finished)
+        dropped = self._session.overflow_count
+        if dropped > self._dropped:
+            self._emit("overflow", dropped=dropped - self._dropped, total=dropped)
+            self._dropped = dropped
+        if not self._force_sample and now - self._last_sample_event < self.settings.interval * INTERVAL_SLACK:
+            return
+        self._force_sample = False
+        self._last_sample_event = now
+        falling_behind = self._session.falling_behind
+        self._emit("sample", bytes=total.total_bytes, rate=total.rate, splits=total.split_count,
+                   active=total.active_count, free_bytes=total.free_bytes,
+                   seconds_until_full=total.seconds_until_full, dropped=dropped,
+                   falling_behind=falling_behind, rates=[sample.rate for sample in samples])
+        for name, value in (("smartbagrec_written_bytes_total", total.total_bytes),
+                            ("smartbagrec_write_rate_bytes", total.rate),
+                            ("smartbagrec_splits_total", total.split_count),
+                            ("smartbagrec_active_files", total.active_count),
+                            ("smartbagrec_free_bytes", total.free_bytes),
+                            ("smartbagrec_dropped_messages_total", dropped),
+                            ("smartbagrec_falling_behind", 1.0 if falling_behind else 0.0),
+                            ("smartbagrec_last_sample_timestamp_seconds", time.time())):
+            self._set_metric(name, float(value))
+        self._write_textfile()
+
+    def on_stop(self, report: ShutdownReport, finalize_latency: float) -> None:
+        """ Writes the last sample, the stop and the end events, and stops collecting.
+        """
+        if self._closed.is_set():
+            return
+        self._force_sample = True
+        self._session.sample()
+        self._closed.set()
+        self._emit("stop", latency=report.latency, finalize_latency=finalize_latency, signals=report.signals,
+                   unfinalized=report.unfinalized)
+        self._emit("session_end", duration=time.time() - self._session.started, dropped=self._dropped,
+                   splits=sum(self._split_counts), finalized=report.finalized)
+        self._set_metric("smartbagrec_recording", 0.0)
+        self._set_metric("smartbagrec_stop_latency_seconds", report.latency)
+        self._set_metric("smartbagrec_finalize_latency_seconds", finalize_latency)
+        self._set_metric("smartbagrec_unfinalized_files", float(len(report.unfinalized)))
+        self._write_textfile()
+        self.close()
+
+    def close(self) -> None:
+        """ Stops collecting and closes the JSONL file; the textfile keeps the last values.
+        """
+        self._closed.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        with self._write_lock:
+            if self._jsonl is not None:
+                self._jsonl.close()
+                self._jsonl = None
+
+    def _run(self) -> None:
+        while True:
+            if self._waiting_for_bytes:
+                self._poll_first_bytes()
+            wait = FIRST_BYTES_POLL_SEC if self._waiting_for_bytes else self.settings.interval
+            if self._closed.wait(wait):
+                return
+            if time.monotonic() - self._last_sample >= self.settings.interval and not self._session.stopping:
+                self._session.sample()
+
+    def _poll_first_bytes(self) -> None:
+        for i in sorted(self._waiting_for_bytes):
+            recorder = self._session.recorders[i]
+            if _has_bytes(recorder.spec):
+                self._first_bytes(i, time.monotonic())
+            elif recorder.poll() is not None:
+                self._waiting_for_bytes.discard(i)
+
+    def _first_bytes(self, i: int, now: float) -> None:
+        # seen by the sampler and by the thread polling the directories, whichever comes first
+        with self._bytes_lock:
+            if i not in self._waiting_for_bytes:
+                return
+            self._waiting_for_bytes.discard(i)
+        latency = now - self._session.recorders[i].spawned
+        self._emit("first_bytes", recorder=i, latency=latency)
+        self._set_metric("smartbagrec_first_bytes_latency_seconds", latency, recorder=str(i))
+
+    def _emit(self, event: str, **fields: Any) -> None:
+        record = {"time": time.time(), "session": self._session.name, "event": event}
+        record.update(fields)
+        line = json.dumps(record) + "\n"
+        with self._write_lock:
+            if self._jsonl is not None:
+                self._jsonl.write(line)
+                self._jsonl.flush()
+
+    def _set_metric(self, name: str, value: float, **labels: str) -> None:
+        samples = [(sample_labels, sample_value) for sample_labels, sample_value in self._metrics[name]
+                   if sample_labels != labels]
+        samples.append((labels, value))
+        self._metrics[name] = samples
+
+    def _write_textfile(self) -> None:
+        path = self.settings.textfile_path
+        if not path:
+            return
+        metrics = [(name, labels, value) for name, samples in self._metrics.items() for labels, value in samples]
+        try:
+            _write_textfile(path, self._session.name, metrics)
+        except OSError as e:
+            print(f"[SmartBagRec] Cannot write the telemetry textfile {path}: {e}")
+
+
+def _has_bytes(spec: OutputSpec) -> bool:
+    """ Whether a bag file of the recording has bytes on disk, without sampling it.
+    """
+    try:
+        entries = list(os.scandir(spec.directory))
+    except OSError:
+        return False
+    for entry in entries:
+        if not spec.matches(entry.name):
+            continue
+        try:
+            st = entry.stat()
+        except OSError:
+            continue
+        if st.st_size > 0 and (spec.stem is not None or st.st_mtime >= spec.started - MTIME_SLACK_SEC):
+            return True
+    return False
+
+
+def _file_size(path: str) -> Optional[int]:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def _write_textfile(path: str, session: str, metrics: List[Tuple[str, Dict[str, str], float]]) -> None:
+    """ Replaces the metrics of a session in a textfile shared with the other sessions of the process.
+    """
+    with _textfiles_lock:
+        sessions = _textfiles.setdefault(path, {})
+        sessions[session] = metrics
+        lines = []
+        for name, kind, description in METRICS:
+            samples = [(session_name, labels, value) for session_name, session_metrics in sorted(sessions.items())
+                       for metric, labels, value in session_metrics if metric == name]
+            if not samples:
+                continue
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {kind}")
+            for session_name, labels, value in samples:
+                label_text = ",".join(f'{key}="{_escape(value)}"'
+                                      for key, value in [("session", session_name)] + sorted(labels.items()))
+                lines.append(f"{name}{{{label_text}}} {_format_value(value)}")
+        # the textfile collector ignores files not ending in .prom, so the partial file is never read
+        tmp_path = path + ".tmp"
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+
+def _format_value(value: float) -> str:
+    # byte counts are written in full rather than rounded to six digits
+    return str(int(value)) if value.is_integer() else repr(value)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
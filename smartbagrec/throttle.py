@@ -0,0 +1,140 @@
+""" Per-topic rate limits applied at record time by throttling relays.
+
+``topic_tools throttle messages IN RATE OUT`` republishes at most RATE messages per second of a topic.
+A throttled topic is recorded as the output of its relay, ``<topic>_throttle``, in place of the original.
+The relays of a session are started before its recorders and stopped after them,
+so a recorder never waits for a relay that has not been started, or loses the last messages.
+"""
+
+from __future__ import annotations
+
+import os
+import re
+import signal
+import subprocess
+import time
+from typing import IO, TYPE_CHECKING, Dict, List, Mapping, Sequence
+
+from .backend import ROS2, RecorderBackend
+
+if TYPE_CHECKING:
+    # probe pulls in concurrent.futures, which the headless path does not need
+    from .probe import TopicStats
+
+THROTTLED_SUFFIX = "_throttle"
+RELAY_STOP_TIMEOUT_SEC = 2.0
+
+
+def throttled_topic(topic: str) -> str:
+    """ The topic the relay of a throttled topic publishes, which is recorded instead of it.
+    """
+    return topic + THROTTLED_SUFFIX
+
+
+def recorded_topics(topics: Sequence[str], throttles: Mapping[str, float]) -> List[str]:
+    """ The topics to record, with the throttled ones replaced by the outputs of their relays.
+    """
+    return [throttled_topic(topic) if topic in throttles else topic for topic in topics]
+
+
+def relay_command(topic: str, rate: float, backend: RecorderBackend) -> List[str]:
+    """ The command line of the relay republishing at most ``rate`` messages per second of the topic.
+    """
+    arguments = ["topic_tools", "throttle", "messages", topic, f"{rate:g}", throttled_topic(topic)]
+    if backend.name == ROS2:
+        # rclcpp nodes are not anonymous, so each relay gets a name of its own
+        node_name = "smartbagrec_throttle" + re.sub(r"\W", "_", topic)
+        return ["ros2", "run"] + arguments + ["--ros-args", "-r", "__node:=" + node_name]
+    return ["rosrun"] + arguments
+
+
+def validate_throttles(throttles: Mapping[str, float]) -> None:
+    """
+    Raises:
+        ValueError: If a rate limit is not a positive number of messages per second
+    """
+    for topic, rate in throttles.items():
+        if not rate > 0:
+            raise ValueError(f"The rate limit of {topic} must be positive, not {rate}")
+
+
+def throttle_stats(stats: Dict[str, TopicStats], throttles: Mapping[str, float]) -> Dict[str, TopicStats]:
+    """ The measured load of the topics as it is once throttled,
+    assuming the messages dropped by a relay are as large as the ones it passes on.
+    """
+    from .probe import TopicStats
+
+    throttled = dict(stats)
+    for topic, limit in throttles.items():
+        topic_stats = stats.get(topic)
+        if topic_stats is not None and topic_stats.rate > limit:
+            throttled[topic] = TopicStats(topic, limit, topic_stats.bandwidth * limit / topic_stats.rate)
+    return throttled
+
+
+def estimate_saving(stats: Dict[str, TopicStats], throttles: Mapping[str, float]) -> float:
+    """ The bytes per second the rate limits keep out of the recording, from the measured topics.
+    """
+    throttled = throttle_stats(stats, throttles)
+    return sum(stats[topic].bandwidth - throttled[topic].bandwidth for topic in throttles if topic in stats)
+
+
+class ThrottleRelays:
+    """ The throttling relays of a recording session, one process per throttled topic.
+
+    Attributes:
+        processes (Dict[str, subprocess.Popen]): The relay of each throttled topic
+        log_path (str): The file the output of the relays is appended to
+    """
+
+    processes: Dict[str, subprocess.Popen]
+    log_path: str
+    _log: IO[bytes]
+
+    def __init__(self, throttles: Mapping[str, float], backend: RecorderBackend, log_path: str) -> None:
+        """
+        Raises:
+            OSError: If a relay cannot be started; the ones already started are stopped
+        """
+        self.processes = {}
+        self.log_path = log_path
+        self._log = open(log_path, "ab")
+        try:
+            for topic, rate in sorted(throttles.items()):
+                command = relay_command(topic, rate, backend)
+                print(f"[SmartBagRec] Throttling command is: {' '.join(command)}")
+                self.processes[topic] = subprocess.Popen(command, stdout=self._log, stderr=subprocess.STDOUT,
+                                                         stdin=subprocess.DEVNULL, start_new_session=True)
+        except OSError:
+            self.shutdown()
+            raise
+
+    def exited(self) -> Dict[str, int]:
+        """ The exit codes of the relays that are no longer running, by topic.
+        """
+        codes = {topic: process.poll() for topic, process in self.processes.items()}
+        return {topic: code for topic, code in codes.items() if code is not None}
+
+    def stop(self, signum: int = signal.SIGINT) -> None:
+        """ Signals the process group of every relay still running, without waiting.
+        """
+        for process in self.processes.values():
+            if process.poll() is None:
+                try:
+                    os.killpg(process.pid, signum)
+                except ProcessLookupError:
+                    pass
+
+    def shutdown(self, timeout: float = RELAY_STOP_TIMEOUT_SEC) -> None:
+        """ Stops every relay, killing the ones that do not exit within ``timeout`` seconds.
+        """
+        self.stop()
+        deadline = time.monotonic() + timeout
+        while any(process.poll() is None for process in self.processes.values()):
+            if time.monotonic() >= deadline:
+                self.stop(signal.SIGKILL)
+                break
+            time.sleep(0.01)
+        for process in self.processes.values():
+            process.wait()
+        self._log.close()
@@ -0,0 +1,101 @@
+""" Filtering of large topic lists.
+
+Topics are kept sorted, so every topic under a namespace, or starting with the literal
+prefix of an anchored glob or regex, is a contiguous range found by bisection.
+Only the rest of the pattern is matched, and only against that range.
+While the user types, a substring pattern usually extends the previous one,
+so it is matched against the previous result instead of the whole list.
+"""
+
+from __future__ import annotations
+
+import bisect
+import fnmatch
+import re
+from typing import List, Optional, Sequence, Tuple
+
+FILTER_MODES = ("substring", "glob", "regex")
+_GLOB_SPECIAL = "*?["
+_REGEX_SPECIAL = ".^$*+?{}[]\\|()"
+_REGEX_QUANTIFIERS = "*+?{"
+
+
+class TopicIndex:
+    """ A sorted set of topics answering filter and namespace queries.
+
+    Attributes:
+        topics (List[str]): All topics, sorted
+    """
+
+    topics: List[str]
+    _last: Optional[Tuple[str, str, List[str]]]
+
+    def __init__(self, topics: Sequence[str] = ()) -> None:
+        self.topics = sorted(set(topics))
+        self._last = None
+
+    def __len__(self) -> int:
+        return len(self.topics)
+
+    def namespace(self, namespace: str) -> List[str]:
+        """ Returns the topics under the namespace, e.g. "/robot/camera".
+        """
+        return self._prefix_range(namespace.rstrip("/") + "/")
+
+    def match(self, pattern: str, mode: str = "substring") -> List[str]:
+        """ Returns the topics matching the pattern, sorted.
+
+        Raises:
+            ValueError: If the mode is unknown or the regex is invalid
+        """
+        if mode not in FILTER_MODES:
+            raise ValueError("Unknown filter mode: " + mode)
+        if not pattern:
+            return self.topics
+        if self._last is not None and self._last[:2] == (mode, pattern):
+            return self._last[2]
+
+        if mode == "substring":
+            candidates = self.topics
+            if self._last is not None and self._last[0] == mode and self._last[1] in pattern:
+                candidates = self._last[2]
+            result = [topic for topic in candidates if pattern in topic]
+        elif mode == "glob":
+            prefix = _literal_prefix(pattern, _GLOB_SPECIAL)
+            regex = re.compile(fnmatch.translate(pattern))
+            result = [topic for topic in self._prefix_range(prefix) if regex.match(topic)]
+        else:
+            try:
+                regex = re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid regex: {e}") from e
+            prefix = ""
+            if pattern.startswith("^") and "|" not in pattern:
+                prefix = _literal_prefix(pattern[1:], _REGEX_SPECIAL, _REGEX_QUANTIFIERS)
+            result = [topic for topic in self._prefix_range(prefix) if regex.search(topic)]
+        self._last = (mode, pattern, result)
+        return result
+
+    def _prefix_range(self, prefix: str) -> List[str]:
+        if not prefix:
+            return self.topics
+        start = bisect.bisect_left(self.topics, prefix)
+        # every string starting with the prefix sorts before prefix + the largest code point
+        end = bisect.bisect_left(self.topics, prefix + "\U0010ffff", start)
+        return self.topics[start:end]
+
+
+def namespace_of(topic: str) -> str:
+    """ Returns the namespace a topic is in, e.g. "/robot/camera" for "/robot/camera/image".
+    """
+    return topic.rstrip("/").rpartition("/")[0] or "/"
+
+
+def _literal_prefix(pattern: str, special: str, quantifiers: str = "") -> str:
+    for i, char in enumerate(pattern):
+        if char in quantifiers:
+            # a quantifier makes the character before it optional too
+            return pattern[:max(0, i - 1)]
+        if char in special:
+            return pattern[:i]
+    return pattern
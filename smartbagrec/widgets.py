@@ -8,7 +8,7 @@ from __future__ import annotations
 
 import tkinter as tk
 import tkinter.ttk as ttk
-from typing import Any, Callable, Optional, Tuple, Union
+from typing import Any, Callable, Dict, List, Optional, Sequence, Set, Tuple, Union
 
 Pos = Tuple[int, ...]
 TkWidgets = Union[tk.Tk, tk.Toplevel, tk.Widget]
@@ -131,12 +131,20 @@ class Checkbutton(Widget):
     def get_state(self) -> bool:
         return self._button_state.get()
 
+    def set_state(self, state: bool) -> None:
+        self._button_state.set(state)
+
+    def on_change(self, callback: Callable[[], None]) -> None:
+        """ Calls the callback whenever the state changes, by clicking or by ``set_state()``.
+        """
+        self._button_state.trace_add("write", lambda *args: callback())
+
 
 class Radiobutton(Widget):
     """ This class wraps the tkinter.ttk.Radiobutton class.
     """
 
-    def __init__(self, parent: Widget, text: str, variable: tk.IntVar, value: Any, command: Callable, pos: Pos = (0, 0), grid_opt: dict = {}) -> None:
+    def __init__(self, parent: Widget, text: str, variable: tk.Variable, value: Any, command: Callable, pos: Pos = (0, 0), grid_opt: dict = {}) -> None:
         super().__init__(parent)
         self._tk_widget = ttk.Radiobutton(
             parent.tk_widget, text=text, variable=variable, value=value, command=command)
@@ -158,18 +166,240 @@ class Entry(Widget):
     def get_state(self) -> str:
         return self._entry_state.get()
 
+    def set_state(self, state: str) -> None:
+        self._entry_state.set(state)
+
+    def on_change(self, callback: Callable[[], None]) -> None:
+        """ Calls the callback whenever the text changes, by typing, pasting or otherwise.
+        """
+        self._entry_state.trace_add("write", lambda *args: callback())
+
+
+class ScrollableTreeview(Widget):
+    """ This class wraps the tkinter.ttk.Treeview class and tk.Scrollbar class as a multi-column list.
+
+    Rows are identified by their text in the first column.
+    In "multiple" mode a click toggles the row like tk.Listbox does.
+    """
+
+    _tk_scrollbar: ttk.Scrollbar
+
+    def __init__(self, parent: Widget, columns: Tuple[Tuple[str, str, int], ...], mode: str,
+                 pos: Pos = (0, 0, 0, 0), grid_opt: dict = {}) -> None:
+        """
+        Args:
+            columns (Tuple[Tuple[str, str, int], ...]): (id, heading, width) of the columns after the first one
+            mode (str): "multiple" to toggle rows on click, otherwise a ttk.Treeview selectmode
+        """
+        super().__init__(parent)
+
+        self._tk_widget: ttk.Treeview = ttk.Treeview(
+            parent.tk_widget, columns=[column[0] for column in columns],
+            selectmode="extended" if mode == "multiple" else mode)
+        self._tk_widget.column("#0", stretch=True)
+        for column_id, heading, width in columns:
+            self._tk_widget.heading(column_id, text=heading)
+            self._tk_widget.column(column_id, width=width, stretch=False, anchor=tk.E)
+        self._tk_widget.grid(row=pos[0], column=pos[1], **grid_opt)  # type: ignore
+        if mode == "multiple":
+            self._tk_widget.bind("<Button-1>", self._on_click)
+
+        self._tk_scrollbar = ttk.Scrollbar(parent.tk_widget, orient=tk.VERTICAL, command=self._tk_widget.yview)
+        self._tk_widget["yscrollcommand"] = self._tk_scrollbar.set
+        self._tk_scrollbar.grid(row=pos[2], column=pos[3], **grid_opt)  # type: ignore
+
+    @property
+    def tk_scrollbar(self) -> ttk.Scrollbar:
+        return self._tk_scrollbar
+
+    def get_selected(self) -> Tuple[str, ...]:
+        return tuple(self._tk_widget.selection())
+
+    def set_rows(self, rows: List[str], selected: Tuple[str, ...] = ()) -> None:
+        """ Replaces all rows and selects the given ones again if they are still listed.
+        """
+        self._tk_widget.delete(*self._tk_widget.get_children())
+        for row in rows:
+            self._tk_widget.insert("", tk.END, iid=row, text=row)
+        self._tk_widget.selection_set([row for row in selected if self._tk_widget.exists(row)])
+
+    def set_values(self, row: str, values: Tuple[str, ...]) -> None:
+        if self._tk_widget.exists(row):
+            self._tk_widget.item(row, values=values)
+
+    def _on_click(self, event: tk.Event) -> Optional[str]:
+        if self._tk_widget.identify_region(event.x, event.y) not in ("tree", "cell"):
+            return None
+        row = self._tk_widget.identify_row(event.y)
+        if row:
+            self._tk_widget.selection_toggle(row)
+        return "break"
+
+
+class VirtualTreeview(Widget):
+    """ This class wraps the tkinter.ttk.Treeview class and tk.Scrollbar class as a virtual multi-column list.
+
+    Only the rows that fit in the view exist as Treeview items; scrolling rewrites them,
+    so the cost of showing a list does not depend on its length.
+    A click toggles a row like tk.Listbox does in "multiple" mode,
+    and the selection is kept for rows that are not shown, e.g. while a filter hides them.
+    The "<<SelectionChanged>>" event is generated when the user changes the selection.
+    """
+
+    _tk_scrollbar: ttk.Scrollbar
+    _rows: List[str]
+    _values: Dict[str, Tuple[str, ...]]
+    _selected: Set[str]
+    _offset: int
+    _visible_count: int
+    _last_clicked: Optional[str]
+
+    def __init__(self, parent: Widget, columns: Tuple[Tuple[str, str, int], ...], height: int = 20,
+                 pos: Pos = (0, 0, 0, 0), grid_opt: dict = {}) -> None:
+        """
+        Args:
+            columns (Tuple[Tuple[str, str, int], ...]): (id, heading, width) of the columns after the first one
+            height (int): The number of rows shown until the widget is resized
+        """
+        super().__init__(parent)
+        self._rows = []
+        self._values = {}
+        self._selected = set()
+        self._offset = 0
+        self._visible_count = height
+        self._last_clicked = None
+
+        self._tk_widget: ttk.Treeview = ttk.Treeview(
+            parent.tk_widget, columns=[column[0] for column in columns], height=height, selectmode="none")
+        self._tk_widget.column("#0", stretch=True)
+        for column_id, heading, width in columns:
+            self._tk_widget.heading(column_id, text=heading)
+            self._tk_widget.column(column_id, width=width, stretch=False, anchor=tk.E)
+        style = ttk.Style()
+        self._tk_widget.tag_configure(
+            "selected",
+            background=style.lookup("Treeview", "background", ("selected",)) or "#4a6984",
+            foreground=style.lookup("Treeview", "foreground", ("selected",)) or "#ffffff")
+        self._tk_widget.grid(row=pos[0], column=pos[1], **grid_opt)  # type: ignore
+        self._tk_widget.bind("<Button-1>", self._on_click)
+        self._tk_widget.bind("<MouseWheel>", lambda event: self._scroll_to(self._offset - event.delta // 120 * 3))
+        self._tk_widget.bind("<Button-4>", lambda event: self._scroll_to(self._offset - 3))
+        self._tk_widget.bind("<Button-5>", lambda event: self._scroll_to(self._offset + 3))
+        self._tk_widget.bind("<Configure>", self._on_configure)
 
-class ScrollableListbox(Widget):
-    """ This class wraps the tk.Listbox class and tk.Scrollbar class.
+        self._tk_scrollbar = ttk.Scrollbar(parent.tk_widget, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self._tk_scrollbar.grid(row=pos[2], column=pos[3], **grid_opt)  # type: ignore
+
+    @property
+    def tk_scrollbar(self) -> ttk.Scrollbar:
+        return self._tk_scrollbar
+
+    @property
+    def rows(self) -> List[str]:
+        """ The rows currently listed, including those scrolled out of view.
+        """
+        return self._rows
+
+    @property
+    def last_clicked(self) -> Optional[str]:
+        return self._last_clicked
+
+    def get_selected(self) -> Tuple[str, ...]:
+        return tuple(sorted(self._selected))
+
+    def set_rows(self, rows: List[str]) -> None:
+        """ Replaces the listed rows. The selection is kept, also for rows no longer listed.
+        """
+        self._rows = rows
+        self._scroll_to(self._offset if rows else 0)
+
+    def set_selected(self, rows: Sequence[str]) -> None:
+        self._selected = set(rows)
+        self._render()
+
+    def select(self, rows: Sequence[str]) -> None:
+        self._selected.update(rows)
+        self._render()
+
+    def set_values(self, row: str, values: Tuple[str, ...]) -> None:
+        self._values[row] = values
+        if row in self._rows[self._offset:self._offset + self._visible_count]:
+            self._render()
+
+    def _scroll_to(self, offset: int) -> None:
+        self._offset = max(0, min(offset, len(self._rows) - self._visible_count))
+        self._render()
+
+    def _render(self) -> None:
+        visible = self._rows[self._offset:self._offset + self._visible_count]
+        items = self._tk_widget.get_children()
+        if len(items) > len(visible):
+            self._tk_widget.delete(*items[len(visible):])
+        for i, row in enumerate(visible):
+            iid = str(i)
+            options = {"text": row, "values": self._values.get(row, ()),
+                       "tags": ("selected",) if row in self._selected else ()}
+            if i < len(items):
+                self._tk_widget.item(iid, **options)
+            else:
+                self._tk_widget.insert("", tk.END, iid=iid, **options)
+        if self._rows:
+            self._tk_scrollbar.set(self._offset / len(self._rows),
+                                   (self._offset + len(visible)) / len(self._rows))
+        else:
+            self._tk_scrollbar.set(0.0, 1.0)
+
+    def _on_scrollbar(self, *args: str) -> None:
+        if args[0] == "moveto":
+            self._scroll_to(round(float(args[1]) * len(self._rows)))
+        elif args[0] == "scroll":
+            step = self._visible_count if args[2] == "pages" else 1
+            self._scroll_to(self._offset + int(args[1]) * step)
+
+    def _on_configure(self, event: tk.Event) -> None:
+        children = self._tk_widget.get_children()
+        bbox = self._tk_widget.bbox(children[0]) if children else None
+        if not bbox:
+            return
+        # rows start below the heading, whose height is the y of the first row
+        visible_count = max(1, (event.height - bbox[1]) // bbox[3])
+        if visible_count != self._visible_count:
+            self._visible_count = visible_count
+            self._scroll_to(self._offset)
+
+    def _on_click(self, event: tk.Event) -> Optional[str]:
+        if self._tk_widget.identify_region(event.x, event.y) not in ("tree", "cell"):
+            return None
+        iid = self._tk_widget.identify_row(event.y)
+        if not iid:
+            return "break"
+        row = self._rows[self._offset + int(iid)]
+        if row in self._selected:
+            self._selected.remove(row)
+        else:
+            self._selected.add(row)
+        self._last_clicked = row
+        self._render()
+        self._tk_widget.event_generate("<<SelectionChanged>>")
+        return "break"
+
+
+class ScrollableText(Widget):
+    """ This class wraps the tk.Text class and tk.Scrollbar class as a read-only log view.
+
+    Only the last ``max_lines`` lines are kept, and the view follows new lines
+    as long as it is scrolled to the bottom.
     """
 
     _tk_scrollbar: ttk.Scrollbar
+    _max_lines: int
 
-    def __init__(self, parent: Widget, contents: Tuple[str], mode: str, pos: Pos = (0, 0, 0, 0), grid_opt: dict = {}) -> None:
+    def __init__(self, parent: Widget, height: int, pos: Pos = (0, 0, 0, 1), grid_opt: dict = {},
+                 max_lines: int = 1000) -> None:
         super().__init__(parent)
+        self._max_lines = max_lines
 
-        string_var = tk.StringVar(value=contents)  # type: ignore
-        self._tk_widget: tk.Listbox = tk.Listbox(parent.tk_widget, listvariable=string_var, selectmode=mode)
+        self._tk_widget: tk.Text = tk.Text(parent.tk_widget, height=height, wrap=tk.NONE, state=tk.DISABLED)
         self._tk_widget.grid(row=pos[0], column=pos[1], **grid_opt)  # type: ignore
 
         self._tk_scrollbar = ttk.Scrollbar(parent.tk_widget, orient=tk.VERTICAL, command=self._tk_widget.yview)
@@ -180,5 +410,15 @@ class ScrollableListbox(Widget):
     def tk_scrollbar(self) -> ttk.Scrollbar:
         return self._tk_scrollbar
 
-    def get_selected(self) -> Tuple[str]:
-        return tuple([self._tk_widget.get(i) for i in self._tk_widget.curselection()])
+    def append(self, lines: List[str]) -> None:
+        if not lines:
+            return
+        at_bottom = self._tk_widget.yview()[1] >= 1.0
+        self._tk_widget.configure(state=tk.NORMAL)
+        self._tk_widget.insert(tk.END, "\n".join(lines) + "\n")
+        excess = int(self._tk_widget.index("end-1c").split(".")[0]) - 1 - self._max_lines
+        if excess > 0:
+            self._tk_widget.delete("1.0", f"{excess + 1}.0")
+        self._tk_widget.configure(state=tk.DISABLED)
+        if at_bottom:
+            self._tk_widget.see(tk.END)
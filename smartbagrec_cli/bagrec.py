@@ -1,20 +1,155 @@
 #!/usr/bin/env python3
 
+import time
 
-from argparse import ArgumentParser
-from smartbagrec.contents import SmartBagRec
+_STARTUP_TIME = time.perf_counter()
+
+import sys  # noqa: E402
+from argparse import ArgumentParser  # noqa: E402
 
 
 def main() -> None:
     parser = ArgumentParser("bagrec command usage")
-    parser.add_argument("--profile", "-p", action="store_true",  help="Open profile selector directly")
+    parser.add_argument("--profile", "-p", nargs="?", const="", default=None, metavar="PATH",
+                        help="Open profile selector directly, or record with the profile at PATH")
+    parser.add_argument("--headless", action="store_true",
+                        help="Record with the profile given by --profile without opening any window")
+    parser.add_argument("--status-interval", type=float, default=5.0, metavar="SEC",
+                        help="Interval of the status lines printed in headless mode (Default: 5)")
+    parser.add_argument("--preflight", action="store_true",
+                        help="In headless mode, check the output disk first and do not record if it cannot keep up")
+    parser.add_argument("--apply-recommendation", action="store_true",
+                        help="In headless mode, write the recommended buffer size into the profile "
+                             "if messages were dropped")
+    parser.add_argument("--stop-timeout", type=float, default=10.0, metavar="SEC",
+                        help="In headless mode, how long the recorders may take to finalize their bag files "
+                             "when stopped before they are terminated (Default: 10)")
+    parser.add_argument("--telemetry", metavar="PATH",
+                        help="Append timing events of every recording (spawn, first bytes, samples, splits, "
+                             "overflows, stop) to the JSONL file PATH")
+    parser.add_argument("--prometheus-textfile", metavar="PATH",
+                        help="Write the metrics of every recording to PATH, a .prom file for the node exporter's "
+                             "textfile collector")
+    parser.add_argument("--telemetry-interval", type=float, default=1.0, metavar="SEC",
+                        help="Interval of the samples of --telemetry and --prometheus-textfile, at least 0.1 (Default: 1)")
+    parser.add_argument("--serve", action="store_true",
+                        help="Serve the control API for starting, stopping and querying recordings; "
+                             "with --headless without opening any window")
+    parser.add_argument("--socket", default=None, metavar="PATH",
+                        help="Unix socket of the control API (Default: ~/.config/smartbagrec/control.sock)")
+    parser.add_argument("--http-port", type=int, default=None, metavar="N",
+                        help="Also serve the control API over HTTP on 127.0.0.1:N, for clients holding the token "
+                             "in ~/.config/smartbagrec/control.token")
+    parser.add_argument("--send", metavar="JSON",
+                        help="Send a command to a running control API, print the answers and exit")
+    parser.add_argument("--repair", metavar="DIR",
+                        help="Reindex the .bag.active files left under DIR by a crash, renaming them to .bag, and exit")
+    parser.add_argument("--repair-workers", type=int, default=2, metavar="N",
+                        help="Number of rosbag reindex processes run at the same time by --repair (Default: 2)")
+    parser.add_argument("--offload", nargs=2, metavar=("SRC", "DEST"),
+                        help="Copy the finished bag files in SRC to DEST in verified chunks, resuming copies "
+                             "left unfinished, and exit")
+    parser.add_argument("--offload-rate", type=float, default=None, metavar="MBPS",
+                        help="Bandwidth cap of --offload in MB/s (Default: no limit)")
+    parser.add_argument("--delete-after-offload", action="store_true",
+                        help="Delete each file in SRC once its copy in DEST has been verified")
+    parser.add_argument("--verify", metavar="DIR",
+                        help="Check the bag files in DIR against its SHA256SUMS or XXH64SUMS manifest and exit")
+    parser.add_argument("--verify-workers", type=int, default=None, metavar="N",
+                        help="Number of files checked at the same time by --verify (Default: CPU count, at most 8)")
+    parser.add_argument("--manifest", metavar="DIR",
+                        help="Add the bag files in DIR that its manifest does not list yet to the manifest and exit")
+    parser.add_argument("--checksum-algorithm", choices=("sha256", "xxh64"), default="sha256",
+                        help="Algorithm of --manifest; xxh64 needs the xxhash package (Default: sha256)")
+    parser.add_argument("--info", nargs="+", metavar="PATH",
+                        help="Print the topics, message counts, time range and compression of bag files, "
+                             "or of the bag files in directories, and exit")
+    parser.add_argument("--list-profiles", action="store_true",
+                        help="Print the profiles in ~/.config/smartbagrec and exit")
     args = parser.parse_args()
 
-    if args.profile:
-        smart_bag_rec = SmartBagRec("SmartBagRec")
-        smart_bag_rec.open_profile()
+    telemetry = None
+    if args.telemetry or args.prometheus_textfile:
+        from smartbagrec.telemetry import TelemetrySettings
+        try:
+            telemetry = TelemetrySettings(args.telemetry, args.prometheus_textfile, args.telemetry_interval)
+        except ValueError as e:
+            parser.error(str(e))
+
+    if args.list_profiles:
+        from smartbagrec.profile import ProfileIndex
+        for summary in ProfileIndex().list():
+            print(f"{summary.path}\t{summary.topic_count} topics\t{summary.shard_count} processes\t"
+                  f"{summary.created}\t{summary.description}")
+        return
+
+    if args.info:
+        from smartbagrec.headless import print_bag_info
+        sys.exit(print_bag_info(args.info))
+
+    if args.verify is not None:
+        from smartbagrec.headless import verify_directory
+        sys.exit(verify_directory(args.verify, args.verify_workers, args.status_interval))
+
+    if args.manifest is not None:
+        from smartbagrec.checksum import ChecksumSettings
+        from smartbagrec.headless import manifest_directory
+        sys.exit(manifest_directory(args.manifest, ChecksumSettings(args.checksum_algorithm)))
+
+    if args.offload:
+        from smartbagrec.headless import offload_directory
+        from smartbagrec.offload import OffloadSettings
+        rate = args.offload_rate * 1024 ** 2 if args.offload_rate is not None else None
+        settings = OffloadSettings(args.offload[1], rate, None, args.delete_after_offload)
+        sys.exit(offload_directory(args.offload[0], settings, args.status_interval))
+
+    if args.send is not None:
+        import json
+        from smartbagrec.control import DEFAULT_SOCKET, send_command
+        try:
+            request = json.loads(args.send)
+        except ValueError as e:
+            parser.error(f"--send needs a JSON object: {e}")
+        ok = True
+        try:
+            for response in send_command(request, args.socket or DEFAULT_SOCKET):
+                print(json.dumps(response), flush=True)
+                ok = ok and bool(response.get("ok"))
+        except OSError as e:
+            print(f"[SmartBagRec] No control API on {args.socket or DEFAULT_SOCKET}: {e}")
+            sys.exit(2)
+        sys.exit(0 if ok else 1)
+
+    if args.repair is not None:
+        from smartbagrec.headless import repair_directory
+        sys.exit(repair_directory(args.repair, args.repair_workers, args.status_interval))
+
+    if args.headless and args.serve:
+        from smartbagrec.control import DEFAULT_SOCKET
+        from smartbagrec.headless import serve
+        sys.exit(serve(args.socket or DEFAULT_SOCKET, args.http_port, args.stop_timeout, telemetry))
+
+    if args.headless:
+        if not args.profile:
+            parser.error("--headless requires --profile PATH")
+        # imported here so that the headless path never loads tkinter
+        from smartbagrec.headless import record_profile
+        sys.exit(record_profile(args.profile, args.status_interval, args.preflight, args.apply_recommendation,
+                                args.stop_timeout, telemetry))
+
+    from smartbagrec.contents import SmartBagRec
+    smart_bag_rec = SmartBagRec("SmartBagRec", _STARTUP_TIME)
+    smart_bag_rec.manager.telemetry = telemetry
+    if args.serve:
+        from smartbagrec.control import DEFAULT_SOCKET
+        try:
+            smart_bag_rec.serve(args.socket or DEFAULT_SOCKET, args.http_port)
+        except OSError as e:
+            print(f"[SmartBagRec] Control API could not be started: {e}")
+    if args.profile is not None:
+        smart_bag_rec.open_profile(args.profile or None)
     else:
-        SmartBagRec("SmartBagRec")()
+        smart_bag_rec()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,70 @@
+import os
+
+from smartbagrec.output import OutputSpec
+from smartbagrec.retention import RetentionManager, RetentionPolicy
+
+STARTED = 1000.0
+
+
+def write_file(path, size, mtime):
+    with open(path, "wb") as f:
+        f.write(b"\0" * size)
+    os.utime(path, (mtime, mtime))
+
+
+def split_name(i, suffix=".bag"):
+    return f"rec_2026-01-01-00-00-00_{i}{suffix}"
+
+
+def recording(directory):
+    return [OutputSpec(str(directory), None, "rec", STARTED)]
+
+
+def test_refresh_counts_a_split_shrunk_by_post_processing(tmp_path):
+    for i in range(3):
+        write_file(str(tmp_path / split_name(i)), 1000, STARTED + i)
+    manager = RetentionManager(str(tmp_path), RetentionPolicy(max_bytes=3200), recording(tmp_path))
+    assert manager.enforce() == []
+
+    # compressed by the pipeline, which replaces the split with a smaller file of the same name
+    write_file(str(tmp_path / "split.tmp"), 100, STARTED + 3)
+    os.replace(str(tmp_path / "split.tmp"), str(tmp_path / split_name(2)))
+    manager.refresh(str(tmp_path / split_name(2)))
+    write_file(str(tmp_path / split_name(3)), 1000, STARTED + 4)
+
+    # 3100 bytes are within the budget; counting the split at its old size would evict the first one
+    assert manager.enforce() == []
+    assert sorted(os.listdir(str(tmp_path))) == [split_name(i) for i in range(4)]
+    assert manager.evicted == 0
+
+
+def test_enforce_evicts_the_oldest_finished_files(tmp_path):
+    for i in range(3):
+        write_file(str(tmp_path / split_name(i)), 1000, STARTED + i)
+    write_file(str(tmp_path / split_name(3, ".bag.active")), 1000, STARTED + 3)
+    manager = RetentionManager(str(tmp_path), RetentionPolicy(max_bytes=2500), recording(tmp_path))
+
+    assert manager.enforce() == [str(tmp_path / split_name(0)), str(tmp_path / split_name(1))]
+    assert manager.evicted_bytes == 2000
+    assert os.path.exists(str(tmp_path / split_name(3, ".bag.active")))
+
+
+def test_enforce_leaves_the_bag_files_of_others_alone(tmp_path):
+    unrelated = [
+        "other.bag",  # kept by the user
+        "rec_2026-01-01-00-00-00_0.orig.bag",  # a backup of rosbag compress
+        "rec_2025-12-31-00-00-00_0.bag",  # an earlier recording with the same prefix
+        "run_2026-01-01-00-00-00_0.bag",  # a recording running side by side
+    ]
+    for name in unrelated:
+        write_file(str(tmp_path / name), 1000, STARTED - 100)
+    write_file(str(tmp_path / "run_2026-01-01-00-00-00_1.bag.active"), 1000, STARTED + 1)
+    for i in range(2):
+        write_file(str(tmp_path / split_name(i)), 1000, STARTED + i)
+    manager = RetentionManager(str(tmp_path), RetentionPolicy(max_bytes=1500), recording(tmp_path))
+
+    # only the two splits of this recording count towards the budget, and only they are deleted
+    assert manager.enforce() == [str(tmp_path / split_name(0))]
+    for name in unrelated:
+        assert os.path.exists(str(tmp_path / name))
+    assert manager.enforce() == []